@@ -0,0 +1,240 @@
+"""
+Компактное представление диалога для конвейера анализа (struct-of-arrays).
+
+Вместо списка словарей {sender, text, time} диалог хранится колонками:
+    sender_ids  — int32, номер отправителя в self.senders (-1 — без отправителя)
+    times       — int64, секунды Unix (NO_TIME — время не задано или не разобрано)
+    text_buffer — все тексты одним UTF-8 буфером
+    offsets     — int64[n + 1], границы текстов в буфере (байты)
+    char_offsets — int64[n + 1], те же границы в символах
+    results     — по-сообщенческие результаты этапов (NumPy-массивы длины n)
+
+Адаптеры from_json / to_json переводят из формата MainAnalyzer и обратно,
+from_messages строит хранилище из потока сообщений (например, из
+prepare_data.formalizer.iter_telegram_messages) без промежуточного списка.
+"""
+from array import array
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+NO_TIME = np.iinfo(np.int64).min
+TEXT_BLOCK = 65536  # сообщений на один блок декодирования при полном обходе
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+def to_epoch(value: Any) -> int:
+    """
+    Время в секундах Unix: число возвращается как есть, строка ISO 8601
+    разбирается (время без часового пояса считается UTC, как и в DialogStore.times).
+    """
+    if isinstance(value, (int, float)):
+        return int(value)
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        return int(dt.timestamp())
+    return (dt - _EPOCH) // _SECOND
+
+
+class _TimeCodec:
+    """
+    Разбор строк времени в секунды и обратно без потерь.
+
+    Формат вывода (разделитель даты и времени, точность) берётся с первой
+    разобранной строки; строки, которые в этом формате не восстанавливаются
+    один в один (часовой пояс, доли секунды, другой формат), запоминаются
+    как есть в exceptions.
+    """
+
+    def __init__(self):
+        self.sep = " "
+        self.timespec = None  # определяется по первой строке
+        self.exceptions: Dict[int, Any] = {}
+        # Соседние сообщения часто с одинаковым временем (точность до минуты)
+        self._last = (None, NO_TIME, False)
+
+    def _detect(self, raw: str):
+        self.sep = raw[10] if len(raw) > 10 and raw[10] in " T" else " "
+        self.timespec = {16: "minutes", 19: "seconds"}.get(len(raw), "seconds")
+
+    def format(self, seconds: int) -> str:
+        return (_EPOCH + timedelta(seconds=seconds)).isoformat(self.sep, self.timespec or "seconds")
+
+    def encode(self, index: int, raw: Any) -> int:
+        if raw is None:
+            return NO_TIME
+        if raw == self._last[0]:
+            if self._last[2]:
+                self.exceptions[index] = raw
+            return self._last[1]
+        seconds = self._encode(index, raw)
+        self._last = (raw, seconds, index in self.exceptions)
+        return seconds
+
+    def _encode(self, index: int, raw: Any) -> int:
+        if not isinstance(raw, str):
+            self.exceptions[index] = raw
+            return NO_TIME
+        try:
+            dt = datetime.fromisoformat(raw)
+        except ValueError:
+            self.exceptions[index] = raw
+            return NO_TIME
+        if dt.tzinfo is not None:
+            self.exceptions[index] = raw
+            return int(dt.timestamp())
+        seconds = (dt - _EPOCH) // _SECOND
+        if self.timespec is None:
+            self._detect(raw)
+        if self.format(seconds) != raw:
+            self.exceptions[index] = raw
+        return seconds
+
+
+class DialogStore:
+    """
+    Диалог в колоночном виде.
+
+    Атрибуты:
+        dialog_id: Идентификатор диалога.
+        title (str or None): Название диалога.
+        senders (list[str]): Интернированные имена отправителей (по порядку появления).
+        sender_ids (np.ndarray): int32[n], номер отправителя или -1.
+        times (np.ndarray): int64[n], время сообщения в секундах Unix или NO_TIME.
+        text_buffer (bytes): Тексты всех сообщений подряд в UTF-8.
+        offsets (np.ndarray): int64[n + 1], границы текстов в text_buffer (в байтах).
+        char_offsets (np.ndarray): int64[n + 1], те же границы в символах.
+        results (dict[str, np.ndarray]): По-сообщенческие результаты этапов анализа.
+        result_labels (dict[str, list[str]]): Названия колонок/битов для результатов.
+    """
+
+    def __init__(self, dialog_id=None, title=None, senders=None, sender_ids=None, times=None,
+                 text_buffer: bytes = b"", offsets=None, char_offsets=None,
+                 time_codec: Optional[_TimeCodec] = None):
+        self.dialog_id = dialog_id
+        self.title = title
+        self.senders: List[str] = list(senders or [])
+        self.sender_ids = np.asarray(sender_ids if sender_ids is not None else [], dtype=np.int32)
+        self.times = np.asarray(times if times is not None else [], dtype=np.int64)
+        self.text_buffer = text_buffer
+        self.offsets = np.asarray(offsets if offsets is not None else [0], dtype=np.int64)
+        self.char_offsets = np.asarray(char_offsets if char_offsets is not None else [0], dtype=np.int64)
+        self._time_codec = time_codec or _TimeCodec()
+        self.results: Dict[str, np.ndarray] = {}
+        self.result_labels: Dict[str, List[str]] = {}
+
+    # ---------------------- АДАПТЕРЫ ----------------------
+    @classmethod
+    def from_messages(cls, messages: Iterable[Dict[str, Any]], dialog_id=None, title=None) -> "DialogStore":
+        """Строит хранилище из итерируемого набора сообщений {sender, text, time}."""
+        sender_index: Dict[str, int] = {}
+        senders: List[str] = []
+        sender_ids = array("i")
+        times = array("q")
+        offsets = array("q", [0])
+        char_offsets = array("q", [0])
+        chars = 0
+        buffer = bytearray()
+        codec = _TimeCodec()
+
+        for i, msg in enumerate(messages):
+            sender = msg.get("sender")
+            if sender:
+                sid = sender_index.get(sender)
+                if sid is None:
+                    sid = sender_index[sender] = len(senders)
+                    senders.append(sender)
+                sender_ids.append(sid)
+            else:
+                sender_ids.append(-1)
+
+            text = msg.get("text")
+            if isinstance(text, str):
+                buffer += text.encode("utf-8")
+                chars += len(text)
+            offsets.append(len(buffer))
+            char_offsets.append(chars)
+            times.append(codec.encode(i, msg.get("time")))
+
+        return cls(dialog_id, title, senders,
+                   np.frombuffer(sender_ids, dtype=np.int32).copy(),
+                   np.frombuffer(times, dtype=np.int64).copy(),
+                   bytes(buffer),
+                   np.frombuffer(offsets, dtype=np.int64).copy(),
+                   np.frombuffer(char_offsets, dtype=np.int64).copy(),
+                   codec)
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "DialogStore":
+        """Из формата MainAnalyzer: {'dialog_id', 'title', 'messages': [...]}."""
+        return cls.from_messages(data.get("messages") or [],
+                                 dialog_id=data.get("dialog_id") or data.get("id"),
+                                 title=data.get("title"))
+
+    def to_json(self) -> Dict[str, Any]:
+        """Обратно в формат MainAnalyzer (лишние поля сообщений не сохраняются)."""
+        return {"dialog_id": self.dialog_id, "title": self.title, "messages": list(self.iter_messages())}
+
+    # ---------------------- ДОСТУП ----------------------
+    def __len__(self) -> int:
+        return len(self.sender_ids)
+
+    def text(self, i: int) -> str:
+        return self.text_buffer[int(self.offsets[i]):int(self.offsets[i + 1])].decode("utf-8")
+
+    def iter_texts(self, indices: Optional[np.ndarray] = None) -> Iterator[str]:
+        """Тексты сообщений (всех или по массиву индексов) по порядку."""
+        buf = self.text_buffer
+        if indices is None:
+            # Весь диалог: декодируем блоками и режем строку по символьным границам
+            for a in range(0, len(self), TEXT_BLOCK):
+                b = min(a + TEXT_BLOCK, len(self))
+                block = buf[int(self.offsets[a]):int(self.offsets[b])].decode("utf-8")
+                bounds = (self.char_offsets[a:b + 1] - self.char_offsets[a]).tolist()
+                for start, end in zip(bounds, bounds[1:]):
+                    yield block[start:end]
+            return
+        indices = np.asarray(indices, dtype=np.int64)
+        for start, end in zip(self.offsets[indices].tolist(), self.offsets[indices + 1].tolist()):
+            yield buf[start:end].decode("utf-8")
+
+    def sender(self, i: int) -> Optional[str]:
+        sid = int(self.sender_ids[i])
+        return self.senders[sid] if sid >= 0 else None
+
+    def iter_senders(self) -> Iterator[Optional[str]]:
+        names = self.senders + [None]  # индекс -1 → None
+        for sid in self.sender_ids.tolist():
+            yield names[sid]
+
+    def time_str(self, i: int) -> Any:
+        """Время сообщения в исходном строковом виде."""
+        if i in self._time_codec.exceptions:
+            return self._time_codec.exceptions[i]
+        seconds = int(self.times[i])
+        return None if seconds == NO_TIME else self._time_codec.format(seconds)
+
+    def iter_messages(self) -> Iterator[Dict[str, Any]]:
+        for i, (sender, text) in enumerate(zip(self.iter_senders(), self.iter_texts())):
+            yield {"sender": sender, "text": text, "time": self.time_str(i)}
+
+    def sender_groups(self) -> Dict[str, np.ndarray]:
+        """Имя отправителя → индексы его сообщений (по порядку); без отправителя — пропускаются."""
+        order = np.argsort(self.sender_ids, kind="stable")
+        counts = np.bincount(self.sender_ids[self.sender_ids >= 0], minlength=len(self.senders))
+        skip = int(np.count_nonzero(self.sender_ids < 0))
+        groups, start = {}, skip
+        for sid, count in enumerate(counts.tolist()):
+            if count:
+                groups[self.senders[sid]] = order[start:start + count]
+            start += count
+        return groups
+
+    def nbytes(self) -> int:
+        """Примерный объём памяти колонок и результатов."""
+        return (self.sender_ids.nbytes + self.times.nbytes + self.offsets.nbytes + self.char_offsets.nbytes
+                + len(self.text_buffer)
+                + sum(len(s.encode("utf-8")) for s in self.senders)
+                + sum(a.nbytes for a in self.results.values()))
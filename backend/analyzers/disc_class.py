@@ -1,3 +1,6 @@
+import metrics
+
+
 class DISCAnalyze():
     """
     Класс для анализа поведенческого профиля по модели DISC 
@@ -116,46 +119,58 @@ class DISCAnalyze():
     
 
     # --------------------- TEXT ---------------------------
-    def _disc_analyze_text(self):
+    def score_text(self, text):
         """
-        Анализирует cleaned_text на наличие ключевых слов и символов, 
-        характерных для каждого из типов DISC, и рассчитывает соответствующие баллы.
-        
-        Учитывает:
-          - ключевые слова для D, I, S, C;
-          - наличие восклицательных знаков и эмодзи (бонус для типа I);
-          - наличие вопросительных знаков (бонус для типа C).
-        
+        Баллы D, I, S, C для произвольного очищенного текста — по тем же
+        правилам, что и _disc_analyze_text (используется и для отдельных
+        сообщений, например, во временной шкале).
+
         Returns:
-            list[str]: Список из одного доминирующего DISC-типа (например: ['I']).
+            dict[str, float]: Баллы по типам DISC.
         """
         scores = {"D": 0, "I": 0, "S": 0, "C": 0}
 
         # Считаем совпадения
         for word in self._d_keywords:
-            if word in self.cleaned_text:
+            if word in text:
                 scores["D"] += 1
         
         for word in self._i_keywords:
-            if word in self.cleaned_text:
+            if word in text:
                 scores["I"] += 1
         # Эмодзи и восклицания дают бонус для I (вне цикла по словам!)
-        if "!" in self.cleaned_text:
-            scores["I"] += self.cleaned_text.count("!") * 0.5
-        if "😊" in self.cleaned_text or "😂" in self.cleaned_text:
+        if "!" in text:
+            scores["I"] += text.count("!") * 0.5
+        if "😊" in text or "😂" in text:
             scores["I"] += 2
         
         for word in self._s_keywords:
-            if word in self.cleaned_text:
+            if word in text:
                 scores["S"] += 1
         
         for word in self._c_keywords:
-            if word in self.cleaned_text:
+            if word in text:
                 scores["C"] += 1
         # Вопросы дают бонус для C
-        if "?" in self.cleaned_text:
-            scores["C"] += self.cleaned_text.count("?") * 0.5
+        if "?" in text:
+            scores["C"] += text.count("?") * 0.5
+        return scores
+
+    @metrics.timed("disc_keywords")
+    def _disc_analyze_text(self):
+        """
+        Анализирует cleaned_text на наличие ключевых слов и символов, 
+        характерных для каждого из типов DISC, и рассчитывает соответствующие баллы.
         
+        Учитывает:
+          - ключевые слова для D, I, S, C;
+          - наличие восклицательных знаков и эмодзи (бонус для типа I);
+          - наличие вопросительных знаков (бонус для типа C).
+        
+        Returns:
+            list[str]: Список из одного доминирующего DISC-типа (например: ['I']).
+        """
+        scores = self.score_text(self.cleaned_text)
         dominant = sorted(scores, key=scores.get, reverse=True)[:2]
         return dominant
 
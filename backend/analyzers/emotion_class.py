@@ -1,34 +1,75 @@
-from transformers import pipeline, AutoModelForSequenceClassification, AutoTokenizer
-import json, os, re, statistics
-from collections import defaultdict
+import json, os, re, time
+import numpy as np
+from analyzers.dialog_store import DialogStore
 from analyzers.disc_class import DISCAnalyze
 from analyzers.topic_class import TopicAnalyzer
+from analyzers.timeline import DISC_TYPES, Timeline
+from analyzers.pipeline import Stage, StageGraph
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from storage.result_cache import ResultCache, file_version, version_hash
+import metrics
+import thread_budget
+from model.backends import GenerationFailed
+from model.registry import ModelProxy, registry
 
+model_name = "cardiffnlp/twitter-xlm-roberta-base-sentiment"
+EMOTION_LABELS = ("negative", "neutral", "positive")
+EMOTION_MODEL_SIZE_MB = 1100  # XLM-R base в float32 вместе с токенизатором
 
-from transformers import (
-    XLMRobertaTokenizer,
-    XLMRobertaForSequenceClassification,
-    pipeline
-)
 
-print("📥 Загружаем модель эмоций...")
-model_name = "cardiffnlp/twitter-xlm-roberta-base-sentiment"
+def _build_emotion_model():
+    # transformers импортируем здесь: с заглушкой модели он не нужен
+    from transformers import (
+        XLMRobertaTokenizer,
+        XLMRobertaForSequenceClassification,
+        pipeline
+    )
+
+    print("📥 Загружаем модель эмоций...")
+    thread_budget.current().apply_torch()
+    # Явно используем slow-токенизатор без конвертации
+    tokenizer = XLMRobertaTokenizer.from_pretrained(model_name, use_fast=False)
+    model = XLMRobertaForSequenceClassification.from_pretrained(model_name)
+
+    return pipeline(
+        "text-classification",
+        model=model,
+        tokenizer=tokenizer,
+        return_all_scores=True,
+        top_k=None
+    )
+
+
+registry.register("emotion", _build_emotion_model, size_mb=EMOTION_MODEL_SIZE_MB,
+                  attributes={"version": model_name})
 
-# Явно используем slow-токенизатор без конвертации
-tokenizer = XLMRobertaTokenizer.from_pretrained(model_name, use_fast=False)
-model = XLMRobertaForSequenceClassification.from_pretrained(model_name)
 
-emotion_model = pipeline(
-    "text-classification",
-    model=model,
-    tokenizer=tokenizer,
-    return_all_scores=True,
-    top_k=None
-)
+def load_emotion_model():
+    """
+    Модель эмоций из реестра моделей (model/registry.py): прокси, который
+    загружает pipeline при первом вызове и отпускает его между вызовами,
+    так что при нехватке памяти модель может быть выгружена.
+    """
+    return registry.proxy("emotion")
+
+ANALYZERS_DIR = os.path.dirname(os.path.abspath(__file__))
+# Словари DISC и тем живут в коде анализаторов — их версия = хеш исходников
+LEXICON_VERSION = file_version(*(os.path.join(ANALYZERS_DIR, f)
+                                 for f in ("emotion_class.py", "disc_class.py", "topic_class.py")))
+
 
 class MainAnalyzer():
-    def __init__(self):
+    def __init__(self, emotion_model=None, result_cache=None):
+        # Модель можно передать явно (общая на несколько анализаторов или заглушка)
+        self.emotion_model = emotion_model if emotion_model is not None else load_emotion_model()
+        # ResultCache: повторный анализ того же диалога без работы моделей; None — выключен
+        self.result_cache = result_cache
         self.dominant_emotion = None
+        self.stage_report = None
+        self.timeline = None
+        self.store = None
+        self._executor = None
         self.sender_clean_text = {}
         self.sender_disc_analyze = {}
 
@@ -39,6 +80,7 @@ class MainAnalyzer():
             "C": "Аналитичный, точный, системный"
         }
 
+    @metrics.timed("clean_text")
     def _clean_text(self, text):
         if not isinstance(text, str):
             return ""
@@ -49,8 +91,9 @@ class MainAnalyzer():
 
 
     # --------------------- EMOTIONS ---------------------------
+    @metrics.timed("emotion_inference")
     def _get_emotion(self, text):
-        preds = emotion_model(text)[0]
+        preds = self.emotion_model(text)[0]
         result = {"negative": 0.0, "neutral": 0.0, "positive": 0.0}
         for p in preds:
             label = p["label"].lower()
@@ -63,149 +106,348 @@ class MainAnalyzer():
         return result
 
 
-    def _emotions_analyze(self, data):
-        batch_size = 50
-
-        def analyze_participant(sender, messages):
-            # Группируем сообщения по батчам
-            batches = [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
-
-            # Объединяем результаты по всем батчам
-            all_emotions = defaultdict(list)
-            total_messages_count = 0
-            all_messages_out = []
-
-            for batch in batches:
-                cleaned_messages = []
-                texts = []
-
-                for msg in batch:
-                    raw_text = msg.get("text")
-                    if not raw_text:
-                        continue
-                    clean = self._clean_text(raw_text)
-                    if not clean:
-                        continue
-                    cleaned_messages.append((msg, clean))
-                    texts.append(clean)
-
-                if not texts:
+    def _analyze_participant_emotions(self, store, indices, batch_size=50, sender=None,
+                                      message_sink=None):
+        """
+        Эмоции одного участника: медианы по сообщениям и доминирующая эмоция.
+
+        store — DialogStore, indices — номера сообщений участника. Оценки
+        каждого сообщения записываются в store.results['emotion_scores'].
+        Если передан message_sink, после каждого батча он получает список
+        строк по сообщениям (index, sender, time, text, emotion_scores) —
+        так результаты можно писать на диск по мере готовности.
+        """
+        scores = store.results["emotion_scores"]
+        values = np.empty((len(indices), 3))
+        total_messages_count = 0
+
+        # Сообщения обрабатываются батчами
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start:start + batch_size]
+            batch_out = []
+
+            for i, raw_text in zip(batch.tolist(), store.iter_texts(batch)):
+                if not raw_text:
                     continue
+                clean = self._clean_text(raw_text)
+                if not clean:
+                    continue
+
+                e = self._get_emotion(clean)
+                row = (e["negative"], e["neutral"], e["positive"])
+                scores[i] = row
+                values[total_messages_count] = row
+                total_messages_count += 1
+                if message_sink is not None:
+                    batch_out.append({"index": i, "sender": sender, "text": raw_text,
+                                      "time": store.time_str(i), "emotion_scores": e})
 
-                # Анализ эмоций для батча
-                for orig_msg, clean_txt in cleaned_messages:
-                    e = self._get_emotion(clean_txt)
-                    for k, v in e.items():
-                        all_emotions[k].append(v)
-                    all_messages_out.append({
-                        "text": orig_msg["text"],
-                        "time": orig_msg.get("time"),
-                        "emotion_scores": e
-                    })
-
-                total_messages_count += len(cleaned_messages)
-
-            if not all_emotions:
-                return {
-                    "messages_count": 0,
-                    "emotions_median": {"negative": 0.0, "neutral": 0.0, "positive": 0.0},
-                    "topics": [],
-                    #"messages": []
-                }
-
-            # Объединяем медианы по всем батчам
-            emotions_median = {k: round(statistics.median(vs), 3) for k, vs in all_emotions.items()}
-            for k in ["negative", "neutral", "positive"]:
-                emotions_median.setdefault(k, 0.0)
-
-            sort = sorted(emotions_median, key=emotions_median.get, reverse=True)
-            if sort[0] == "neutral":
-                dominant_emotion = sort[1] if len(sort) > 1 else sort[0]
-            else:
-                dominant_emotion = sort[0]
+            if batch_out:
+                message_sink(batch_out)
 
+        if not total_messages_count:
             return {
-                "messages_count": total_messages_count,
-                "dominant_emotion": dominant_emotion,
-                "emotions_median": emotions_median,
-                "text_dominant": self.sender_disc_analyze[sender]["text_dominant"],
-                "test_dominant": self.sender_disc_analyze[sender]["test_dominant"],
-                "type_descriptions": self.type_descriptions,
-                # "messages": all_messages_out
+                "messages_count": 0,
+                "emotions_median": {"negative": 0.0, "neutral": 0.0, "positive": 0.0},
+                "topics": [],
+                #"messages": []
             }
 
-        messages = data.get("messages", [])
-        if not messages:
-            return {"dialog_id": data.get("dialog_id") or data.get("id"), "error": "Пустой диалог"}
+        # Медианы по всем сообщениям участника
+        medians = np.median(values[:total_messages_count], axis=0).tolist()
+        emotions_median = {k: round(v, 3) for k, v in zip(EMOTION_LABELS, medians)}
 
-        # Группируем по отправителям
-        grouped = {}
-        for msg in messages:
-            sender = msg.get("sender")
-            if sender:
-                grouped.setdefault(sender, []).append(msg)
+        sort = sorted(emotions_median, key=emotions_median.get, reverse=True)
+        if sort[0] == "neutral":
+            dominant_emotion = sort[1] if len(sort) > 1 else sort[0]
+        else:
+            dominant_emotion = sort[0]
 
-        # Получаем отправителей
-        keys = list(grouped.keys())
+        return {
+            "messages_count": total_messages_count,
+            "dominant_emotion": dominant_emotion,
+            "emotions_median": emotions_median,
+            # "messages": all_messages_out
+        }
+
+    # --------------------- STAGES ---------------------------
+    def _normalize_stage(self, data):
+        """
+        Приводит диалог к DialogStore и группирует сообщения по отправителям.
+
+        Returns:
+            dict: 'store' (DialogStore), 'grouped' (имя → индексы сообщений),
+                  'senders' (имена по порядку появления).
+        """
+        store = data if isinstance(data, DialogStore) else DialogStore.from_json(data)
+        grouped = store.sender_groups()
+        return {"store": store, "grouped": grouped, "senders": list(grouped)}
+
+    def _emotion_stage(self, normalize, message_sink=None):
+        """Эмоции всех участников (этап, зависящий от модели)."""
+        store = normalize["store"]
+        # NaN — сообщение без текста или без отправителя
+        store.results["emotion_scores"] = np.full((len(store), 3), np.nan, dtype=np.float32)
+        store.result_labels["emotion_scores"] = list(EMOTION_LABELS)
+        participants_data = {}
+        for sender, indices in normalize["grouped"].items():
+            try:
+                participants_data[sender] = self._analyze_participant_emotions(
+                    store, indices, sender=sender, message_sink=message_sink)
+            except Exception as e:
+                participants_data[sender] = {"error": str(e)}
+        return participants_data
 
-        # Очищаем текст каждого участника диалога
-        for sender in keys:
-            text = grouped[sender]
+    def _disc_stage(self, normalize):
+        """DISC-профиль каждого участника по склеенному очищенному тексту."""
+        sender_clean_text, sender_disc = {}, {}
+        for sender, indices in normalize["grouped"].items():
             # Склеиваем все сообщения участника в один текст
-            full_text = " ".join(msg.get("text", "") for msg in text if msg.get("text"))
+            full_text = " ".join(t for t in normalize["store"].iter_texts(indices) if t)
             cleaned = self._clean_text(full_text)
-            self.sender_clean_text[sender] = cleaned
+            sender_clean_text[sender] = cleaned
 
             disc_sender_analyzer = DISCAnalyze(cleaned)
             text_dominant, test_dominant = disc_sender_analyzer.analyze(1)
 
-            self.sender_disc_analyze[sender] = {"text_dominant": text_dominant, "test_dominant": test_dominant}
+            sender_disc[sender] = {"text_dominant": text_dominant, "test_dominant": test_dominant}
+        self.sender_clean_text = sender_clean_text
+        self.sender_disc_analyze = sender_disc
+        return sender_disc
+
+    def _disc_messages_stage(self, normalize):
+        """Баллы DISC каждого сообщения — для временной шкалы (store.results['disc_scores'])."""
+        store = normalize["store"]
+        scorer = DISCAnalyze("")
+        scores = np.zeros((len(store), len(DISC_TYPES)), dtype=np.float32)
+        for i, text in enumerate(store.iter_texts()):
+            if text:
+                msg_scores = scorer.score_text(self._clean_text(text))
+                scores[i] = [msg_scores[t] for t in DISC_TYPES]
+        store.results["disc_scores"] = scores
+        store.result_labels["disc_scores"] = list(DISC_TYPES)
+        return scores
+
+    def _timeline_stage(self, normalize, bucket):
+        """Временная шкала по уже посчитанным результатам сообщений."""
+        return Timeline.build(normalize["store"], bucket)
+
+    def _topics_stage(self, normalize):
+        """Темы диалога и интересы участников."""
+        return TopicAnalyzer().analyze(
+            messages=normalize["store"],
+            participants=normalize["senders"]
+        )
 
-        participants_data = {}
-        for sender, msgs in grouped.items():
-            try:
-                participants_data[sender] = analyze_participant(sender, msgs)
-            except Exception as e:
-                participants_data[sender] = {"error": str(e)}
+    def _merge_stage(self, store, emotion, disc, topics):
+        """Объединяет эмоции, DISC и темы в итоговый результат анализа."""
+        combined_result = {
+            "dialog_id": store.dialog_id,
+            "title": store.title,
+            "total_messages_analyzed": topics["total_messages_analyzed"],
+            "dominant_topics": topics["dominant_topics"],
+            #"topic_transitions": topics["topic_transitions"],
+            "participants_analysis": {}
+        }
 
-        return {
-            "dialog_id": data.get("dialog_id") or data.get("id"),
-            "title": data.get("title"),
-            "participants_analysis": participants_data
-        }, keys
+        for sender, emotion_data in emotion.items():
+            participant = dict(emotion_data)
+            # DISC добавляется только к успешно посчитанным эмоциям
+            if "dominant_emotion" in participant:
+                participant.update({
+                    "text_dominant": disc[sender]["text_dominant"],
+                    "test_dominant": disc[sender]["test_dominant"],
+                    "type_descriptions": self.type_descriptions,
+                })
+            # Обогащаем анализ каждого участника тематической информацией
+            participant["topic_interests"] = topics["participant_interests"].get(sender, {})
+            combined_result["participants_analysis"][sender] = participant
 
-    #---------------------------- MAIN ANALYZER ------------------------------
-    def analyze(self, data):
-        """Полный анализ диалога: темы, эмоции, DISC-профили участников."""
-        # Анализ эмоций и DISC
-        emotions_disc_result, senders = self._emotions_analyze(data)
-        # Анализ тем
-        topics_result = TopicAnalyzer().analyze(
-            messages=data.get("messages", []),
-            participants=senders
-        )
+        return combined_result
 
-        # Если в emotions_disc_result есть ошибка — возвращаем её
-        if "error" in emotions_disc_result:
-            return emotions_disc_result
+    def _emotions_analyze(self, data):
+        """Эмоции и DISC без тем — последовательно, как раньше."""
+        normalize = self._normalize_stage(data)
+        store = normalize["store"]
+        if not len(store):
+            return {"dialog_id": store.dialog_id, "error": "Пустой диалог"}, []
 
-        # Объединяем результаты
-        combined_result = {
-            "dialog_id": emotions_disc_result["dialog_id"],
-            "title": emotions_disc_result.get("title"),
-            "total_messages_analyzed": topics_result["total_messages_analyzed"],
-            "dominant_topics": topics_result["dominant_topics"],
-            #"topic_transitions": topics_result["topic_transitions"],
-            "participants_analysis": {}
+        disc = self._disc_stage(normalize)
+        participants_data = {}
+        for sender, emotion_data in self._emotion_stage(normalize).items():
+            participants_data[sender] = dict(emotion_data)
+            if "dominant_emotion" in emotion_data:
+                participants_data[sender].update({**disc[sender], "type_descriptions": self.type_descriptions})
+
+        return {
+            "dialog_id": store.dialog_id,
+            "title": store.title,
+            "participants_analysis": participants_data
+        }, normalize["senders"]
+
+    def _build_graph(self, data, advisor=None, message_sink=None, timeline=None, summarize=False):
+        """
+        normalize → {emotion, disc, topics} → merge [→ retrieval → generation]
+        [+ timeline] [+ summary → generation].
+        """
+        stages = [
+            Stage("normalize", lambda: self._normalize_stage(data)),
+            Stage("emotion", lambda normalize: self._emotion_stage(normalize, message_sink), ["normalize"]),
+            Stage("disc", self._disc_stage, ["normalize"]),
+            Stage("topics", self._topics_stage, ["normalize"]),
+            Stage("merge",
+                  lambda normalize, emotion, disc, topics: self._merge_stage(normalize["store"], emotion,
+                                                                             disc, topics),
+                  ["normalize", "emotion", "disc", "topics"]),
+        ]
+        if timeline is not None:
+            stages += [
+                Stage("disc_messages", self._disc_messages_stage, ["normalize"]),
+                Stage("timeline",
+                      lambda normalize, emotion, topics, disc_messages: self._timeline_stage(normalize, timeline),
+                      ["normalize", "emotion", "topics", "disc_messages"]),
+            ]
+        if advisor is not None and summarize:
+            stages += [
+                # Краткое содержание переписки идёт параллельно эмоциям и DISC
+                Stage("summary", lambda normalize, topics: advisor.summarize_dialog(normalize["store"]),
+                      ["normalize", "topics"]),
+                Stage("retrieval", lambda merge: advisor.retrieve(merge), ["merge"]),
+                Stage("generation",
+                      lambda merge, retrieval, summary: advisor.generate_from_retrieved(merge, *retrieval,
+                                                                                         digest=summary),
+                      ["merge", "retrieval", "summary"]),
+            ]
+        elif advisor is not None:
+            stages += [
+                Stage("retrieval", lambda merge: advisor.retrieve(merge), ["merge"]),
+                Stage("generation",
+                      lambda merge, retrieval: advisor.generate_from_retrieved(merge, *retrieval),
+                      ["merge", "retrieval"]),
+            ]
+        return StageGraph(stages)
+
+    def versions(self):
+        """Версии компонентов, от которых зависит результат анализа (для ключа кэша)."""
+        if isinstance(self.emotion_model, ModelProxy):
+            # Версия из реестра — ключ кэша считается без загрузки модели
+            emotion_version = self.emotion_model.version
+        else:
+            config = getattr(getattr(self.emotion_model, "model", None), "config", None)
+            emotion_version = getattr(config, "_name_or_path", None) or type(self.emotion_model).__name__
+        return {
+            "emotion_model": emotion_version,
+            "lexicons": LEXICON_VERSION,
         }
 
-        # Обогащаем анализ каждого участника тематической информацией
-        for sender, emotion_disc_data in emotions_disc_result["participants_analysis"].items():
-            participant_topics = topics_result["participant_interests"].get(sender, {})
-            combined_result["participants_analysis"][sender] = {
-                **emotion_disc_data,  # эмоции, DISC и сообщения
-                "topic_interests": participant_topics  # добавляем темы
-            }
+    def _analyze_cached(self, data, advisor):
+        """Анализ через ResultCache: полный хит, хит без совета или полный пересчёт."""
+        key = ResultCache.make_key(data, self.versions())
+        advice_version = version_hash(advisor.versions()) if advisor is not None else None
+        entry = self.result_cache.get(key)
+
+        if entry is not None:
+            result = entry["result"]
+            if advisor is None:
+                metrics.inc("result_cache_hits")
+                self.stage_report = {"cache": "hit"}
+                return result
+            if advice_version in entry["advice"]:
+                metrics.inc("result_cache_hits")
+                self.stage_report = {"cache": "hit"}
+                return {**result, "advice": entry["advice"][advice_version]}
+            # Анализ уже есть, совета для этой версии советчика — нет
+            metrics.inc("result_cache_partial_hits")
+            start = time.perf_counter()
+            advice = advisor.generate_advice(result)
+            self.stage_report = {"cache": "advice_only", "total_s": round(time.perf_counter() - start, 4)}
+            if not isinstance(advice, GenerationFailed):
+                self.result_cache.put(key, result, {**entry["advice"], advice_version: advice})
+            return {**result, "advice": advice}
+
+        metrics.inc("result_cache_misses")
+        result = self._analyze_graph(data, advisor)
+        advice = None
+        if advisor is not None and not isinstance(result["advice"], GenerationFailed):
+            advice = {advice_version: result["advice"]}
+        # Неудачный совет не сохраняем: анализ закэширован, совет сгенерируется заново
+        self.result_cache.put(key, result, advice)
+        return result
 
+    def close(self):
+        """Останавливает пул потоков графа; анализатор можно использовать снова."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _analyze_graph(self, data, advisor=None, message_sink=None, timeline=None, keep_store=False,
+                       summarize=False):
+        if self._executor is None:
+            # Пик tracemalloc общий на процесс: при замере памяти этапы идут по одному
+            workers = 1 if metrics.memory_tracking() else 4
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analyze")
+
+        metrics.inc("dialogs_analyzed")
+        metrics.inc("messages_analyzed", len(data) if isinstance(data, DialogStore) else len(data["messages"]))
+        # Модель из реестра держим на весь анализ: между батчами её нельзя выгрузить
+        hold = self.emotion_model.hold() if isinstance(self.emotion_model, ModelProxy) else nullcontext()
+        with hold:
+            results, self.stage_report = self._build_graph(data, advisor, message_sink, timeline,
+                                                           summarize).run(self._executor)
+        self.timeline = results.get("timeline")
+        if keep_store:
+            self.store = results["normalize"]["store"]
+        combined_result = results["merge"]
+        if advisor is not None:
+            combined_result["advice"] = results["generation"]
+        if "summary" in results:
+            combined_result["dialog_summary"] = results["summary"]
         return combined_result
 
+    #---------------------------- MAIN ANALYZER ------------------------------
+    def analyze(self, data, advisor=None, message_sink=None, use_cache=True, timeline=None, keep_store=False,
+                summarize=False):
+        """
+        Полный анализ диалога: темы, эмоции, DISC-профили участников.
+
+        data — диалог в формате JSON ({'dialog_id', 'title', 'messages'})
+        или уже готовый DialogStore.
+
+        Этапы выполняются графом на пуле потоков: эмоции, DISC и темы
+        считаются параллельно. Если передан advisor (RAGPsychologyAdvisor),
+        в граф добавляются извлечение фактов и генерация, а совет
+        записывается в поле 'advice'. message_sink получает построчные
+        результаты по сообщениям по мере готовности батчей. Время этапов
+        и критический путь сохраняются в self.stage_report.
+
+        Если задан self.result_cache и use_cache=True, повторный анализ того
+        же диалога (и тех же версий моделей) берётся из кэша. С message_sink
+        кэш не используется: построчные результаты нужно посчитать заново.
+
+        timeline ('hour', 'day' или ширина корзины в секундах) добавляет
+        этапы временной шкалы; готовый Timeline кладётся в self.timeline
+        (кэш при этом тоже не используется).
+
+        keep_store=True оставляет DialogStore с оценками по сообщениям в
+        self.store — для storage.message_store (тоже в обход кэша).
+
+        summarize=True (вместе с advisor) добавляет этап краткого содержания
+        переписки (model/summarizer.py): пересказ попадает в промпт совета
+        и в поле 'dialog_summary'. Пересказы фрагментов кэширует сам
+        советчик, поэтому кэш результатов здесь не используется.
+        """
+        self.timeline = None
+        self.store = None
+        if isinstance(data, DialogStore):
+            empty, dialog_id = not len(data), data.dialog_id
+        else:
+            empty, dialog_id = not data.get("messages"), data.get("dialog_id") or data.get("id")
+        if empty:
+            self.stage_report = None
+            return {"dialog_id": dialog_id, "error": "Пустой диалог"}
+
+        summarize = summarize and advisor is not None
+        if (self.result_cache is not None and use_cache and message_sink is None and timeline is None
+                and not keep_store and not summarize):
+            return self._analyze_cached(data, advisor)
+        return self._analyze_graph(data, advisor, message_sink, timeline, keep_store, summarize)
@@ -0,0 +1,106 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+import metrics
+
+
+class Stage:
+    """
+    Этап конвейера анализа.
+
+    Атрибуты:
+        name (str): Уникальное имя этапа.
+        func (Callable): Функция этапа; получает результаты зависимостей
+            именованными аргументами (имя зависимости → её результат).
+        deps (tuple[str]): Имена этапов, которые должны завершиться раньше.
+    """
+
+    def __init__(self, name: str, func: Callable[..., Any], deps: Iterable[str] = ()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+
+
+class StageGraph:
+    """
+    Небольшой граф зависимостей этапов, исполняемый на пуле потоков.
+
+    Независимые этапы (например, эмоции, DISC и темы) выполняются параллельно,
+    поэтому время обработки диалога стремится к самому медленному этапу,
+    а не к сумме всех этапов. После запуска доступен отчёт: время каждого
+    этапа и критический путь графа.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        self.stages = {s.name: s for s in stages}
+        for stage in stages:
+            missing = [d for d in stage.deps if d not in self.stages]
+            if missing:
+                raise ValueError(f"Этап {stage.name}: неизвестные зависимости {missing}")
+
+    def run(self, executor) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Выполняет граф на executor.
+
+        Returns:
+            tuple:
+                - results (dict): Имя этапа → результат.
+                - report (dict): Время этапов ('stages'), критический путь
+                  ('critical_path', 'critical_path_s'), общее время ('total_s')
+                  и сумма времени этапов ('sum_s').
+        """
+        t0 = time.perf_counter()
+        results, timings = {}, {}
+        pending = dict(self.stages)
+        running = {}
+
+        def timed(stage, kwargs):
+            start = time.perf_counter()
+            with metrics.timer("pipeline_stage", stage=stage.name):
+                value = stage.func(**kwargs)
+            return value, start - t0, time.perf_counter() - t0
+
+        while pending or running:
+            # Запускаем все этапы, чьи зависимости уже посчитаны
+            for name in [n for n, s in pending.items() if all(d in results for d in s.deps)]:
+                stage = pending.pop(name)
+                kwargs = {d: results[d] for d in stage.deps}
+                running[executor.submit(timed, stage, kwargs)] = name
+
+            if not running:
+                raise RuntimeError(f"Циклическая зависимость этапов: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    value, start, end = future.result()
+                except Exception:
+                    for other in running:
+                        other.cancel()
+                    raise
+                results[name] = value
+                timings[name] = {"start_s": round(start, 4), "end_s": round(end, 4),
+                                 "wall_s": round(end - start, 4)}
+
+        return results, self._report(timings, time.perf_counter() - t0)
+
+    def _report(self, timings: Dict[str, Dict[str, float]], total: float) -> Dict[str, Any]:
+        # Критический путь: от последнего завершившегося этапа назад
+        # по зависимости, которая завершилась позже остальных
+        path = []
+        name = max(timings, key=lambda n: timings[n]["end_s"]) if timings else None
+        while name is not None:
+            path.append(name)
+            deps = self.stages[name].deps
+            name = max(deps, key=lambda n: timings[n]["end_s"]) if deps else None
+        path.reverse()
+
+        return {
+            "stages": timings,
+            "critical_path": path,
+            "critical_path_s": round(sum(timings[n]["wall_s"] for n in path), 4),
+            "sum_s": round(sum(t["wall_s"] for t in timings.values()), 4),
+            "total_s": round(total, 4),
+        }
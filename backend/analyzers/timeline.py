@@ -0,0 +1,228 @@
+"""
+Временная шкала диалога: эмоции, баллы DISC и темы по корзинам времени.
+
+По-сообщенческие результаты из DialogStore (emotion_scores, disc_scores,
+topic_mask) раскладываются по корзинам фиксированной ширины (час, день)
+через np.bincount, а затем накапливаются префиксными суммами по времени.
+Хранятся только непустые корзины: для каждого среза (весь диалог и каждый
+участник) — отсортированные номера корзин и строки префиксных сумм по ним,
+поэтому размер шкалы не больше удвоенного числа сообщений, даже если
+переписка растянута на годы. Агрегат за любой диапазон — разность двух
+строк, найденных двоичным поиском, то есть O(log n).
+
+    timeline = Timeline.build(store, bucket="day")
+    timeline.aggregate("2025-01-01", "2025-02-01", sender="Анна")
+    timeline.series(step=7)            # понедельные точки для графика
+    timeline.save("1_timeline.npz"); Timeline.load("1_timeline.npz")
+"""
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from analyzers.dialog_store import NO_TIME, DialogStore, to_epoch
+
+BUCKETS = {"hour": 3600, "day": 86400}
+EMOTIONS = ["negative", "neutral", "positive"]
+DISC_TYPES = ["D", "I", "S", "C"]
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _iso(seconds: int) -> str:
+    return (_EPOCH + timedelta(seconds=int(seconds))).isoformat(" ", "minutes")
+
+
+class Timeline:
+    """
+    Префиксные суммы по непустым корзинам времени.
+
+    Атрибуты:
+        bucket_seconds (int): Ширина корзины в секундах.
+        origin (int): Начало нулевой корзины (секунды Unix, UTC).
+        n_buckets (int): Число корзин от первого сообщения до последнего.
+        columns (list[str]): Колонки: messages, emotion_messages, эмоции,
+            disc_<тип>, topic:<категория>.
+        senders (list[str]): Участники; срез 0 — весь диалог, i + 1 — senders[i].
+        keys (np.ndarray): int64 — непустые корзины срезов подряд, по возрастанию
+            внутри среза; срез s — keys[key_starts[s]:key_starts[s + 1]].
+        key_starts (np.ndarray): int64[len(senders) + 2] — границы срезов в keys.
+        prefix (np.ndarray): float64[len(keys) + len(senders) + 1, колонок] —
+            у среза s строки key_starts[s] + s … key_starts[s + 1] + s: нулевая
+            и накопленные суммы после каждой его корзины.
+    """
+
+    def __init__(self, bucket_seconds: int, origin: int, n_buckets: int, columns: List[str],
+                 senders: List[str], keys: np.ndarray, key_starts: np.ndarray, prefix: np.ndarray):
+        self.bucket_seconds = bucket_seconds
+        self.origin = origin
+        self.n_buckets = n_buckets
+        self.columns = columns
+        self.senders = senders
+        self.keys = keys
+        self.key_starts = key_starts
+        self.prefix = prefix
+        self._col = {c: i for i, c in enumerate(columns)}
+
+    # ---------------------- ПОСТРОЕНИЕ ----------------------
+    @classmethod
+    def build(cls, store: DialogStore, bucket: Any = "day") -> "Timeline":
+        """
+        Строит шкалу по результатам этапов в store.results. Сообщения без
+        времени в шкалу не попадают; отсутствующие результаты дают нули.
+        """
+        width = BUCKETS[bucket] if isinstance(bucket, str) else int(bucket)
+        valid = store.times != NO_TIME
+        times = store.times[valid]
+        senders = list(store.senders)
+
+        topic_labels = store.result_labels.get("topic_mask", [])
+        columns = (["messages", "emotion_messages"] + EMOTIONS + [f"disc_{t}" for t in DISC_TYPES]
+                   + [f"topic:{label}" for label in topic_labels])
+
+        n_slots = len(senders) + 1
+        if not len(times):
+            return cls(width, 0, 0, columns, senders, np.zeros(0, dtype=np.int64),
+                       np.zeros(n_slots + 1, dtype=np.int64), np.zeros((n_slots, len(columns))))
+
+        origin = int(times.min()) // width * width
+        buckets = (times - origin) // width
+        n_buckets = int(buckets.max()) + 1
+        # Ячейки (срез, корзина): срез 0 — все сообщения, i + 1 — сообщения участника i
+        sender_ids = store.sender_ids[valid].astype(np.int64)
+        has_sender = sender_ids >= 0
+        cells = np.concatenate([buckets, (sender_ids[has_sender] + 1) * n_buckets + buckets[has_sender]])
+        # Только непустые ячейки: размер не зависит от длины переписки во времени
+        cell_ids, inverse = np.unique(cells, return_inverse=True)
+
+        def column(weights):
+            if weights is not None:
+                weights = np.concatenate([weights, weights[has_sender]])
+            return np.bincount(inverse, weights=weights, minlength=len(cell_ids))
+
+        zeros = np.zeros(len(cell_ids))
+        values = [column(None)]
+
+        scores = store.results.get("emotion_scores")
+        if scores is not None:
+            scores = scores[valid].astype(np.float64)
+            has_emotion = ~np.isnan(scores[:, 0])
+            values.append(column(has_emotion.astype(np.float64)))
+            scores = np.nan_to_num(scores)
+            values += [column(scores[:, k]) for k in range(len(EMOTIONS))]
+        else:
+            values += [zeros] * (1 + len(EMOTIONS))
+
+        disc = store.results.get("disc_scores")
+        if disc is not None:
+            disc = disc[valid].astype(np.float64)
+            values += [column(disc[:, k]) for k in range(len(DISC_TYPES))]
+        else:
+            values += [zeros] * len(DISC_TYPES)
+
+        masks = store.results.get("topic_mask")
+        if masks is not None:
+            masks = masks[valid]
+            values += [column(((masks >> k) & 1).astype(np.float64)) for k in range(len(topic_labels))]
+
+        sums = np.stack(values, axis=-1)
+        keys = cell_ids % n_buckets
+        key_starts = np.searchsorted(cell_ids // n_buckets, np.arange(n_slots + 1)).astype(np.int64)
+        # У каждого среза — нулевая строка и накопленные суммы по его корзинам
+        prefix = np.zeros((len(cell_ids) + n_slots, len(columns)))
+        for slot in range(n_slots):
+            lo, hi = key_starts[slot], key_starts[slot + 1]
+            np.cumsum(sums[lo:hi], axis=0, out=prefix[lo + slot + 1:hi + slot + 1])
+        return cls(width, origin, n_buckets, columns, senders, keys, key_starts, prefix)
+
+    # ---------------------- ЗАПРОСЫ ----------------------
+    def _slot(self, sender: Optional[str]) -> int:
+        if sender is None:
+            return 0
+        try:
+            return self.senders.index(sender) + 1
+        except ValueError:
+            raise KeyError(f"Нет участника {sender!r}")
+
+    def _rows(self, slot: int):
+        """Непустые корзины среза и его строки префиксных сумм (на одну больше)."""
+        lo, hi = self.key_starts[slot], self.key_starts[slot + 1]
+        return self.keys[lo:hi], self.prefix[lo + slot:hi + slot + 1]
+
+    @staticmethod
+    def _sum(keys: np.ndarray, rows: np.ndarray, b0: int, b1: int) -> np.ndarray:
+        """Суммы по корзинам [b0, b1): разность строк после корзин < b1 и < b0."""
+        return rows[np.searchsorted(keys, b1)] - rows[np.searchsorted(keys, b0)]
+
+    def _bucket_range(self, start: Any, end: Any):
+        """[start, end) → номера корзин; границы расширяются до целых корзин."""
+        b0 = 0 if start is None else (to_epoch(start) - self.origin) // self.bucket_seconds
+        b1 = self.n_buckets if end is None else -((self.origin - to_epoch(end)) // self.bucket_seconds)
+        b0 = min(max(b0, 0), self.n_buckets)
+        b1 = min(max(b1, b0), self.n_buckets)
+        return b0, b1
+
+    def _describe(self, sums: np.ndarray) -> Dict[str, Any]:
+        emotion_n = sums[self._col["emotion_messages"]]
+        return {
+            "messages": int(sums[self._col["messages"]]),
+            "emotions_mean": {e: (round(float(sums[self._col[e]] / emotion_n), 3) if emotion_n else 0.0)
+                              for e in EMOTIONS},
+            "disc": {t: round(float(sums[self._col[f"disc_{t}"]]), 1) for t in DISC_TYPES},
+            "topics": {c.split(":", 1)[1]: int(sums[i]) for c, i in self._col.items()
+                       if c.startswith("topic:") and sums[i]},
+        }
+
+    def aggregate(self, start: Any = None, end: Any = None, sender: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Агрегат за [start, end) за O(log n): число сообщений, средние эмоции,
+        суммы баллов DISC и частоты тем. start/end — ISO-строки или секунды
+        Unix; None — от начала / до конца переписки.
+        """
+        b0, b1 = self._bucket_range(start, end)
+        result = self._describe(self._sum(*self._rows(self._slot(sender)), b0, b1))
+        result.update({
+            "start": _iso(self.origin + b0 * self.bucket_seconds),
+            "end": _iso(self.origin + b1 * self.bucket_seconds),
+            "sender": sender,
+        })
+        return result
+
+    def series(self, start: Any = None, end: Any = None, sender: Optional[str] = None,
+               step: int = 1) -> List[Dict[str, Any]]:
+        """Точки для графика: агрегаты по step >= 1 корзин подряд (тоже через префиксные суммы)."""
+        if step < 1:
+            raise ValueError(f"step должен быть >= 1, получено {step}")
+        b0, b1 = self._bucket_range(start, end)
+        keys, rows = self._rows(self._slot(sender))
+        points = []
+        for b in range(b0, b1, step):
+            e = min(b + step, b1)
+            point = self._describe(self._sum(keys, rows, b, e))
+            point["start"] = _iso(self.origin + b * self.bucket_seconds)
+            points.append(point)
+        return points
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "bucket_seconds": self.bucket_seconds,
+            "start": _iso(self.origin),
+            "end": _iso(self.origin + self.n_buckets * self.bucket_seconds),
+            "buckets": self.n_buckets,
+            "senders": self.senders,
+        }
+
+    # ---------------------- ХРАНЕНИЕ ----------------------
+    def save(self, path: str):
+        meta = {"bucket_seconds": self.bucket_seconds, "origin": self.origin, "n_buckets": self.n_buckets,
+                "columns": self.columns, "senders": self.senders}
+        with open(path, "wb") as f:
+            np.savez_compressed(f, keys=self.keys, key_starts=self.key_starts, prefix=self.prefix,
+                                meta=np.array(json.dumps(meta, ensure_ascii=False)))
+
+    @classmethod
+    def load(cls, path: str) -> "Timeline":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            return cls(meta["bucket_seconds"], meta["origin"], meta["n_buckets"], meta["columns"],
+                       meta["senders"], data["keys"], data["key_starts"], data["prefix"])
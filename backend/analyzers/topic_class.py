@@ -2,6 +2,9 @@ import json
 import os
 from collections import Counter
 import re
+import numpy as np
+import metrics
+from analyzers.dialog_store import DialogStore
 
 class TopicAnalyzer:
     """Анализатор тематики и эмоциональных паттернов в диалогах.
@@ -173,7 +176,72 @@ class TopicAnalyzer:
                     break
         
         return list(set(found_topics))  # Убираем дубли
+
+    def labels(self):
+        """Все категории (темы, затем эмоциональные паттерны) без повторов — номера битов масок."""
+        return list(dict.fromkeys(list(self.topic_keywords) + list(self.emotion_patterns)))
+
+    def _topic_mask(self, text, bits):
+        """То же, что _extract_topics_from_text, но в виде битовой маски категорий."""
+        text = text.lower()
+        mask = 0
+        for topic, keywords in self.topic_keywords.items():
+            for keyword in keywords:
+                if keyword in text:
+                    mask |= bits[topic]
+                    break
+        for emotion, patterns in self.emotion_patterns.items():
+            for pattern in patterns:
+                if pattern in text:
+                    mask |= bits[emotion]
+                    break
+        return mask
+
+    def _analyze_store_topics(self, store, participants=None):
+        """
+        Вариант _analyze_dialog_topics для DialogStore: маски категорий по
+        сообщениям сохраняются в store.results['topic_mask'], частоты
+        считаются NumPy по матрице попаданий.
+        """
+        labels = self.labels()
+        bits = {label: 1 << i for i, label in enumerate(labels)}
+        masks = np.fromiter((self._topic_mask(t, bits) for t in store.iter_texts()),
+                            dtype=np.uint32, count=len(store))
+        store.results["topic_mask"] = masks
+        store.result_labels["topic_mask"] = labels
+
+        hits = (masks[:, None] & np.array(list(bits.values()), dtype=np.uint32)[None, :]) != 0
+
+        def ranked(rows):
+            # Порядок как у Counter.most_common: по частоте, при равенстве — по первому появлению
+            counts = rows.sum(axis=0)
+            first = rows.argmax(axis=0)
+            found = [i for i in range(len(labels)) if counts[i]]
+            by_first = sorted(found, key=lambda i: (first[i], i))
+            return [(labels[i], int(counts[i])) for i in sorted(by_first, key=lambda i: -counts[i])], \
+                   {labels[i]: int(counts[i]) for i in by_first}
+
+        top, _ = ranked(hits)
+        total = int(hits.sum())
+        dominant_topics = [{'topic': topic, 'count': count, 'percentage': round(count / total * 100, 1)}
+                           for topic, count in top[:5] if count >= 2]
+
+        participant_interests = {}
+        sender_index = {name: i for i, name in enumerate(store.senders)}
+        for participant in participants or []:
+            if participant not in sender_index:
+                continue
+            top, all_topics = ranked(hits[store.sender_ids == sender_index[participant]])
+            if top:
+                participant_interests[participant] = {'main_interest': top[0][0], 'all_topics': all_topics}
+
+        return {
+            'dominant_topics': dominant_topics,
+            'total_messages_analyzed': len(store),
+            'participant_interests': participant_interests
+        }
     
+    @metrics.timed("topic_keywords")
     def _analyze_dialog_topics(self, messages, participants=None):
         """Анализирует распределение тем по всему диалогу и по отдельным участникам.
 
@@ -195,6 +263,9 @@ class TopicAnalyzer:
                 - 'participant_interests' (dict): Интересы участников, где ключ — имя,
                   значение — словарь с 'main_interest' и 'all_topics' (частоты).
         """
+        if isinstance(messages, DialogStore):
+            return self._analyze_store_topics(messages, participants)
+
         all_topics = []
         topics_by_participant = {}
         
@@ -284,7 +355,8 @@ class TopicAnalyzer:
         Анализирует список сообщений и возвращает структурированный отчёт о темах.
         
         Args:
-            messages (list): Список словарей с ключами 'text' и 'sender'
+            messages (list or DialogStore): Список словарей с ключами 'text' и 'sender'
+                или колоночное представление диалога
             participants (list, optional): Список имён участников для детального анализа
         
         Returns:
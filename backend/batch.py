@@ -0,0 +1,341 @@
+"""
+Пакетный анализ каталога диалогов с однократной загрузкой моделей.
+
+Запуск (из каталога backend):
+    python batch.py ../dialogs --out-dir ../analysis_results --workers 4
+    python batch.py "../exports/**/*.json" --no-advice
+    python batch.py ../account_export/manifest.json   # шарды полного экспорта Telegram
+
+Модели эмоций, эмбеддингов и LLM загружаются один раз и разделяются между
+потоками-воркерами. Уже посчитанные диалоги (результат новее входа)
+пропускаются, поэтому после падения достаточно перезапустить ту же команду.
+Результаты пишутся атомарно, итоги запуска — в run_summary.json.
+
+Результаты называются по пути входа относительно аргумента командной
+строки, из которого он взят (<stem>): для каталога ../dialogs это имя
+файла, для шаблона "../exports/**/*.json" — anna/result.json → anna__result.
+Имя не зависит от того, какие ещё файлы попали в запуск.
+
+С --format jsonl|parquet сводка остаётся в <stem>_analysis.json, а оценки
+по каждому сообщению пишутся по мере готовности в <stem>_messages.<format>
+(см. storage/compact_output.py). --format mmap пишет их в каталог
+<stem>_messages/ в бинарном формате фиксированной ширины
+(storage/message_store.py) — его постранично читает эндпоинт /messages сервера.
+
+С --timeline hour|day рядом пишется <stem>_timeline.npz — префиксные суммы
+эмоций, DISC и тем по корзинам времени (см. analyzers/timeline.py); его
+читает эндпоинт /timeline сервера.
+
+С --summarize советчик получает краткое содержание самой переписки
+(model/summarizer.py); пересказы фрагментов кэшируются, поэтому повторный
+запуск по дописанному чату пересказывает только новые фрагменты.
+"""
+import argparse
+import glob
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from analyzers.emotion_class import MainAnalyzer, load_emotion_model
+import metrics
+import thread_budget
+from prepare_data.formalizer import MANIFEST_NAME, read_manifest
+from storage.compact_output import CompactResultWriter
+from storage.message_store import store_dir, write_message_store
+from storage.result_cache import ResultCache
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUT_DIR = os.path.join(PROJECT_DIR, "analysis_results")
+DEFAULT_KB_PATH = os.path.join(PROJECT_DIR, "lib_liter", "literature_data.json")
+JOURNAL_NAME = "batch_journal.jsonl"
+SUMMARY_NAME = "run_summary.json"
+
+
+def _pattern_root(pattern: str) -> str:
+    """Каталог glob-шаблона до первого элемента с * ? или [ (для файла — его каталог)."""
+    parts = pattern.split(os.sep)
+    for i, part in enumerate(parts):
+        if any(c in part for c in "*?["):
+            return os.path.abspath(os.sep.join(parts[:i]) or os.curdir)
+    return os.path.dirname(os.path.abspath(pattern))
+
+
+def collect_inputs(patterns: List[str]) -> Dict[str, str]:
+    """
+    Раскрывает каталоги (все *.json внутри) и glob-шаблоны во входные файлы.
+    Манифест полного экспорта (или каталог с ним) раскрывается в шарды чатов —
+    каждый чат анализируется как отдельное задание. Возвращает {путь: корень},
+    отсортированный по пути; корень — каталог или начало шаблона, от которого
+    считается имя результата (output_stem).
+    """
+    found = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern) and os.path.exists(os.path.join(pattern, MANIFEST_NAME)):
+            paths, root = read_manifest(os.path.join(pattern, MANIFEST_NAME)), pattern
+        elif os.path.isdir(pattern):
+            paths, root = glob.glob(os.path.join(pattern, "*.json")), pattern
+        elif os.path.basename(pattern) == MANIFEST_NAME:
+            paths, root = read_manifest(pattern), os.path.dirname(os.path.abspath(pattern))
+        else:
+            paths, root = glob.glob(pattern, recursive=True), _pattern_root(pattern)
+        for path in paths:
+            if os.path.isfile(path):
+                found.setdefault(os.path.abspath(path), os.path.abspath(root))
+    return dict(sorted(found.items()))
+
+
+def _stem(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def output_stem(path: str, root: str) -> str:
+    """
+    Имя результатов входа — путь относительно корня без расширения:
+    ../exports/anna/result.json при корне ../exports → anna__result. Имя
+    зависит только от самого входа и корня, а не от остальных файлов запуска.
+    """
+    return os.path.splitext(os.path.relpath(os.path.abspath(path), root))[0].replace(os.sep, "__")
+
+
+def output_stems(inputs: Dict[str, str]) -> Dict[str, str]:
+    """
+    Имена результатов для {путь: корень}. Совпасть они могут только у входов
+    из разных корней — тогда ValueError: такие входы нужно анализировать
+    отдельными запусками (или в разные --out-dir).
+    """
+    stems, owners = {}, {}
+    for path, root in inputs.items():
+        stem = output_stem(path, root)
+        if stem in owners:
+            raise ValueError(f"Одинаковое имя результата {stem!r}: {owners[stem]} и {path}")
+        stems[path], owners[stem] = stem, path
+    return stems
+
+
+def output_path_for(stem: str, out_dir: str) -> str:
+    return os.path.join(out_dir, f"{stem}_analysis.json")
+
+
+def is_up_to_date(input_path: str, output_path: str) -> bool:
+    """Результат актуален, если он существует и записан после изменения входа."""
+    return (os.path.exists(output_path) and
+            os.path.getmtime(output_path) >= os.path.getmtime(input_path))
+
+
+def write_json_atomic(path: str, obj: Any, indent: int = 2):
+    """Пишет JSON во временный файл и подменяет целевой — без полузаписанных файлов при сбое."""
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=indent, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class BatchRunner:
+    """
+    Прогоняет много диалогов через MainAnalyzer (и, опционально, RAG-советчик).
+
+    Атрибуты:
+        out_dir (str): Каталог для результатов, журнала и итогов запуска.
+        workers (int): Число потоков-воркеров.
+        force (bool): Пересчитывать даже актуальные результаты.
+        result_cache (ResultCache or None): Кэш результатов по содержимому диалога.
+        fmt (str): Формат вывода: 'json' (только сводка), 'jsonl', 'parquet' или 'mmap'.
+        timeline (str or None): Ширина корзин временной шкалы ('hour', 'day') или None.
+        summarize (bool): Краткое содержание переписки в промпте совета.
+        advisor (RAGPsychologyAdvisor or None): Общий советчик; None — без советов.
+    """
+
+    def __init__(self, out_dir: str = DEFAULT_OUT_DIR, workers: int = 1, with_advice: bool = True,
+                 knowledge_base_path: str = DEFAULT_KB_PATH, force: bool = False, fmt: str = "json",
+                 use_cache: bool = True, timeline: str = None, summarize: bool = False):
+        self.out_dir = out_dir
+        self.workers = max(1, workers)
+        self.force = force
+        self.fmt = fmt
+        self.timeline = timeline
+        self.summarize = summarize
+        os.makedirs(out_dir, exist_ok=True)
+        # Одинаковые диалоги под разными именами файлов считаются один раз
+        self.result_cache = ResultCache(os.path.join(out_dir, ".result_cache")) if use_cache else None
+
+        # === Модели загружаются один раз на весь запуск ===
+        self.emotion_model = load_emotion_model()
+        self.advisor = None
+        if with_advice:
+            from model.rag_adviser import RAGPsychologyAdvisor
+            self.advisor = RAGPsychologyAdvisor(knowledge_base_path=knowledge_base_path)
+
+        self._journal_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _analyzer(self) -> MainAnalyzer:
+        """MainAnalyzer хранит состояние между этапами — у каждого потока свой."""
+        if not hasattr(self._local, "analyzer"):
+            self._local.analyzer = MainAnalyzer(emotion_model=self.emotion_model,
+                                                 result_cache=self.result_cache)
+        return self._local.analyzer
+
+    def _journal(self, record: Dict[str, Any]):
+        with self._journal_lock:
+            with open(os.path.join(self.out_dir, JOURNAL_NAME), "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def process_one(self, input_path: str, stem: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Анализирует один диалог и возвращает запись для итогов запуска.
+        stem — имя результатов (по умолчанию имя входного файла без расширения).
+        """
+        stem = stem or _stem(input_path)
+        out_path = output_path_for(stem, self.out_dir)
+        record = {"input": input_path, "output": out_path}
+        if not self.force and is_up_to_date(input_path, out_path):
+            record["status"] = "skipped"
+            return record
+
+        start = time.perf_counter()
+        try:
+            with open(input_path, "r", encoding="utf-8") as f, metrics.timer("json_parse"):
+                data = json.load(f)
+            loaded = time.perf_counter()
+
+            # Извлечение фактов и генерация — этапы того же графа, что и анализ
+            analyzer = self._analyzer()
+            if self.fmt == "json":
+                result = analyzer.analyze(data, advisor=self.advisor, timeline=self.timeline,
+                                          summarize=self.summarize)
+                analyzed = time.perf_counter()
+                write_json_atomic(out_path, result)
+            elif self.fmt == "mmap":
+                result = analyzer.analyze(data, advisor=self.advisor, timeline=self.timeline, keep_store=True,
+                                          summarize=self.summarize)
+                analyzed = time.perf_counter()
+                if analyzer.store is not None:
+                    messages_path = write_message_store(analyzer.store, store_dir(self.out_dir, stem))
+                    result["messages_store"] = {"format": "mmap", "path": os.path.basename(messages_path)}
+                    record["messages_output"] = messages_path
+                    analyzer.store = None
+                write_json_atomic(out_path, result)
+            else:
+                writer = CompactResultWriter(self.out_dir, stem, self.fmt)
+                try:
+                    result = analyzer.analyze(data, advisor=self.advisor, message_sink=writer,
+                                              timeline=self.timeline, summarize=self.summarize)
+                except Exception:
+                    writer.abort()
+                    raise
+                analyzed = time.perf_counter()
+                writer.close(result)
+                record["messages_output"] = writer.rows_path
+            if analyzer.timeline is not None:
+                timeline_path = os.path.join(self.out_dir, f"{stem}_timeline.npz")
+                analyzer.timeline.save(f"{timeline_path}.tmp")
+                os.replace(f"{timeline_path}.tmp", timeline_path)
+                record["timeline_output"] = timeline_path
+            record.update({
+                "status": "error" if "error" in result else "ok",
+                "messages": len(data.get("messages", [])),
+                "timings": {
+                    "load_s": round(loaded - start, 4),
+                    "analyze_s": round(analyzed - loaded, 4),
+                    "total_s": round(time.perf_counter() - start, 4),
+                },
+                "stages": analyzer.stage_report,
+            })
+            if "error" in result:
+                record["error"] = result["error"]
+        except Exception as e:
+            record.update({"status": "failed", "error": str(e),
+                           "timings": {"total_s": round(time.perf_counter() - start, 4)}})
+
+        self._journal(record)
+        return record
+
+    def run(self, inputs: Dict[str, str]) -> Dict[str, Any]:
+        """Обрабатывает все входы ({путь: корень} из collect_inputs) и пишет run_summary.json."""
+        started = datetime.now(timezone.utc).isoformat()
+        wall_start = time.perf_counter()
+        records = []
+        # Имена результатов проверяются до запуска: одинаковые имена не перезаписывают друг друга
+        stems = output_stems(inputs)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self.process_one, path, stems[path]): path for path in inputs}
+            for future in as_completed(futures):
+                record = future.result()
+                records.append(record)
+                mark = {"ok": "✅", "skipped": "⏭️"}.get(record["status"], "❌")
+                print(f"{mark} {os.path.basename(record['input'])} → {record['status']}")
+
+        records.sort(key=lambda r: r["input"])
+        counts = {}
+        for r in records:
+            counts[r["status"]] = counts.get(r["status"], 0) + 1
+
+        summary = {
+            "started_at": started,
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "wall_s": round(time.perf_counter() - wall_start, 3),
+            "workers": self.workers,
+            "threads": thread_budget.current().as_dict(),
+            "total": len(records),
+            "counts": counts,
+            "dialogs": records,
+        }
+        if metrics.is_enabled():
+            summary["profile"] = metrics.snapshot()
+        write_json_atomic(os.path.join(self.out_dir, SUMMARY_NAME), summary)
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный анализ диалогов")
+    parser.add_argument("inputs", nargs="+", help="Каталоги или glob-шаблоны с JSON-диалогами")
+    parser.add_argument("--out-dir", default=DEFAULT_OUT_DIR)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--kb", default=DEFAULT_KB_PATH, help="База знаний для RAG-советчика")
+    parser.add_argument("--no-advice", action="store_true", help="Без генерации советов LLM")
+    parser.add_argument("--force", action="store_true", help="Пересчитать даже актуальные результаты")
+    parser.add_argument("--format", choices=["json", "jsonl", "parquet", "mmap"], default="json",
+                        help="jsonl/parquet — сводка отдельно, оценки по сообщениям построчно; mmap — бинарное хранилище")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать кэш результатов")
+    parser.add_argument("--timeline", choices=["hour", "day"], help="Сохранить временную шкалу с корзинами такой ширины")
+    parser.add_argument("--summarize", action="store_true",
+                        help="Краткое содержание переписки (map-reduce LLM) в промпте совета")
+    parser.add_argument("--metrics", action="store_true", help="Собрать профиль горячих путей в run_summary.json")
+    parser.add_argument("--track-memory", action="store_true",
+                        help="Пиковая память по этапам (медленнее; диалоги и этапы — в один поток)")
+    args = parser.parse_args()
+
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print("❌ Не найдено ни одного входного файла")
+        return
+    try:
+        output_stems(inputs)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+
+    if args.track_memory and args.workers > 1:
+        # Пик tracemalloc общий на процесс — параллельные диалоги испортили бы пики друг друга
+        print("⚠️ --track-memory: диалоги обрабатываются в один поток")
+        args.workers = 1
+
+    # Потоки делят одну модель: intra-op потоки делятся между ними, без привязки к ядрам
+    thread_budget.configure(workers=args.workers, pin=False)
+    if args.metrics or args.track_memory:
+        metrics.enable(track_memory=args.track_memory)
+
+    runner = BatchRunner(out_dir=args.out_dir, workers=args.workers, with_advice=not args.no_advice,
+                         knowledge_base_path=args.kb, force=args.force, fmt=args.format, use_cache=not args.no_cache,
+                         timeline=args.timeline, summarize=args.summarize)
+    summary = runner.run(inputs)
+    print(f"📊 Готово за {summary['wall_s']} c: {summary['counts']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Нагрузочный тест авторизации: задержка посторонних запросов во время логинов.
+
+Сначала измеряет задержку «пробного» эндпоинта (по умолчанию /metrics) без
+нагрузки, затем — пока несколько потоков непрерывно логинятся. Если bcrypt
+блокирует цикл событий, p99 пробных запросов во второй фазе вырастает до
+сотен миллисекунд; с пулом bcrypt она должна остаться почти прежней.
+
+Запуск (сервер уже поднят, из каталога backend):
+    uvicorn database.server:app --port 8000 &
+    python -m benchmarks.auth_load --url http://127.0.0.1:8000 --logins 8 --seconds 10
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+
+def _request(url: str, payload=None) -> float:
+    """Один запрос; возвращает время ответа в секундах."""
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            resp.read()
+    except urllib.error.HTTPError as e:
+        e.read()
+    return time.perf_counter() - start
+
+
+def _percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "p50_ms": round(pick(0.50) * 1000, 2),
+        "p99_ms": round(pick(0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 2),
+    }
+
+
+def _probe(url: str, seconds: float, interval: float):
+    """Пробные запросы к постороннему эндпоинту в течение seconds."""
+    samples, deadline = [], time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        samples.append(_request(url))
+        time.sleep(interval)
+    return samples
+
+
+def run(base_url: str, logins: int, seconds: float, probe_path: str, interval: float):
+    username = f"load_{uuid.uuid4().hex[:8]}"
+    password = "load-test-password"
+    _request(f"{base_url}/register/", {"username": username, "password": password,
+                                       "email": f"{username}@example.com"})
+    probe_url = f"{base_url}{probe_path}"
+
+    print(f"📏 Фаза 1: {probe_path} без нагрузки ({seconds} c)")
+    idle = _probe(probe_url, seconds, interval)
+
+    print(f"🔥 Фаза 2: {logins} потоков логинятся, {probe_path} параллельно ({seconds} c)")
+    stop = threading.Event()
+    login_samples, lock = [], threading.Lock()
+
+    def login_loop():
+        while not stop.is_set():
+            elapsed = _request(f"{base_url}/login", {"username": username, "password": password})
+            with lock:
+                login_samples.append(elapsed)
+
+    threads = [threading.Thread(target=login_loop, daemon=True) for _ in range(logins)]
+    for t in threads:
+        t.start()
+    loaded = _probe(probe_url, seconds, interval)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    return {
+        "probe_idle": _percentiles(idle),
+        "probe_under_login_load": _percentiles(loaded),
+        "login": _percentiles(login_samples),
+        "logins_per_s": round(len(login_samples) / seconds, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержка посторонних запросов во время логинов")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--logins", type=int, default=8, help="Потоков, непрерывно вызывающих /login")
+    parser.add_argument("--seconds", type=float, default=10.0, help="Длительность каждой фазы")
+    parser.add_argument("--probe", default="/metrics", help="Посторонний эндпоинт для замеров")
+    parser.add_argument("--interval", type=float, default=0.01, help="Пауза между пробными запросами")
+    parser.add_argument("--out", help="Куда сохранить JSON-отчёт")
+    args = parser.parse_args()
+
+    report = run(args.url.rstrip("/"), args.logins, args.seconds, args.probe, args.interval)
+    idle, loaded = report["probe_idle"], report["probe_under_login_load"]
+    print(f"⏱️ {args.probe}: p99 {idle.get('p99_ms')} мс без нагрузки → {loaded.get('p99_ms')} мс под логинами")
+    print(f"🔐 /login: p50 {report['login'].get('p50_ms')} мс, {report['logins_per_s']} логинов/с")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
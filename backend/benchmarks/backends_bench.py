@@ -0,0 +1,145 @@
+"""
+Бенчмарк бэкендов генерации.
+
+Для каждого бэкенда измеряет скорость prefill и decode (токенов/с),
+время до первого токена (TTFT) и пиковый RSS. Каждый бэкенд запускается
+в отдельном процессе, чтобы пиковая память не смешивалась между моделями.
+
+Запуск (из каталога backend):
+    python -m benchmarks.backends_bench --backend stub \
+        --backend llama_cpp:model/mistral/saiga_mistral_7b.Q4_K_M.gguf \
+        --backend transformers:IlyaGusev/saiga_llama3_8b --runs 3
+"""
+import argparse
+import json
+import multiprocessing as mp
+import resource
+import statistics
+import sys
+import time
+
+from model.backends import create_backend
+
+
+DEFAULT_PROMPT = (
+    "Ты — психолог-консультант. Участники переписки обсуждают работу и быт, "
+    "у одного доминирует негативная эмоция, стиль DISC — D, у другого — S. "
+    "Дай три практических совета, как снизить напряжение в диалоге.\n\nОтвет:"
+)
+
+
+def parse_spec(spec: str):
+    """'llama_cpp:path' → ('llama_cpp', {'model_path': path}); 'stub' → ('stub', {})."""
+    kind, _, arg = spec.partition(":")
+    if kind == "llama_cpp":
+        return kind, {"model_path": arg}
+    if kind == "transformers":
+        return kind, {"model_name": arg}
+    return kind, {}
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS текущего процесса в МБ (ru_maxrss на Linux — в КБ)."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 if sys.platform != "darwin" else rss / (1024 * 1024)
+
+
+def measure(backend, prompt: str, max_tokens: int, seed: int = 42) -> dict:
+    """Один прогон: TTFT, prefill и decode в токенах/с."""
+    prompt_tokens = backend.count_tokens(prompt)
+    start = time.perf_counter()
+    first = None
+    pieces = []
+    for piece in backend.stream(prompt, max_tokens=max_tokens, temperature=0.7, seed=seed):
+        if first is None:
+            first = time.perf_counter()
+        pieces.append(piece)
+    end = time.perf_counter()
+
+    first = first or end
+    ttft = first - start
+    # Куски стрима llama.cpp — по токену; для остальных пересчитываем токенизатором
+    generated = max(len(pieces), backend.count_tokens("".join(pieces)))
+    decode_time = end - first
+    return {
+        "prompt_tokens": prompt_tokens,
+        "generated_tokens": generated,
+        "ttft_s": round(ttft, 4),
+        "prefill_tok_s": round(prompt_tokens / ttft, 2) if ttft > 0 else None,
+        "decode_tok_s": round((generated - 1) / decode_time, 2) if generated > 1 and decode_time > 0 else None,
+        "total_s": round(end - start, 4),
+    }
+
+
+def _run_backend(spec: str, prompt: str, max_tokens: int, runs: int, queue):
+    try:
+        kind, kwargs = parse_spec(spec)
+        load_start = time.perf_counter()
+        backend = create_backend(kind, **kwargs)
+        load_s = time.perf_counter() - load_start
+
+        measure(backend, prompt, max_tokens=8)  # прогрев
+        samples = [measure(backend, prompt, max_tokens) for _ in range(runs)]
+
+        def med(key):
+            values = [s[key] for s in samples if s[key] is not None]
+            return round(statistics.median(values), 4) if values else None
+
+        queue.put({
+            "backend": spec,
+            "load_s": round(load_s, 3),
+            "runs": runs,
+            "prompt_tokens": samples[0]["prompt_tokens"],
+            "ttft_s": med("ttft_s"),
+            "prefill_tok_s": med("prefill_tok_s"),
+            "decode_tok_s": med("decode_tok_s"),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "samples": samples,
+        })
+    except Exception as e:
+        queue.put({"backend": spec, "error": str(e)})
+
+
+def run(specs, prompt: str = DEFAULT_PROMPT, max_tokens: int = 128, runs: int = 3):
+    """Прогоняет каждый бэкенд в отдельном процессе и возвращает список отчётов."""
+    ctx = mp.get_context("spawn")
+    reports = []
+    for spec in specs:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run_backend, args=(spec, prompt, max_tokens, runs, queue))
+        proc.start()
+        reports.append(queue.get())
+        proc.join()
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк бэкендов генерации")
+    parser.add_argument("--backend", action="append", required=True,
+                        help="stub | llama_cpp:<путь к gguf> | transformers:<модель>")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--max-tokens", type=int, default=128)
+    parser.add_argument("--prompt-file", help="Файл с промптом (по умолчанию — встроенный)")
+    parser.add_argument("--out", help="Куда сохранить JSON-отчёт")
+    args = parser.parse_args()
+
+    prompt = DEFAULT_PROMPT
+    if args.prompt_file:
+        with open(args.prompt_file, "r", encoding="utf-8") as f:
+            prompt = f.read()
+
+    reports = run(args.backend, prompt, args.max_tokens, args.runs)
+    for r in reports:
+        if "error" in r:
+            print(f"❌ {r['backend']}: {r['error']}")
+            continue
+        print(f"⏱️ {r['backend']}: TTFT {r['ttft_s']} c, prefill {r['prefill_tok_s']} ток/с, "
+              f"decode {r['decode_tok_s']} ток/с, пик RSS {r['peak_rss_mb']} МБ")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
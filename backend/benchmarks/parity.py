@@ -0,0 +1,377 @@
+"""
+Проверка точности оптимизированных путей анализа против эталонного.
+
+Эталон — MainAnalyzer.analyze без кэша и оптимизаций; кандидат — один из
+путей PATHS (кэш результатов, хранилище по сообщениям, квантованная модель
+эмоций...). Оба прогоняются на диалогах из dialogs/ и на синтетических
+диалогах, и для каждого диалога сравниваются:
+
+    emotion_scores — оценки каждого сообщения, |Δ| <= --tolerance
+                     (если кандидат не даёт оценок по сообщениям — медианы участников)
+    labels         — DISC (text/test_dominant), темы и интересы участников: точное
+                     совпадение; доминирующая эмоция — точное, если у эталона
+                     отрыв первой эмоции от второй больше допуска
+    retrieval      — recall@k поиска фактов (_search_ids, объединённый ответ на все
+                     запросы анализа) против точного поиска по каждому запросу
+                     на тех же эмбеддингах, не ниже --min-recall и без дубликатов
+
+В отчёте рядом с расхождениями — ускорение кандидата. При любом нарушении
+скрипт печатает ❌ и завершается с кодом 1.
+
+Запуск (из каталога backend):
+    python -m benchmarks.parity --candidate store --synthetic 1000 10000
+    python -m benchmarks.parity --real --candidate int8 --retrieval hnsw --out parity.json
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from analyzers.dialog_store import DialogStore
+from analyzers.emotion_class import EMOTION_LABELS, MainAnalyzer, load_emotion_model
+from benchmarks.stubs import StubEmbeddingModel, StubEmotionModel
+from benchmarks.synthetic import SyntheticDialogGenerator
+from storage.result_cache import ResultCache
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(os.path.dirname(BENCH_DIR))
+DEFAULT_DIALOGS = os.path.join(PROJECT_DIR, "dialogs")
+DEFAULT_KB_PATH = os.path.join(PROJECT_DIR, "lib_liter", "literature_data.json")
+
+
+# ---------------------- ПУТИ АНАЛИЗА ----------------------
+# Путь — фабрика (emotion_model, tmp_dir) → run(dialog) → (результат, оценки по сообщениям или None)
+
+def _scores_of(analyzer: MainAnalyzer) -> np.ndarray:
+    return analyzer.store.results["emotion_scores"]
+
+
+def reference_path(emotion_model, tmp_dir):
+    analyzer = MainAnalyzer(emotion_model=emotion_model)
+
+    def run(dialog):
+        result = analyzer.analyze(dialog, use_cache=False, keep_store=True)
+        return result, _scores_of(analyzer)
+    return run
+
+
+def store_path(emotion_model, tmp_dir):
+    """Диалог подаётся готовым DialogStore (потоковый разбор экспортов, задания)."""
+    analyzer = MainAnalyzer(emotion_model=emotion_model)
+
+    def run(dialog):
+        result = analyzer.analyze(DialogStore.from_json(dialog), use_cache=False, keep_store=True)
+        return result, _scores_of(analyzer)
+    return run
+
+
+def cache_path(emotion_model, tmp_dir):
+    """Повторный анализ из ResultCache (время — попадания; прогрев не считается)."""
+    analyzer = MainAnalyzer(emotion_model=emotion_model, result_cache=ResultCache(os.path.join(tmp_dir, "results")))
+    warmed = set()
+
+    def run(dialog):
+        key = id(dialog)
+        if key not in warmed:
+            warmed.add(key)
+            analyzer.analyze(dialog)
+            raise _Warmup()
+        return analyzer.analyze(dialog), None
+    return run
+
+
+def mmap_path(emotion_model, tmp_dir):
+    """Оценки по сообщениям, прочитанные обратно из storage.message_store (float32)."""
+    from storage.message_store import MessageStore, write_message_store
+
+    analyzer = MainAnalyzer(emotion_model=emotion_model)
+
+    def run(dialog):
+        result = analyzer.analyze(dialog, use_cache=False, keep_store=True)
+        path = write_message_store(analyzer.store, os.path.join(tmp_dir, "messages"))
+        return result, np.asarray(MessageStore(path).records["scores"], dtype=np.float64)
+    return run
+
+
+def int8_path(emotion_model, tmp_dir):
+    """Модель эмоций с динамическим int8-квантованием линейных слоёв (только --real)."""
+    import torch
+    from analyzers.emotion_class import _build_emotion_model
+
+    pipe = _build_emotion_model()
+    pipe.model = torch.quantization.quantize_dynamic(pipe.model, {torch.nn.Linear}, dtype=torch.qint8)
+    return reference_path(pipe, tmp_dir)
+
+
+class _Warmup(Exception):
+    """Путь прогревается: этот прогон не сравнивается, а повторяется."""
+
+
+PATHS: Dict[str, Callable] = {
+    "store": store_path,
+    "cache": cache_path,
+    "mmap": mmap_path,
+    "int8": int8_path,
+}
+# Пути, которым нужны настоящие модели: с заглушкой им нечего сравнивать
+REAL_ONLY = {"int8"}
+
+
+# ---------------------- ПОИСК ФАКТОВ ----------------------
+def exact_search(embeddings: np.ndarray, query: np.ndarray, k: int) -> set:
+    """
+    Точные k ближайших по L2 к одному запросу (эталон для recall@k). В базе
+    знаний есть одинаковые записи, поэтому годится любой id не дальше k-го.
+    """
+    dist = (query ** 2).sum() - 2 * embeddings @ query + (embeddings ** 2).sum(1)
+    kth = np.partition(dist, min(k, len(dist)) - 1)[min(k, len(dist)) - 1]
+    return set(np.flatnonzero(dist <= kth + 1e-6 * abs(kth)).tolist())
+
+
+def hnsw_index(embeddings: np.ndarray):
+    import faiss
+
+    index = faiss.IndexHNSWFlat(embeddings.shape[1], 32)
+    index.add(embeddings)
+    return index
+
+
+RETRIEVAL_INDEXES = {
+    "faiss": None,  # индекс самого советчика
+    "hnsw": hnsw_index,
+}
+
+
+def retrieval_parity(advisor, analyses: List[Dict[str, Any]], k: int, index_kind: str) -> Dict[str, Any]:
+    """
+    recall@k поиска советчика (_search_ids: батч запросов одного анализа и их
+    объединение по рангу) против точного поиска по каждому запросу отдельно:
+    для каждого запроса в объединённом ответе должны быть его k ближайших.
+    Так проверяется и индекс, и слияние запросов.
+    """
+    kb_embs = advisor.encode(advisor.kb_texts)
+    if RETRIEVAL_INDEXES[index_kind] is not None:
+        advisor.index = RETRIEVAL_INDEXES[index_kind](kb_embs)
+
+    hits = duplicates = n_queries = 0
+    reference_s = candidate_s = 0.0
+    for analysis in analyses:
+        queries = advisor._build_queries(analysis)
+        if not queries:
+            continue
+        n_queries += len(queries)
+        start = time.perf_counter()
+        truth = [exact_search(kb_embs, query_emb, k) for query_emb in np.atleast_2d(advisor.encode(queries))]
+        reference_s += time.perf_counter() - start
+        start = time.perf_counter()
+        found = advisor._search_ids(queries, k)
+        candidate_s += time.perf_counter() - start
+
+        hits += sum(min(k, len(t & set(found))) for t in truth)
+        duplicates += len(found) - len(set(found))
+
+    return {
+        "index": index_kind,
+        "queries": n_queries,
+        "k": k,
+        f"recall@{k}": round(hits / (n_queries * k), 4) if n_queries else 1.0,
+        "duplicates": duplicates,
+        "reference_s": round(reference_s, 6),
+        "candidate_s": round(candidate_s, 6),
+    }
+
+
+# ---------------------- СРАВНЕНИЕ ----------------------
+def _dominant_is_stable(participant: Dict[str, Any], tolerance: float) -> bool:
+    """
+    Доминирующая эмоция эталона устойчива к отклонению оценок в пределах допуска:
+    соседние медианы различаются больше чем на 2 допуска (с учётом правила
+    «нейтральная — вторая по величине» порядок должен быть устойчив целиком).
+    """
+    medians = sorted(participant["emotions_median"].values(), reverse=True)
+    return all(a - b > 2 * tolerance for a, b in zip(medians, medians[1:]))
+
+
+def compare_labels(ref: Dict[str, Any], cand: Dict[str, Any], tolerance: float) -> List[str]:
+    """Расхождения в точных полях: DISC, темы, интересы, устойчивая доминирующая эмоция."""
+    problems = []
+    if ref.get("dominant_topics") != cand.get("dominant_topics"):
+        problems.append("dominant_topics")
+    ref_p, cand_p = ref.get("participants_analysis", {}), cand.get("participants_analysis", {})
+    if set(ref_p) != set(cand_p):
+        return problems + ["participants"]
+    for sender, r in ref_p.items():
+        c = cand_p[sender]
+        for key in ("text_dominant", "test_dominant", "topic_interests", "messages_count"):
+            if r.get(key) != c.get(key):
+                problems.append(f"{sender}.{key}")
+        if "dominant_emotion" in r and r.get("dominant_emotion") != c.get("dominant_emotion") \
+                and _dominant_is_stable(r, tolerance):
+            problems.append(f"{sender}.dominant_emotion")
+    return problems
+
+
+def compare_scores(ref: Dict[str, Any], cand: Dict[str, Any], ref_scores: np.ndarray,
+                   cand_scores: Optional[np.ndarray]) -> Dict[str, Any]:
+    """Отклонение оценок эмоций: по сообщениям, а без них — по медианам участников."""
+    if cand_scores is not None:
+        ref_nan, cand_nan = np.isnan(ref_scores), np.isnan(cand_scores)
+        if ref_scores.shape != cand_scores.shape or not np.array_equal(ref_nan, cand_nan):
+            return {"level": "message", "max_delta": float("inf"), "mean_delta": float("inf")}
+        delta = np.abs(np.nan_to_num(ref_scores) - np.nan_to_num(cand_scores))
+        return {"level": "message", "max_delta": float(delta.max(initial=0.0)),
+                "mean_delta": float(delta.mean()) if delta.size else 0.0}
+
+    deltas = []
+    for sender, r in ref.get("participants_analysis", {}).items():
+        c = cand.get("participants_analysis", {}).get(sender, {})
+        for label in EMOTION_LABELS:
+            deltas.append(abs(r["emotions_median"][label] - c.get("emotions_median", {}).get(label, np.inf)))
+    return {"level": "median", "max_delta": max(deltas, default=0.0),
+            "mean_delta": float(np.mean(deltas)) if deltas else 0.0}
+
+
+def _timed(run, dialog):
+    while True:
+        start = time.perf_counter()
+        try:
+            out = run(dialog)
+        except _Warmup:
+            continue
+        return out, time.perf_counter() - start
+
+
+def dialog_parity(name: str, dialog: Dict[str, Any], reference, candidate, tolerance: float) -> Dict[str, Any]:
+    (ref, ref_scores), ref_s = _timed(reference, dialog)
+    (cand, cand_scores), cand_s = _timed(candidate, dialog)
+    scores = compare_scores(ref, cand, ref_scores, cand_scores)
+    labels = compare_labels(ref, cand, tolerance)
+    return {
+        "dialog": name,
+        "messages": len(dialog["messages"]),
+        "reference_s": round(ref_s, 4),
+        "candidate_s": round(cand_s, 4),
+        "speedup": round(ref_s / cand_s, 3) if cand_s > 0 else None,
+        "scores": {k: (round(v, 6) if isinstance(v, float) else v) for k, v in scores.items()},
+        "label_mismatches": labels,
+        "passed": scores["max_delta"] <= tolerance and not labels,
+    }
+
+
+# ---------------------- ДАННЫЕ ----------------------
+def load_dialogs(dialogs_dir: str, synthetic: List[int], participants: int, seed: int) -> Dict[str, Dict]:
+    """Диалоги из каталога (формат MainAnalyzer или экспорт Telegram) и синтетические."""
+    from prepare_data.formalizer import load_dialog
+
+    dialogs = {}
+    for path in sorted(glob.glob(os.path.join(dialogs_dir, "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        messages = data.get("messages") if isinstance(data, dict) else None
+        if not messages:
+            continue
+        if "from" in messages[0] or "date" in messages[0]:
+            data = load_dialog(path)
+        dialogs[os.path.basename(path)] = data
+    generator = SyntheticDialogGenerator(seed)
+    for size in synthetic:
+        dialogs[f"synthetic_{size}x{participants}"] = generator.generate(size, participants)
+    return dialogs
+
+
+def run_parity(candidate: str, real: bool = False, dialogs_dir: str = DEFAULT_DIALOGS,
+               synthetic: List[int] = (1000,), participants: int = 3, seed: int = 42,
+               tolerance: float = 0.02, retrieval: Optional[str] = None, k: int = 3,
+               min_recall: float = 0.9, kb_path: str = DEFAULT_KB_PATH) -> Dict[str, Any]:
+    if candidate in REAL_ONLY and not real:
+        raise ValueError(f"Путь {candidate} проверяется только с настоящими моделями (--real)")
+    emotion_model = load_emotion_model() if real else StubEmotionModel()
+    dialogs = load_dialogs(dialogs_dir, list(synthetic), participants, seed)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        reference = reference_path(emotion_model, tmp_dir)
+        cand_run = PATHS[candidate](emotion_model, tmp_dir)
+        reports = []
+        for name, dialog in dialogs.items():
+            print(f"⚖️ {name} ({len(dialog['messages'])} сообщений)...")
+            reports.append(dialog_parity(name, dialog, reference, cand_run, tolerance))
+
+        retrieval_report = None
+        if retrieval:
+            from model.backends import StubBackend
+            from model.rag_adviser import RAGPsychologyAdvisor
+
+            kwargs = {} if real else {"backend": StubBackend(), "embedding_model": StubEmbeddingModel()}
+            advisor = RAGPsychologyAdvisor(knowledge_base_path=kb_path, cache_dir=os.path.join(tmp_dir, "rag"),
+                                           **kwargs)
+            analyses = [reference(d)[0] for d in dialogs.values()]
+            retrieval_report = retrieval_parity(advisor, analyses, k, retrieval)
+            retrieval_report["passed"] = (retrieval_report[f"recall@{k}"] >= min_recall
+                                          and retrieval_report["duplicates"] == 0)
+
+    ref_total = sum(r["reference_s"] for r in reports)
+    cand_total = sum(r["candidate_s"] for r in reports)
+    passed = all(r["passed"] for r in reports) and (retrieval_report is None or retrieval_report["passed"])
+    return {
+        "candidate": candidate,
+        "models": "real" if real else "stub",
+        "tolerance": tolerance,
+        "min_recall": min_recall if retrieval else None,
+        "speedup": round(ref_total / cand_total, 3) if cand_total > 0 else None,
+        "max_score_delta": max((r["scores"]["max_delta"] for r in reports), default=0.0),
+        "dialogs": reports,
+        "retrieval": retrieval_report,
+        "passed": passed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка точности оптимизированных путей анализа")
+    parser.add_argument("--candidate", choices=sorted(PATHS), default="store")
+    parser.add_argument("--real", action="store_true", help="Настоящие модели вместо заглушек")
+    parser.add_argument("--dialogs-dir", default=DEFAULT_DIALOGS)
+    parser.add_argument("--synthetic", type=int, nargs="*", default=[1000], help="Размеры синтетических диалогов")
+    parser.add_argument("--participants", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Допуск оценок эмоций")
+    parser.add_argument("--retrieval", choices=sorted(RETRIEVAL_INDEXES), help="Проверить recall@k поиска фактов")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    parser.add_argument("--kb", default=DEFAULT_KB_PATH, help="База знаний для RAG-советчика")
+    parser.add_argument("--out", help="Куда сохранить JSON-отчёт")
+    args = parser.parse_args()
+    if args.candidate in REAL_ONLY and not args.real:
+        parser.error(f"--candidate {args.candidate} требует --real")
+
+    report = run_parity(args.candidate, real=args.real, dialogs_dir=args.dialogs_dir, synthetic=args.synthetic,
+                        participants=args.participants, seed=args.seed, tolerance=args.tolerance,
+                        retrieval=args.retrieval, k=args.k, min_recall=args.min_recall, kb_path=args.kb)
+
+    for r in report["dialogs"]:
+        mark = "✅" if r["passed"] else "❌"
+        print(f"{mark} {r['dialog']}: ×{r['speedup']}, |Δ| max {r['scores']['max_delta']:.4g} "
+              f"({r['scores']['level']}), расхождения: {r['label_mismatches'] or 'нет'}")
+    retrieval = report["retrieval"]
+    if retrieval is not None:
+        mark = "✅" if retrieval["passed"] else "❌"
+        recall_key = f"recall@{retrieval['k']}"
+        print(f"{mark} поиск ({retrieval['index']}): {recall_key} = {retrieval[recall_key]}, "
+              f"дубликатов: {retrieval['duplicates']}")
+    print(f"{'✅' if report['passed'] else '❌'} {report['candidate']}: ускорение ×{report['speedup']}, "
+          f"max |Δ| {report['max_score_delta']:.4g}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if not report["passed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Сквозной бенчмарк конвейера анализа на синтетических диалогах.
+
+Замеряет каждый этап (_clean_text, _get_emotion, DialogStore, DISCAnalyze, TopicAnalyzer,
+полный MainAnalyzer.analyze, извлечение фактов и генерацию), пишет результат
+в JSON и сравнивает его с сохранённым базовым замером.
+
+    # заглушки вместо ML-моделей (по умолчанию)
+    python -m benchmarks.run_bench --sizes 1000 10000 100000 --participants 2 8 --out bench.json
+    # сохранить базовый замер и потом сравнивать с ним
+    python -m benchmarks.run_bench --save-baseline
+    python -m benchmarks.run_bench --baseline benchmarks/baseline.json --threshold 0.2
+    # настоящие модели
+    python -m benchmarks.run_bench --real --sizes 1000
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+from analyzers.dialog_store import DialogStore
+from analyzers.disc_class import DISCAnalyze
+from analyzers.emotion_class import MainAnalyzer, load_emotion_model
+from analyzers.topic_class import TopicAnalyzer
+from benchmarks.stubs import StubEmbeddingModel, StubEmotionModel
+from benchmarks.synthetic import SyntheticDialogGenerator
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(os.path.dirname(BENCH_DIR))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_KB_PATH = os.path.join(PROJECT_DIR, "lib_liter", "literature_data.json")
+
+
+def time_stage(fn: Callable[[], Any], items: int, repeat: int) -> Dict[str, float]:
+    """Лучшее из repeat измерений — меньше всего подвержено шуму."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return {
+        "seconds": round(best, 6),
+        "items": items,
+        "items_per_s": round(items / best, 1) if best > 0 else None,
+    }
+
+
+def build_advisor(real: bool, cache_dir: str):
+    from model.backends import StubBackend
+    from model.rag_adviser import RAGPsychologyAdvisor
+
+    if real:
+        return RAGPsychologyAdvisor(knowledge_base_path=DEFAULT_KB_PATH)
+    # Отдельный каталог кэша: индекс из заглушечных эмбеддингов не должен затереть настоящий
+    return RAGPsychologyAdvisor(knowledge_base_path=DEFAULT_KB_PATH, backend=StubBackend(),
+                                embedding_model=StubEmbeddingModel(), cache_dir=cache_dir)
+
+
+def bench_dialog(dialog: Dict[str, Any], analyzer: MainAnalyzer, advisor, repeat: int,
+                 emotion_limit: int, e2e_limit: int) -> Dict[str, Any]:
+    messages = dialog["messages"]
+    texts = [m["text"] for m in messages]
+    stages = {}
+
+    stages["clean_text"] = time_stage(lambda: [analyzer._clean_text(t) for t in texts], len(texts), repeat)
+
+    cleaned = [analyzer._clean_text(t) for t in texts[:emotion_limit]]
+    stages["get_emotion"] = time_stage(lambda: [analyzer._get_emotion(t) for t in cleaned if t],
+                                       len(cleaned), repeat)
+
+    stages["dialog_store"] = time_stage(lambda: DialogStore.from_json(dialog), len(messages), repeat)
+    grouped = analyzer._normalize_stage(dialog)
+    store = grouped["store"]
+    per_sender = [analyzer._clean_text(" ".join(store.iter_texts(idx))) for idx in grouped["grouped"].values()]
+    stages["disc"] = time_stage(lambda: [DISCAnalyze(t).analyze(1) for t in per_sender], len(messages), repeat)
+
+    stages["topics"] = time_stage(lambda: TopicAnalyzer().analyze(store, grouped["senders"]),
+                                  len(messages), repeat)
+
+    if len(messages) <= e2e_limit:
+        stages["analyze"] = time_stage(lambda: analyzer.analyze(dialog), len(messages), repeat)
+    # Для RAG-этапов достаточно анализа префикса диалога
+    analysis = analyzer.analyze({**dialog, "messages": messages[:e2e_limit]})
+
+    if advisor is not None:
+        stages["retrieval"] = time_stage(lambda: advisor.retrieve(analysis), 1, repeat)
+        retrieved = advisor.retrieve(analysis)
+        stages["generation"] = time_stage(lambda: advisor.generate_from_retrieved(analysis, *retrieved),
+                                          1, repeat)
+
+    return {"messages": len(messages), "participants": len(grouped["senders"]), "stages": stages}
+
+
+def run_suite(sizes: List[int], participants: List[int], seed: int = 42, real: bool = False,
+              repeat: int = 3, emotion_limit: int = 2000, e2e_limit: int = 100000,
+              with_rag: bool = True) -> Dict[str, Any]:
+    """Прогоняет все комбинации размеров и числа участников."""
+    emotion_model = load_emotion_model() if real else StubEmotionModel()
+    analyzer = MainAnalyzer(emotion_model=emotion_model)
+    generator = SyntheticDialogGenerator(seed)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        advisor = build_advisor(real, cache_dir) if with_rag else None
+        runs = {}
+        for size in sizes:
+            for n_participants in participants:
+                dialog = generator.generate(size, n_participants)
+                key = f"{size}x{n_participants}"
+                print(f"⏱️ {key}...")
+                runs[key] = bench_dialog(dialog, analyzer, advisor, repeat, emotion_limit, e2e_limit)
+
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "seed": seed,
+            "models": "real" if real else "stub",
+            "repeat": repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "runs": runs,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.2,
+            min_delta_s: float = 0.005) -> List[Dict[str, Any]]:
+    """
+    Сравнивает замер с базовым. Регрессия — этап стал медленнее более чем на
+    threshold (доля) и при этом более чем на min_delta_s секунд (отсекаем шум).
+    """
+    regressions = []
+    for key, run in current["runs"].items():
+        base_run = baseline.get("runs", {}).get(key)
+        if not base_run:
+            continue
+        for stage, cur in run["stages"].items():
+            base = base_run["stages"].get(stage)
+            if not base:
+                continue
+            ratio = cur["seconds"] / base["seconds"] if base["seconds"] > 0 else 1.0
+            if ratio > 1 + threshold and cur["seconds"] - base["seconds"] > min_delta_s:
+                regressions.append({"run": key, "stage": stage, "baseline_s": base["seconds"],
+                                    "current_s": cur["seconds"], "ratio": round(ratio, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера анализа")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--participants", type=int, nargs="+", default=[2])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--real", action="store_true", help="Настоящие модели вместо заглушек")
+    parser.add_argument("--no-rag", action="store_true", help="Без этапов извлечения и генерации")
+    parser.add_argument("--emotion-limit", type=int, default=2000,
+                        help="Сколько сообщений прогонять через модель эмоций")
+    parser.add_argument("--e2e-limit", type=int, default=100000,
+                        help="Максимальный размер диалога для полного analyze")
+    parser.add_argument("--out", help="Куда сохранить результат")
+    parser.add_argument("--baseline", help="Базовый замер для сравнения")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help=f"Сохранить результат как базовый ({DEFAULT_BASELINE})")
+    args = parser.parse_args()
+
+    result = run_suite(args.sizes, args.participants, args.seed, args.real, args.repeat,
+                       args.emotion_limit, args.e2e_limit, with_rag=not args.no_rag)
+
+    for key, run in result["runs"].items():
+        print(f"\n📊 {key}")
+        for stage, m in run["stages"].items():
+            print(f"   {stage:<12} {m['seconds']:>10.4f} c  {m['items_per_s'] or '-':>12} эл/с")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if args.save_baseline:
+        with open(DEFAULT_BASELINE, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Базовый замер сохранён: {DEFAULT_BASELINE}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.threshold)
+        if regressions:
+            print("\n❌ Регрессии производительности:")
+            for r in regressions:
+                print(f"   {r['run']} / {r['stage']}: {r['baseline_s']} → {r['current_s']} c (x{r['ratio']})")
+            sys.exit(1)
+        print("\n✅ Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
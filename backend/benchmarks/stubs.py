@@ -0,0 +1,49 @@
+"""
+Заглушки ML-моделей для бенчмарков и проверок без загрузки весов.
+
+Ответы детерминированы и зависят только от входного текста, поэтому
+замеры изолируют накладные расходы конвейера от скорости самих моделей.
+"""
+import hashlib
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.md5(text.encode("utf-8")).digest()
+
+
+class StubEmotionModel:
+    """Заменяет pipeline модели эмоций: тот же формат ответа, псевдослучайные оценки."""
+
+    def __call__(self, text):
+        texts = [text] if isinstance(text, str) else list(text)
+        out = []
+        for t in texts:
+            d = _digest(t)
+            raw = [d[0] + 1, d[1] + 1, d[2] + 1]
+            total = sum(raw)
+            out.append([
+                {"label": "negative", "score": raw[0] / total},
+                {"label": "neutral", "score": raw[1] / total},
+                {"label": "positive", "score": raw[2] / total},
+            ])
+        return out
+
+
+class StubEmbeddingModel:
+    """Заменяет SentenceTransformer: нормированные векторы из хеша текста."""
+
+    def __init__(self, dim: int = 64):
+        self.dim = dim
+
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=True, **kwargs):
+        import numpy as np
+
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        embs = np.empty((len(texts), self.dim), dtype="float32")
+        for i, t in enumerate(texts):
+            seed = int.from_bytes(_digest(t)[:4], "little")
+            embs[i] = np.random.default_rng(seed).standard_normal(self.dim)
+        if normalize_embeddings:
+            embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+        return embs[0] if single else embs
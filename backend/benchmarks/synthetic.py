@@ -0,0 +1,112 @@
+"""
+Генератор синтетических русскоязычных диалогов для бенчмарков.
+
+Сообщения собираются из тех же словарей, что используют анализаторы
+(ключевые слова тем и эмоциональные паттерны TopicAnalyzer, ключевые слова
+DISCAnalyze), плюс нейтральные слова-связки и эмодзи. Генерация полностью
+определяется seed, поэтому одинаковые параметры дают одинаковый диалог.
+
+    python -m benchmarks.synthetic --messages 100000 --participants 5 --out /tmp/synth.json
+"""
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator
+
+from analyzers.disc_class import DISCAnalyze
+from analyzers.topic_class import TopicAnalyzer
+
+NAMES = ["Марина", "Сергей", "Анна", "Дмитрий", "Ольга", "Иван", "Екатерина", "Алексей",
+         "Наталья", "Павел", "Юлия", "Михаил", "Татьяна", "Андрей", "Светлана", "Николай"]
+FILLERS = ["ну", "вот", "кстати", "слушай", "короче", "а", "и", "может", "сегодня", "завтра",
+           "вообще", "мне", "тебе", "кажется", "давай", "потом", "сейчас", "уже", "ещё", "просто"]
+EMOJI = ["😊", "😂", "❤️", "😴", "🙄", "😢", "👍", "🔥", "😅", "🤔"]
+ENDINGS = [".", "!", "?", "...", ""]
+
+
+class SyntheticDialogGenerator:
+    """
+    Генератор диалогов на основе лексиконов анализаторов.
+
+    Атрибуты:
+        seed (int): Начальное значение генератора случайных чисел.
+        vocab (list[str]): Ключевые слова тем, паттерны эмоций и слова DISC.
+    """
+
+    def __init__(self, seed: int = 42, keyword_rate: float = 0.6, emoji_rate: float = 0.2):
+        self.seed = seed
+        self.keyword_rate = keyword_rate
+        self.emoji_rate = emoji_rate
+
+        topics = TopicAnalyzer()
+        disc = DISCAnalyze("")
+        self.vocab = sorted({w for words in topics.topic_keywords.values() for w in words} |
+                            {p for patterns in topics.emotion_patterns.values() for p in patterns} |
+                            set(disc._d_keywords + disc._i_keywords + disc._s_keywords + disc._c_keywords))
+
+    def _message_text(self, rng: random.Random) -> str:
+        words = rng.choices(FILLERS, k=rng.randint(2, 8))
+        # Часть сообщений несёт ключевые слова — чтобы анализаторам было что находить
+        while rng.random() < self.keyword_rate:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(self.vocab))
+            if len(words) > 20:
+                break
+        text = " ".join(words)
+        text = text[0].upper() + text[1:] + rng.choice(ENDINGS)
+        if rng.random() < self.emoji_rate:
+            text += " " + rng.choice(EMOJI)
+        return text
+
+    def iter_messages(self, n_messages: int, n_participants: int = 2,
+                      start: datetime = datetime(2025, 4, 10, 7, 0)) -> Iterator[Dict[str, str]]:
+        """Лениво выдаёт сообщения — миллион сообщений не нужно держать в памяти."""
+        rng = random.Random(self.seed)
+        names = NAMES[:n_participants] if n_participants <= len(NAMES) else \
+            NAMES + [f"Участник {i}" for i in range(len(NAMES) + 1, n_participants + 1)]
+        current = start
+        sender = rng.randrange(n_participants)
+        for _ in range(n_messages):
+            # Ответы чаще идут от другого участника, паузы — от секунд до часов
+            if rng.random() < 0.7:
+                sender = rng.randrange(n_participants)
+            current += timedelta(seconds=int(rng.expovariate(1 / 240)) + 1)
+            yield {
+                "sender": names[sender],
+                "text": self._message_text(rng),
+                "time": current.strftime("%Y-%m-%d %H:%M"),
+            }
+
+    def generate(self, n_messages: int, n_participants: int = 2) -> Dict[str, Any]:
+        """Возвращает диалог в формате MainAnalyzer."""
+        return {
+            "dialog_id": f"synthetic_{n_messages}_{n_participants}_{self.seed}",
+            "title": f"Синтетический диалог: {n_messages} сообщений, {n_participants} участника(ов)",
+            "messages": list(self.iter_messages(n_messages, n_participants)),
+        }
+
+    def write(self, path: str, n_messages: int, n_participants: int = 2):
+        """Пишет диалог в файл потоково, не собирая список сообщений в памяти."""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('{"dialog_id": "synthetic_%d_%d_%d", "title": %s, "messages": [\n'
+                    % (n_messages, n_participants, self.seed,
+                       json.dumps(f"Синтетический диалог: {n_messages} сообщений", ensure_ascii=False)))
+            for i, msg in enumerate(self.iter_messages(n_messages, n_participants)):
+                f.write(("" if i == 0 else ",\n") + json.dumps(msg, ensure_ascii=False))
+            f.write("\n]}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор синтетических диалогов")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--participants", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+
+    SyntheticDialogGenerator(args.seed).write(args.out, args.messages, args.participants)
+    print(f"✅ {args.messages} сообщений → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Бенчмарк распределения потоков (thread_budget.py) против настроек по умолчанию.
+
+Запускает --workers процессов, которые одновременно крутят одну и ту же
+нагрузку, и считает общую пропускную способность (операций в секунду):
+    default — каждая библиотека берёт потоки сама (обычно по числу ядер)
+    budget  — потоки из ThreadBudget: ядра делятся между воркерами,
+              с --pin воркеры привязаны к своим ядрам
+
+Нагрузки:
+    blas     — умножение матриц numpy (OpenBLAS/MKL), без моделей
+    emotion  — модель эмоций XLM-R на батче сообщений (нужен transformers)
+    faiss    — поиск по IndexFlatL2 (нужен faiss)
+
+Запуск (из каталога backend):
+    python -m benchmarks.threads_bench --workers 4 --engine blas --seconds 10
+    python -m benchmarks.threads_bench --workers 2 --engine emotion --pin --out threads.json
+
+Выигрыш заметен, только когда процессов с потоками больше, чем ядер
+(на одном ядре обе схемы совпадают).
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import time
+
+import thread_budget
+
+TEXTS = [
+    "не могу больше это терпеть, ты опять опоздал",
+    "спасибо большое, очень выручил сегодня",
+    "давай обсудим план на выходные",
+    "мне кажется, ты меня совсем не слушаешь",
+] * 4
+
+
+def _workload(engine: str):
+    """Одна операция нагрузки (функция без аргументов) и число единиц работы в ней."""
+    if engine == "blas":
+        import numpy as np
+
+        rng = np.random.default_rng(0)
+        a = rng.standard_normal((768, 768), dtype=np.float32)
+        b = rng.standard_normal((768, 768), dtype=np.float32)
+        return (lambda: a @ b), 1
+    if engine == "emotion":
+        from analyzers.emotion_class import _build_emotion_model
+
+        model = _build_emotion_model()
+        return (lambda: model(TEXTS)), len(TEXTS)
+    if engine == "faiss":
+        import faiss
+        import numpy as np
+
+        thread_budget.current().apply_faiss()
+        rng = np.random.default_rng(0)
+        index = faiss.IndexFlatL2(1024)
+        index.add(rng.standard_normal((20000, 1024), dtype=np.float32))
+        queries = rng.standard_normal((16, 1024), dtype=np.float32)
+        return (lambda: index.search(queries, 5)), len(queries)
+    raise ValueError(f"Неизвестная нагрузка {engine!r}")
+
+
+def _worker(mode: str, engine: str, index: int, workers: int, pin: bool, seconds: float, barrier, queue):
+    try:
+        if mode == "budget":
+            thread_budget.configure(workers=workers, index=index, pin=pin)
+        else:
+            for var in thread_budget.OMP_VARS:
+                os.environ.pop(var, None)
+        torch_default = None
+        if engine == "emotion" and mode == "default":
+            import torch
+            torch_default = torch.get_num_threads()
+        op, units = _workload(engine)
+        if torch_default is not None:
+            # _build_emotion_model применяет бюджет — возвращаем умолчание torch
+            import torch
+            torch.set_num_threads(torch_default)
+        op()  # прогрев
+
+        barrier.wait()
+        done = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            op()
+            done += units
+        queue.put({"index": index, "units": done, "elapsed_s": time.perf_counter() - start})
+    except Exception as e:
+        barrier.abort()
+        queue.put({"index": index, "error": str(e)})
+
+
+def run(mode: str, engine: str, workers: int, seconds: float, pin: bool = False) -> dict:
+    """Одновременный прогон workers процессов; общая пропускная способность в единицах/с."""
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(workers)
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(mode, engine, i, workers, pin, seconds, barrier, queue))
+             for i in range(workers)]
+    for proc in procs:
+        proc.start()
+    results = [queue.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+
+    errors = [r["error"] for r in results if "error" in r]
+    if errors:
+        return {"mode": mode, "error": errors[0]}
+    throughput = sum(r["units"] / r["elapsed_s"] for r in results)
+    per_worker = sorted(r["units"] / r["elapsed_s"] for r in results)
+    return {
+        "mode": mode,
+        "throughput": round(throughput, 2),
+        "slowest_worker": round(per_worker[0], 2),
+        "fastest_worker": round(per_worker[-1], 2),
+    }
+
+
+def host_info() -> dict:
+    """Машина прогона — без неё число в отчёте не с чем сравнивать."""
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), cpu)
+    except OSError:
+        pass
+    return {"cpu": cpu, "cpu_count": os.cpu_count(), "cores_available": thread_budget.available_cores(),
+            "platform": platform.platform()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк распределения CPU-потоков между воркерами")
+    parser.add_argument("--engine", choices=["blas", "emotion", "faiss"], default="blas")
+    parser.add_argument("--workers", type=int, default=max(2, thread_budget.available_cores() // 2))
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--pin", action="store_true", help="Привязать воркеры к своим ядрам")
+    parser.add_argument("--out", help="Куда сохранить JSON-отчёт")
+    args = parser.parse_args()
+
+    budget = thread_budget.ThreadBudget(workers=args.workers)
+    cores = thread_budget.available_cores()
+    print(f"🧮 Ядер доступно: {cores}, воркеров: {args.workers}, "
+          f"потоки на воркер: {budget.as_dict()}")
+    if cores < 2:
+        print("⚠️ Одно ядро: обе схемы дают по одному потоку, ускорение не показательно")
+    reports = [run(mode, args.engine, args.workers, args.seconds, args.pin) for mode in ("default", "budget")]
+    for r in reports:
+        if "error" in r:
+            print(f"❌ {r['mode']}: {r['error']}")
+            continue
+        print(f"⏱️ {r['mode']}: {r['throughput']} ед/с (воркеры {r['slowest_worker']}–{r['fastest_worker']})")
+
+    report = {
+        "engine": args.engine,
+        "workers": args.workers,
+        "cores": cores,
+        "host": host_info(),
+        "seconds": args.seconds,
+        "pin": args.pin,
+        "threads": budget.as_dict(),
+        "runs": reports,
+        # Сравнение имеет смысл, только когда потоков по умолчанию больше, чем ядер на воркер
+        "conclusive": cores >= 2,
+    }
+    if all("throughput" in r for r in reports) and reports[0]["throughput"]:
+        report["speedup"] = round(reports[1]["throughput"] / reports[0]["throughput"], 3)
+        print(f"🚀 Ускорение с бюджетом потоков: ×{report['speedup']}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
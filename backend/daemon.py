@@ -0,0 +1,270 @@
+"""
+Резидентный демон анализа: модели загружаются один раз и остаются «тёплыми».
+
+Запуск (из каталога backend):
+    python daemon.py --port 8765                 # HTTP на 127.0.0.1
+    python daemon.py --socket /tmp/webpsycho.sock  # Unix-сокет
+
+Эндпоинты:
+    GET  /health   — состояние, время работы, число обработанных заданий, реестр моделей
+    GET  /metrics  — метрики в формате Prometheus (при WEBPSYCHO_METRICS=1)
+    POST /analyze  — тело: диалог в формате MainAnalyzer; ?advice=1 — добавить совет,
+                     ?nocache=1 — пересчитать, минуя кэш результатов
+    POST /advice   — тело: результат MainAnalyzer.analyze, ответ — совет
+    POST /reload   — перезагрузить модели без остановки (SIGHUP делает то же)
+
+Клиент — daemon_client.py.
+"""
+import argparse
+import json
+import os
+import signal
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from analyzers.emotion_class import MainAnalyzer, load_emotion_model
+from model.registry import ModelProxy, registry
+import metrics
+import thread_budget
+from storage.result_cache import ResultCache
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_KB_PATH = os.path.join(PROJECT_DIR, "lib_liter", "literature_data.json")
+# Сколько свободных анализаторов (у каждого свой пул потоков) держать между запросами
+ANALYZER_POOL_SIZE = 4
+
+
+class WarmModels:
+    """
+    Набор загруженных моделей. При перезагрузке создаётся новый набор,
+    а старый дорабатывает уже начатые запросы. Модели из реестра
+    загружаются сразу (registry.preload), а не при первом запросе.
+    """
+
+    def __init__(self, with_advice: bool, knowledge_base_path: str, result_cache: ResultCache = None):
+        self.result_cache = result_cache
+        self.loaded_at = datetime.now(timezone.utc).isoformat()
+        self.emotion_model = load_emotion_model()
+        self.advisor = None
+        if with_advice:
+            from model.rag_adviser import RAGPsychologyAdvisor
+            self.advisor = RAGPsychologyAdvisor(knowledge_base_path=knowledge_base_path)
+        names = [self.emotion_model.name] if isinstance(self.emotion_model, ModelProxy) else []
+        if self.advisor is not None:
+            names += self.advisor.registered_models
+        registry.preload(*names)
+        # Свободные анализаторы: ThreadingHTTPServer заводит поток на каждое соединение,
+        # поэтому анализатор берётся из общего пула на время запроса и возвращается в него
+        self._idle = []
+        self._pool_lock = threading.Lock()
+        self._closed = False
+
+    @contextmanager
+    def analyzer(self):
+        """MainAnalyzer хранит состояние между этапами — на время запроса он выдаётся одному потоку."""
+        with self._pool_lock:
+            analyzer = self._idle.pop() if self._idle else None
+        if analyzer is None:
+            analyzer = MainAnalyzer(emotion_model=self.emotion_model, result_cache=self.result_cache)
+        try:
+            yield analyzer
+        finally:
+            with self._pool_lock:
+                keep = not self._closed and len(self._idle) < ANALYZER_POOL_SIZE
+                if keep:
+                    self._idle.append(analyzer)
+            if not keep:
+                analyzer.close()
+
+    def close(self):
+        """Закрывает свободные анализаторы; занятые закроются, когда их вернут."""
+        with self._pool_lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for analyzer in idle:
+            analyzer.close()
+
+    def advice(self, analysis):
+        if self.advisor is None:
+            raise RuntimeError("Демон запущен без советчика (--no-advice)")
+        return self.advisor.generate_advice(analysis)
+
+
+class AnalysisDaemon:
+    """Состояние демона: текущие модели, счётчики и перезагрузка."""
+
+    def __init__(self, with_advice: bool = True, knowledge_base_path: str = DEFAULT_KB_PATH,
+                 result_cache: ResultCache = None):
+        self.with_advice = with_advice
+        # Кэш переживает перезагрузку: версии моделей входят в ключ
+        self.result_cache = result_cache
+        self.knowledge_base_path = knowledge_base_path
+        self.started = time.time()
+        self.jobs_served = 0
+        self._served_lock = threading.Lock()
+        self.reloading = False
+        self._reload_lock = threading.Lock()
+        self.models = WarmModels(with_advice, knowledge_base_path, result_cache)
+
+    def reload(self):
+        """Загружает новый набор моделей и атомарно подменяет текущий."""
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            self.reloading = True
+            print("🔄 Перезагружаем модели...")
+            # Выгружаем модели из реестра, чтобы они действительно перечитались;
+            # занятые старым набором выгрузятся, когда он доработает
+            registry.unload_all()
+            old, self.models = self.models, WarmModels(self.with_advice, self.knowledge_base_path,
+                                                       self.result_cache)
+            old.close()
+            print("✅ Модели перезагружены")
+            return True
+        finally:
+            self.reloading = False
+            self._reload_lock.release()
+
+    def served(self):
+        """Учитывает обработанное задание: обработчики работают в разных потоках."""
+        with self._served_lock:
+            self.jobs_served += 1
+
+    def health(self):
+        return {
+            "status": "reloading" if self.reloading else "ok",
+            "uptime_s": round(time.time() - self.started, 1),
+            "loaded_at": self.models.loaded_at,
+            "jobs_served": self.jobs_served,
+            "advice": self.models.advisor is not None,
+            "result_cache": self.result_cache.stats() if self.result_cache is not None else None,
+            "models": registry.stats(),
+        }
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    daemon: AnalysisDaemon = None  # назначается при запуске сервера
+
+    def address_string(self):
+        # У Unix-сокета нет адреса клиента
+        return self.client_address[0] if self.client_address else "unix"
+
+    def _send(self, status: int, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length).decode("utf-8")) if length else {}
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            return self._send(200, self.daemon.health())
+        if urlparse(self.path).path == "/metrics":
+            body = metrics.export_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self._send(404, {"error": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            if url.path == "/reload":
+                threading.Thread(target=self.daemon.reload, daemon=True).start()
+                return self._send(202, {"status": "reloading"})
+
+            payload = self._read_json()
+            # Берём ссылку на текущий набор моделей один раз — перезагрузка не сломает запрос
+            models = self.daemon.models
+            if url.path == "/analyze":
+                start = time.perf_counter()
+                query = parse_qs(url.query)
+                want_advice = query.get("advice") == ["1"]
+                if want_advice and models.advisor is None:
+                    raise RuntimeError("Демон запущен без советчика (--no-advice)")
+                # Извлечение фактов и генерация — этапы того же графа, что и анализ
+                with models.analyzer() as analyzer:
+                    result = analyzer.analyze(payload, advisor=models.advisor if want_advice else None,
+                                              use_cache=query.get("nocache") != ["1"])
+                    stages = analyzer.stage_report
+                self.daemon.served()
+                return self._send(200, {"result": result, "stages": stages,
+                                        "elapsed_s": round(time.perf_counter() - start, 4)})
+            if url.path == "/advice":
+                self.daemon.served()
+                return self._send(200, {"advice": models.advice(payload)})
+            self._send(404, {"error": "Not found"})
+        except json.JSONDecodeError as e:
+            self._send(400, {"error": f"Некорректный JSON: {e}"})
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(daemon: AnalysisDaemon, host: str = "127.0.0.1", port: int = 8765, socket_path: str = None):
+    DaemonHandler.daemon = daemon
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, DaemonHandler)
+        where = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), DaemonHandler)
+        where = f"http://{host}:{port}"
+
+    # SIGHUP — перезагрузка моделей, SIGTERM — корректная остановка
+    signal.signal(signal.SIGHUP, lambda *_: threading.Thread(target=daemon.reload, daemon=True).start())
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+
+    print(f"🚀 Демон анализа слушает {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+        print("👋 Демон остановлен")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Резидентный демон анализа диалогов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", help="Слушать Unix-сокет вместо TCP")
+    parser.add_argument("--kb", default=DEFAULT_KB_PATH, help="База знаний для RAG-советчика")
+    parser.add_argument("--no-advice", action="store_true", help="Не загружать LLM и советчик")
+    parser.add_argument("--cache-dir", default=os.path.join("rag_cache", "results"),
+                        help="Каталог кэша результатов анализа")
+    parser.add_argument("--cache-max-mb", type=int, default=512)
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать кэш результатов")
+    args = parser.parse_args()
+
+    thread_budget.configure()
+    result_cache = None
+    if not args.no_cache:
+        result_cache = ResultCache(args.cache_dir, max_bytes=args.cache_max_mb * 1024 * 1024)
+    daemon = AnalysisDaemon(with_advice=not args.no_advice, knowledge_base_path=args.kb,
+                            result_cache=result_cache)
+    serve(daemon, args.host, args.port, args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Тонкий клиент демона анализа (daemon.py).
+
+    python daemon_client.py health
+    python daemon_client.py analyze ../dialogs/1.json --advice --out ../analysis_results/1_analysis.json
+    python daemon_client.py reload
+
+Из кода: DaemonClient(socket_path=...).analyze(data).
+"""
+import argparse
+import http.client
+import json
+import socket
+import sys
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP-соединение поверх Unix-сокета."""
+
+    def __init__(self, socket_path: str, timeout: float = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DaemonClient:
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, socket_path: str = None,
+                 timeout: float = 600):
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, payload=None):
+        if self.socket_path:
+            conn = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = json.loads(response.read().decode("utf-8") or "{}")
+            if response.status >= 400:
+                raise RuntimeError(data.get("error", f"HTTP {response.status}"))
+            return data
+        finally:
+            conn.close()
+
+    def health(self):
+        return self._request("GET", "/health")
+
+    def analyze(self, dialog, advice: bool = False, use_cache: bool = True):
+        params = [p for p, on in (("advice=1", advice), ("nocache=1", not use_cache)) if on]
+        path = "/analyze" + ("?" + "&".join(params) if params else "")
+        return self._request("POST", path, dialog)["result"]
+
+    def advice(self, analysis):
+        return self._request("POST", "/advice", analysis)["advice"]
+
+    def reload(self):
+        return self._request("POST", "/reload", {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Клиент демона анализа")
+    parser.add_argument("command", choices=["health", "analyze", "reload"])
+    parser.add_argument("path", nargs="?", help="JSON-диалог для analyze")
+    parser.add_argument("--advice", action="store_true", help="Сгенерировать совет")
+    parser.add_argument("--no-cache", action="store_true", help="Пересчитать, минуя кэш результатов демона")
+    parser.add_argument("--out", help="Куда сохранить результат analyze")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", help="Unix-сокет демона")
+    args = parser.parse_args()
+
+    client = DaemonClient(args.host, args.port, args.socket)
+    try:
+        if args.command == "health":
+            result = client.health()
+        elif args.command == "reload":
+            result = client.reload()
+        else:
+            if not args.path:
+                parser.error("analyze требует путь к диалогу")
+            with open(args.path, "r", encoding="utf-8") as f:
+                result = client.analyze(json.load(f), advice=args.advice, use_cache=not args.no_cache)
+    except (OSError, RuntimeError) as e:
+        print(f"❌ Демон недоступен или вернул ошибку: {e}")
+        sys.exit(1)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"✅ Результат сохранён в {args.out}")
+    else:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Фоны пользователей: общие базовые фоны + личные файлы.
+
+Базовые фоны лежат один раз в static/ и не копируются при регистрации —
+адрес /users/<id>/<имя> по-прежнему работает: если личного файла с таким
+именем нет, отдаётся общий. Личный файл появляется, только когда
+пользователь что-то меняет (загрузка фона). Запись всегда идёт во временный
+файл с атомарной заменой, поэтому общий файл не изменится, даже если
+личная копия была жёсткой ссылкой на него.
+
+Миграция старых каталогов, где базовые фоны скопированы каждому
+пользователю (из каталога backend):
+    python -m database.backgrounds --dedupe
+"""
+import argparse
+import filecmp
+import hashlib
+import os
+from typing import BinaryIO, Dict, Optional
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _safe_name(name: str) -> bool:
+    return bool(name) and os.path.basename(name) == name and not name.startswith(".")
+
+
+def resolve_static(static_dir: str, filename: str) -> Optional[str]:
+    """Путь к общему базовому фону или None."""
+    if not _safe_name(filename):
+        return None
+    path = os.path.join(static_dir, filename)
+    return path if os.path.isfile(path) else None
+
+
+def resolve(users_dir: str, static_dir: str, user_id: str, filename: str) -> Optional[str]:
+    """Путь к файлу пользователя: личный, иначе общий базовый; None — нет ни того, ни другого."""
+    if not _safe_name(user_id) or not _safe_name(filename):
+        return None
+    path = os.path.join(users_dir, user_id, filename)
+    if os.path.isfile(path):
+        return path
+    return resolve_static(static_dir, filename)
+
+
+def write_user_file(path: str, src: BinaryIO) -> str:
+    """
+    Атомарная запись личного файла: существующий файл (или ссылка на общий)
+    заменяется, а не дописывается. Возвращает SHA-256 содержимого, посчитанный
+    при записи, — чтобы не перечитывать файл ради ETag.
+    """
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    h = hashlib.sha256()
+    with open(tmp_path, "wb") as f:
+        for block in iter(lambda: src.read(1 << 20), b""):
+            h.update(block)
+            f.write(block)
+    os.replace(tmp_path, path)
+    return h.hexdigest()
+
+
+def dedupe_user_dirs(users_dir: str, static_dir: str, dry_run: bool = False) -> Dict[str, int]:
+    """
+    Удаляет из каталогов пользователей побайтные копии базовых фонов —
+    они будут отдаваться из static_dir по тем же адресам. Изменённые
+    пользователем файлы с теми же именами не трогаются.
+    """
+    defaults = {f for f in os.listdir(static_dir) if os.path.isfile(os.path.join(static_dir, f))}
+    stats = {"users": 0, "removed": 0, "kept_modified": 0, "freed_bytes": 0}
+    for user_id in sorted(os.listdir(users_dir)):
+        user_dir = os.path.join(users_dir, user_id)
+        if not os.path.isdir(user_dir):
+            continue
+        stats["users"] += 1
+        for name in sorted(defaults & set(os.listdir(user_dir))):
+            path = os.path.join(user_dir, name)
+            if not os.path.isfile(path):
+                continue
+            if not filecmp.cmp(path, os.path.join(static_dir, name), shallow=False):
+                stats["kept_modified"] += 1
+                continue
+            # Жёсткая ссылка на общий файл место не занимает
+            if not os.path.samefile(path, os.path.join(static_dir, name)):
+                stats["freed_bytes"] += os.path.getsize(path)
+            stats["removed"] += 1
+            if not dry_run:
+                os.remove(path)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Общие базовые фоны вместо копий у каждого пользователя")
+    parser.add_argument("--dedupe", action="store_true", help="Удалить копии базовых фонов из каталогов пользователей")
+    parser.add_argument("--dry-run", action="store_true", help="Только посчитать, ничего не удалять")
+    parser.add_argument("--users-dir", default=os.path.join(CURRENT_DIR, "users"))
+    parser.add_argument("--static-dir", default=os.path.join(CURRENT_DIR, "static"))
+    args = parser.parse_args()
+    if not args.dedupe:
+        parser.print_help()
+        return
+
+    stats = dedupe_user_dirs(args.users_dir, args.static_dir, dry_run=args.dry_run)
+    print(f"🧹 Пользователей: {stats['users']}, удалено копий: {stats['removed']}, "
+          f"изменённых оставлено: {stats['kept_modified']}, освобождено {stats['freed_bytes'] / 1e6:.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
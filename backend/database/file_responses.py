@@ -0,0 +1,171 @@
+"""
+Отдача фонов с HTTP-кэшированием, Range-запросами и миниатюрами WebP.
+
+    ETag        — сильный, по SHA-256 содержимого (хеш кэшируется по mtime и размеру;
+                  загруженный файл хешируется при записи, остальные — в пуле
+                  потоков, не в цикле событий)
+    304         — на If-None-Match с тем же ETag
+    Cache-Control — адрес с ?v=<версия> (версия = начало хеша) неизменяем и
+                  кэшируется на год; без версии — no-cache (только с проверкой ETag)
+    Range       — bytes=a-b / a- / -n (один диапазон), ответ 206 или 416
+    ?w=<ширина> — миниатюра WebP одной из THUMB_WIDTHS, создаётся при первом
+                  запросе и хранится в THUMBS_DIR под хешем исходника, поэтому
+                  общий базовый фон ужимается один раз для всех пользователей.
+
+Pillow необязателен: без него вместо миниатюры отдаётся исходный файл.
+"""
+import asyncio
+import hashlib
+import mimetypes
+import os
+import threading
+from typing import Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+THUMB_WIDTHS = (160, 320, 640, 1280)
+THUMB_QUALITY = 80
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+VERSION_LENGTH = 16
+
+_hash_cache = {}  # путь → ((mtime_ns, размер), sha256)
+_hash_lock = threading.Lock()
+_thumb_lock = threading.Lock()
+
+
+def _stamp(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def cached_hash(path: str) -> Optional[str]:
+    """SHA-256 из кэша, если файл с тех пор не менялся; иначе None."""
+    stamp = _stamp(path)
+    with _hash_lock:
+        cached = _hash_cache.get(path)
+    return cached[1] if cached is not None and cached[0] == stamp else None
+
+
+def remember_hash(path: str, digest: str):
+    """Запоминает хеш, посчитанный при записи файла (write_user_file)."""
+    stamp = _stamp(path)
+    with _hash_lock:
+        _hash_cache[path] = (stamp, digest)
+
+
+def content_hash(path: str) -> str:
+    """SHA-256 файла; пересчитывается, только если изменились mtime или размер."""
+    cached = cached_hash(path)
+    if cached is not None:
+        return cached
+    stamp = _stamp(path)
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    digest = h.hexdigest()
+    with _hash_lock:
+        _hash_cache[path] = (stamp, digest)
+    return digest
+
+
+async def content_hash_async(path: str) -> str:
+    """content_hash для обработчиков: полный пересчёт — в пуле потоков."""
+    return cached_hash(path) or await asyncio.to_thread(content_hash, path)
+
+
+async def version_of(path: str) -> str:
+    """Версия для адреса ?v=…: меняется вместе с содержимым."""
+    return (await content_hash_async(path))[:VERSION_LENGTH]
+
+
+async def versioned_url(url: str, path: Optional[str]) -> str:
+    return f"{url}?v={await version_of(path)}" if path else url
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    return header.strip() == "*" or etag in (t.strip() for t in header.split(","))
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """'bytes=a-b' → (start, end) включительно; None — диапазон не удовлетворим."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            start, end = size - int(last), size - 1
+    except ValueError:
+        return None
+    start, end = max(start, 0), min(end, size - 1)
+    return (start, end) if start <= end else None
+
+
+def thumbnail(path: str, width: int, thumbs_dir: str) -> Optional[str]:
+    """
+    Путь к WebP-миниатюре ширины width (создаётся при первом обращении).
+    None — Pillow не установлен или файл не картинка.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    thumb_path = os.path.join(thumbs_dir, f"{content_hash(path)}_{width}.webp")
+    if os.path.exists(thumb_path):
+        return thumb_path
+    with _thumb_lock:
+        if os.path.exists(thumb_path):
+            return thumb_path
+        os.makedirs(thumbs_dir, exist_ok=True)
+        try:
+            with Image.open(path) as img:
+                img.thumbnail((width, width * 4))  # уменьшает по ширине, пропорции сохраняются
+                tmp_path = f"{thumb_path}.tmp.{os.getpid()}"
+                img.save(tmp_path, "WEBP", quality=THUMB_QUALITY)
+        except (OSError, Image.DecompressionBombError):
+            # DecompressionBombError — не OSError: картинка больше предела Pillow
+            return None
+        os.replace(tmp_path, thumb_path)
+    return thumb_path
+
+
+async def serve_file(request: Request, path: str, source: Optional[str] = None) -> Response:
+    """
+    Файл с ETag, 304, Cache-Control по ?v= и поддержкой одного Range.
+    source — исходник, если path производный от него (миниатюра): версия в
+    адресе сверяется с исходником.
+    """
+    etag = f'"{await content_hash_async(path)}"'
+    version = request.query_params.get("v")
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE if version == await version_of(source or path) else REVALIDATE,
+        "Accept-Ranges": "bytes",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        size = os.path.getsize(path)
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        start, end = byte_range
+        with open(path, "rb") as f:
+            f.seek(start)
+            body = f.read(end - start + 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        return Response(body, status_code=206, headers=headers, media_type=media_type)
+
+    return FileResponse(path, headers=headers)
@@ -1,13 +1,14 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import jwt
 from typing import List
-import os, json, shutil
+from concurrent.futures import ThreadPoolExecutor
+import asyncio, os, sys, shutil, time
 
 # === CONFIG ===
 SECRET_KEY = "your-super-secret-key-change-in-production"
@@ -15,9 +16,29 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-USERS_FILE = os.path.join(CURRENT_DIR, "users.json")
-STATIC_DIR = os.path.join(CURRENT_DIR, "static")  # базовые фоны
+BACKEND_DIR = os.path.dirname(CURRENT_DIR)
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)  # analyzers/, model/, metrics.py
+
+import metrics
+from analyzers.timeline import Timeline
+from storage.message_store import MessageStore, StoreFormatError, store_dir
+from database.user_store import UserExistsError, UserStore
+from database.backgrounds import resolve as resolve_user_file, resolve_static, write_user_file
+from database.file_responses import THUMB_WIDTHS, remember_hash, serve_file, thumbnail, versioned_url
+from storage.job_queue import JobQueue, QueueFullError
+USERS_FILE = os.path.join(CURRENT_DIR, "users.json")  # старый формат, переносится в USERS_DB
+USERS_DB = os.path.join(CURRENT_DIR, "users.sqlite3")
+STATIC_DIR = os.path.join(CURRENT_DIR, "static")  # базовые фоны, общие для всех пользователей
 USERS_DIR = os.path.join(CURRENT_DIR, "users")    # папки пользователей
+THUMBS_DIR = os.path.join(CURRENT_DIR, "thumbs")  # миниатюры WebP по хешу исходника
+RESULTS_DIR = os.path.join(BACKEND_DIR, "..", "analysis_results")  # результаты batch.py
+TIMELINE_CACHE_SIZE = 16
+JOBS_DIR = os.environ.get("WEBPSYCHO_JOBS_DIR", os.path.join(BACKEND_DIR, "..", "jobs"))
+JOB_WORKERS = int(os.environ.get("WEBPSYCHO_JOB_WORKERS", "0"))   # 0 — пул запускается отдельно (job_pool.py)
+# Часов хранения завершённых заданий и результатов (0 — не удалять)
+JOB_RESULT_TTL_HOURS = float(os.environ.get("WEBPSYCHO_JOB_RESULT_TTL_HOURS", "168"))
+JOB_MAX_PENDING = int(os.environ.get("WEBPSYCHO_JOB_MAX_PENDING", "32"))
 
 os.makedirs(STATIC_DIR, exist_ok=True)
 os.makedirs(USERS_DIR, exist_ok=True)
@@ -25,12 +46,33 @@ os.makedirs(USERS_DIR, exist_ok=True)
 # === PASSWORDS & TOKENS ===
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt занимает 100–300 мс CPU: считаем его в отдельном пуле, а не в цикле событий.
+# Семафор ограничивает число одновременных задач — остальные ждут асинхронно,
+# не занимая потоки, а время ожидания идёт в метрику password_queue_seconds.
+PASSWORD_WORKERS = int(os.environ.get("WEBPSYCHO_PASSWORD_WORKERS", "2"))
+_password_pool = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+_password_slots = asyncio.Semaphore(PASSWORD_WORKERS)
+
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
+async def run_password_task(fn, *args):
+    """Выполняет hash/verify в пуле bcrypt, не блокируя остальные запросы воркера."""
+    op = fn.__name__
+    queued = time.perf_counter()
+    async with _password_slots:
+        metrics.observe("password_queue_seconds", time.perf_counter() - queued, op=op)
+        metrics.inc("password_tasks", op=op)
+
+        def task():
+            with metrics.timer("password_work", op=op):
+                return fn(*args)
+
+        return await asyncio.get_running_loop().run_in_executor(_password_pool, task)
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None) -> str:
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -61,21 +103,8 @@ class BackgroundResponse(BaseModel):
     backgrounds: List[str]
 
 # === STORAGE ===
-def load_users():
-    if not os.path.exists(USERS_FILE):
-        return {}
-    try:
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-            return json.loads(content) if content else {}
-    except json.JSONDecodeError:
-        return {}
-
-def save_users(users):
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
-
-users_db = load_users()
+# SQLite (WAL): индексы по имени и email, атомарная выдача id; users.json переносится один раз
+users_db = UserStore(USERS_DB, legacy_json=USERS_FILE)
 BASE_BACKGROUND_NAMES = [
     f for f in os.listdir(STATIC_DIR) if os.path.isfile(os.path.join(STATIC_DIR, f))
 ]
@@ -94,40 +123,25 @@ app.add_middleware(
 # === AUTH ===
 @app.post("/register/", response_model=UserResponse)
 async def register(user_data: UserRegistration):
-    for u in users_db.values():
-        if u["username"] == user_data.username:
-            raise HTTPException(status_code=400, detail="Username already exists")
+    if users_db.get_by_username(user_data.username) is not None:
+        raise HTTPException(status_code=400, detail="Username already exists")
 
-    user_id = str(max([int(uid) for uid in users_db.keys()] or [0]) + 1)
-    hashed = get_password_hash(user_data.password)
-
-    user_dir = os.path.join(USERS_DIR, user_id)
-    os.makedirs(user_dir, exist_ok=True)
+    hashed = await run_password_task(get_password_hash, user_data.password)
+    try:
+        user_id = users_db.create_user(user_data.username, user_data.email, hashed,
+                                       BASE_BACKGROUND_NAMES)["user_id"]
+    except UserExistsError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    # Скопировать базовые фоны пользователю
-    user_backgrounds = []
-    for f in BASE_BACKGROUND_NAMES:
-        src = os.path.join(STATIC_DIR, f)
-        dst = os.path.join(user_dir, f)
-        shutil.copy2(src, dst)
-        user_backgrounds.append(f"/users/{user_id}/{f}")
-
-    users_db[user_id] = {
-        "user_id": user_id,
-        "username": user_data.username,
-        "email": user_data.email,
-        "hashed_password": hashed,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "backgrounds": user_backgrounds,
-    }
-    save_users(users_db)
+    # Базовые фоны не копируются: /users/<id>/<имя> отдаёт общий файл из STATIC_DIR
+    os.makedirs(os.path.join(USERS_DIR, user_id), exist_ok=True)
 
     return UserResponse(user_id=user_id, username=user_data.username, email=user_data.email)
 
 @app.post("/login", response_model=Token)
 async def login(user_data: UserLogin):
-    user = next((u for u in users_db.values() if u["username"] == user_data.username), None)
-    if not user or not verify_password(user_data.password, user["hashed_password"]):
+    user = users_db.get_by_username(user_data.username)
+    if not user or not await run_password_task(verify_password, user_data.password, user["hashed_password"]):
         raise HTTPException(status_code=401, detail="Incorrect username or password")
     token = create_access_token({"sub": user["user_id"]})
     return Token(access_token=token, token_type="bearer", user_id=user["user_id"])
@@ -135,13 +149,18 @@ async def login(user_data: UserLogin):
 # === BACKGROUNDS ===
 @app.get("/backgrounds/{user_id}", response_model=BackgroundResponse)
 async def get_backgrounds(user_id: str):
-    if user_id not in users_db:
+    if not users_db.exists(user_id):
         raise HTTPException(status_code=404, detail="User not found")
-    return {"backgrounds": users_db[user_id]["backgrounds"]}
+    # ?v=<хеш содержимого>: такие адреса браузер кэширует надолго без проверок
+    backgrounds = []
+    for rel in users_db.backgrounds(user_id):
+        path = resolve_user_file(USERS_DIR, STATIC_DIR, user_id, os.path.basename(rel))
+        backgrounds.append(await versioned_url(rel, path))
+    return {"backgrounds": backgrounds}
 
 @app.post("/upload_background/")
 async def upload_background(user_id: str = Form(...), file: UploadFile = File(...)):
-    if user_id not in users_db:
+    if not users_db.exists(user_id):
         raise HTTPException(status_code=404, detail="User not found")
 
     ext = os.path.splitext(file.filename)[1].lower()
@@ -151,24 +170,211 @@ async def upload_background(user_id: str = Form(...), file: UploadFile = File(..
     user_dir = os.path.join(USERS_DIR, user_id)
     os.makedirs(user_dir, exist_ok=True)
 
+    # Личная копия появляется только здесь; атомарная замена не трогает общий файл.
+    # Хеш для ETag считается при записи — первый запрос фона не перечитывает файл
     path = os.path.join(user_dir, file.filename)
-    with open(path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    remember_hash(path, await asyncio.to_thread(write_user_file, path, file.file))
 
     rel = f"/users/{user_id}/{file.filename}"
-    if rel not in users_db[user_id]["backgrounds"]:
-        users_db[user_id]["backgrounds"].append(rel)
-        save_users(users_db)
+    users_db.add_background(user_id, rel)
 
     return {"message": "Background uploaded", "path": rel}
 
+async def serve_image(request: Request, path: str, w: int | None):
+    """Картинка или её миниатюра ширины w (из THUMB_WIDTHS) с HTTP-кэшированием."""
+    if w is None:
+        return await serve_file(request, path)
+    if w not in THUMB_WIDTHS:
+        raise HTTPException(status_code=400, detail=f"w must be one of {list(THUMB_WIDTHS)}")
+    thumb = await asyncio.to_thread(thumbnail, path, w, THUMBS_DIR)
+    return await serve_file(request, thumb, source=path) if thumb else await serve_file(request, path)
+
 @app.get("/users/{user_id}/{filename}")
-async def get_user_file(user_id: str, filename: str):
-    path = os.path.join(USERS_DIR, user_id, filename)
-    if not os.path.exists(path):
+async def get_user_file(request: Request, user_id: str, filename: str, w: int | None = None):
+    path = resolve_user_file(USERS_DIR, STATIC_DIR, user_id, filename)
+    if path is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return await serve_image(request, path, w)
+
+@app.get("/static/{filename}")
+async def get_static_file(request: Request, filename: str, w: int | None = None):
+    path = resolve_static(STATIC_DIR, filename)
+    if path is None:
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(path)
+    return await serve_image(request, path, w)
+
 
+# === TIMELINE ===
+_timeline_cache = {}  # путь → (mtime, Timeline), по давности обращения
+
+def load_timeline(dialog_name: str) -> Timeline:
+    """Timeline из <dialog_name>_timeline.npz; последние открытые держим в памяти."""
+    if not dialog_name or os.path.basename(dialog_name) != dialog_name or dialog_name.startswith("."):
+        raise HTTPException(status_code=400, detail="Invalid dialog name")
+    path = os.path.join(RESULTS_DIR, f"{dialog_name}_timeline.npz")
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="Timeline not found")
+    cached = _timeline_cache.pop(path, None)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, Timeline.load(path))
+    _timeline_cache[path] = cached
+    while len(_timeline_cache) > TIMELINE_CACHE_SIZE:
+        _timeline_cache.pop(next(iter(_timeline_cache)))
+    return cached[1]
+
+@app.get("/timeline/{dialog_name}")
+async def get_timeline(dialog_name: str, start: str | None = None, end: str | None = None,
+                       sender: str | None = None, step: int = 0):
+    """
+    Эмоции, DISC и темы диалога за [start, end) (ISO-дата/время, необязательно),
+    по всему диалогу или одному участнику. step > 0 — ещё и ряд точек по step корзин.
+    """
+    timeline = load_timeline(dialog_name)
+    try:
+        response = {"timeline": timeline.summary(), "aggregate": timeline.aggregate(start, end, sender)}
+        if step > 0:
+            response["series"] = timeline.series(start, end, sender, step)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Sender not found")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid start/end")
+    return response
+
+
+# === MESSAGES ===
+_message_stores = {}  # путь → (mtime, MessageStore), по давности обращения
+
+def load_message_store(dialog_name: str) -> MessageStore:
+    """MessageStore из <dialog_name>_messages/ (batch.py --format mmap); файлы отображаются в память."""
+    if not dialog_name or os.path.basename(dialog_name) != dialog_name or dialog_name.startswith("."):
+        raise HTTPException(status_code=400, detail="Invalid dialog name")
+    path = store_dir(RESULTS_DIR, dialog_name)
+    try:
+        mtime = os.path.getmtime(os.path.join(path, "meta.json"))
+    except OSError:
+        raise HTTPException(status_code=404, detail="Message store not found")
+    cached = _message_stores.pop(path, None)
+    if cached is None or cached[0] != mtime:
+        try:
+            cached = (mtime, MessageStore(path))
+        except StoreFormatError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    _message_stores[path] = cached
+    while len(_message_stores) > TIMELINE_CACHE_SIZE:
+        _message_stores.pop(next(iter(_message_stores)))
+    return cached[1]
+
+@app.get("/messages/{dialog_name}")
+async def get_messages(dialog_name: str, offset: int = 0, limit: int = 50, sender: str | None = None,
+                       start: str | None = None, end: str | None = None, emotion: str | None = None,
+                       min_score: float | None = None, sort: str = "index"):
+    """
+    Страница результатов по сообщениям: фильтры по участнику, времени [start, end)
+    и порогу эмоции (emotion, min_score); sort=negative — самые негативные сначала.
+    Сочетания фильтров без индекса по большому диалогу — 400 (см. storage/message_store.py).
+    """
+    if offset < 0 or not 0 < limit <= 500:
+        raise HTTPException(status_code=400, detail="offset >= 0, 0 < limit <= 500")
+    store = load_message_store(dialog_name)
+    try:
+        page = store.query(offset, limit, sender=sender, start=start, end=end, emotion=emotion,
+                           min_score=min_score, sort=sort)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Sender not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"offset": offset, "limit": limit, **page}
+
+
+# === JOBS ===
+job_queue = JobQueue(JOBS_DIR, max_pending=JOB_MAX_PENDING)
+job_pool = None
+
+@app.on_event("startup")
+async def start_job_pool():
+    global job_pool
+    if JOB_WORKERS > 0:
+        from job_pool import JobPool
+        job_pool = JobPool(JOBS_DIR, JOB_WORKERS, result_ttl=JOB_RESULT_TTL_HOURS * 3600)
+        job_pool.start()
+
+@app.on_event("shutdown")
+async def stop_job_pool():
+    if job_pool is not None:
+        job_pool.stop()
+
+def _job_view(job: dict) -> dict:
+    view = {k: job[k] for k in ("job_id", "status", "kind", "progress", "stage", "error",
+                                "submitted_at", "started_at", "finished_at")}
+    if "position" in job:
+        view["queue_position"] = job["position"]
+    return view
+
+def _save_upload(file: UploadFile, path: str):
+    # Воркер прочитает входной файл сам
+    with open(path, "wb") as f:
+        shutil.copyfileobj(file.file, f)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...), kind: str = Form("dialog"), advice: bool = Form(False)):
+    """
+    Ставит диалог в очередь анализа: kind=dialog — JSON в формате MainAnalyzer,
+    kind=telegram — экспорт чата Telegram. Ответ — job_id; при полной очереди 429,
+    без живых воркеров 503 (оба с Retry-After).
+    """
+    if kind not in ("dialog", "telegram"):
+        raise HTTPException(status_code=400, detail="kind must be 'dialog' or 'telegram'")
+    if job_queue.alive_workers() == 0:
+        raise HTTPException(status_code=503, detail="No analysis workers running", headers={"Retry-After": "30"})
+
+    job_id = JobQueue.new_id()
+    input_path = job_queue.input_path(job_id)
+    try:
+        job_queue.check_capacity()
+        # Копия тела на диск — в пуле потоков, чтобы не держать цикл событий
+        await asyncio.to_thread(_save_upload, file, input_path)
+        job_queue.submit(job_id, kind, input_path, {"advice": advice})
+    except QueueFullError as e:
+        if os.path.exists(input_path):
+            os.remove(input_path)
+        metrics.inc("jobs_rejected")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    metrics.inc("jobs_submitted", kind=kind)
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_view(job)
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """
+    Результат задания. Пока оно в работе — 202 со статусом; упавшее задание —
+    200 со status=failed и ошибкой (сервер при этом исправен). Завершённые
+    задания удаляются через WEBPSYCHO_JOB_RESULT_TTL_HOURS — затем 404.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "failed":
+        return _job_view(job)
+    if job["status"] != "done":
+        return JSONResponse(_job_view(job), status_code=202, headers={"Retry-After": "5"})
+    if not os.path.exists(job["result_path"]):
+        raise HTTPException(status_code=404, detail="Job result expired")
+    return FileResponse(job["result_path"], media_type="application/json")
+
+
+# === METRICS ===
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Метрики в текстовом формате Prometheus (сбор включается WEBPSYCHO_METRICS=1)."""
+    return PlainTextResponse(metrics.export_prometheus(), media_type="text/plain; version=0.0.4")
 
 
 # === FRONTEND ===
@@ -0,0 +1,221 @@
+"""
+Хранилище пользователей на SQLite (режим WAL).
+
+Заменяет users.json, который целиком переписывался на каждую регистрацию
+и загрузку фона. Поиск по имени — по уникальному индексу, id выдаёт сама
+база (INSERT атомарен), поэтому несколько воркеров uvicorn могут работать
+с одним файлом, а падение посреди записи не теряет данные.
+
+При первом открытии пустой базы пользователи переносятся из users.json
+(файл переименовывается в users.json.migrated). Перенос всё или ничего:
+если хотя бы одна запись не переносится, база остаётся пустой, а
+users.json — на месте. id переносятся как есть, и новые id выдаются
+после наибольшего старого — каталоги users/<id>/ не достаются чужим.
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+# email NULL — не указан; сравнивается без учёта регистра (как в migrate_from_json).
+# duplicate_email=1 — старый пользователь из users.json с тем же email, что
+# у другого (уникальность email проверялась не всегда).
+# Уникальный индекс email на них не распространяется, но новый пользователь
+# такой email не получит: его держит первая запись.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    email TEXT COLLATE NOCASE,
+    hashed_password TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    duplicate_email INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS users_username ON users(username);
+CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users(email)
+    WHERE email IS NOT NULL AND duplicate_email = 0;
+CREATE TABLE IF NOT EXISTS backgrounds (
+    user_id INTEGER NOT NULL REFERENCES users(user_id),
+    position INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (user_id, path)
+);
+"""
+
+
+class UserExistsError(ValueError):
+    """Имя пользователя или email уже заняты (field — какое поле)."""
+
+    def __init__(self, field: str):
+        super().__init__(f"{field} already exists")
+        self.field = field
+
+
+class MigrationError(RuntimeError):
+    """users.json не перенесён: база не тронута, файл оставлен на месте."""
+
+
+class UserStore:
+    """
+    Пользователи и их фоны в SQLite.
+
+    Соединение своё у каждого потока; id пользователей наружу отдаются
+    строками, как и раньше в users.json.
+
+    Атрибуты:
+        path (str): Путь к файлу базы.
+    """
+
+    def __init__(self, path: str, legacy_json: Optional[str] = None):
+        self.path = path
+        self._local = threading.local()
+        self._init_schema()
+        if legacy_json and os.path.exists(legacy_json):
+            self.migrate_from_json(legacy_json)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        self._conn().executescript(SCHEMA)
+
+    def _user(self, row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        user = dict(row)
+        user["user_id"] = str(user["user_id"])
+        user["email"] = user["email"] or ""
+        user.pop("duplicate_email", None)
+        return user
+
+    # ---------------------- ЧТЕНИЕ ----------------------
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            uid = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        return self._user(self._conn().execute("SELECT * FROM users WHERE user_id = ?", (uid,)).fetchone())
+
+    def get_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        return self._user(self._conn().execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone())
+
+    def exists(self, user_id: str) -> bool:
+        return self.get(user_id) is not None
+
+    def backgrounds(self, user_id: str) -> List[str]:
+        rows = self._conn().execute("SELECT path FROM backgrounds WHERE user_id = ? ORDER BY position",
+                                    (int(user_id),))
+        return [r["path"] for r in rows]
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    # ---------------------- ЗАПИСЬ ----------------------
+    def create_user(self, username: str, email: str, hashed_password: str,
+                    background_names: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Добавляет пользователя и его фоны одной транзакцией.
+
+        background_names — имена файлов; пути в базе — /users/<id>/<имя>.
+        Raises:
+            UserExistsError: Имя пользователя или email уже заняты.
+        """
+        conn = self._conn()
+        created_at = datetime.now(timezone.utc).isoformat()
+        try:
+            with conn:
+                cur = conn.execute(
+                    "INSERT INTO users (username, email, hashed_password, created_at) VALUES (?, ?, ?, ?)",
+                    (username, email or None, hashed_password, created_at))
+                uid = cur.lastrowid
+                conn.executemany("INSERT INTO backgrounds (user_id, position, path) VALUES (?, ?, ?)",
+                                 [(uid, i, f"/users/{uid}/{name}")
+                                  for i, name in enumerate(background_names or [])])
+        except sqlite3.IntegrityError as e:
+            raise UserExistsError("Email" if "email" in str(e) else "Username") from e
+        return {"user_id": str(uid), "username": username, "email": email,
+                "hashed_password": hashed_password, "created_at": created_at}
+
+    def add_background(self, user_id: str, path: str) -> bool:
+        """Добавляет фон в конец списка; False — такой уже есть."""
+        conn = self._conn()
+        with conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO backgrounds (user_id, position, path) "
+                "SELECT ?, COALESCE(MAX(position), -1) + 1, ? FROM backgrounds WHERE user_id = ?",
+                (int(user_id), path, int(user_id)))
+        return cur.rowcount > 0
+
+    # ---------------------- МИГРАЦИЯ ----------------------
+    def migrate_from_json(self, json_path: str) -> int:
+        """
+        Однократный перенос из users.json в пустую базу одной транзакцией.
+        Возвращает число перенесённых пользователей. Пустой email
+        сохраняется как NULL, повторный — с пометкой duplicate_email.
+
+        Raises:
+            MigrationError: Запись не переносится (повтор имени, нет полей) —
+                            транзакция откатывается, users.json не переименовывается.
+        """
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                content = f.read().strip()
+            users = json.loads(content) if content else {}
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"⚠️ Не удалось прочитать {json_path}: {e}")
+            return 0
+
+        conn = self._conn()
+        failures, duplicates = [], 0
+        seen_emails = set()
+        with conn:
+            # Блокировка записи: при нескольких воркерах переносит только первый
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]:
+                return 0
+            for user_id, user in sorted(users.items(), key=lambda kv: int(kv[0])):
+                email = (user.get("email") or "").strip() or None
+                duplicate = email is not None and email.lower() in seen_emails
+                try:
+                    conn.execute(
+                        "INSERT INTO users (user_id, username, email, hashed_password, created_at, duplicate_email) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (int(user_id), user["username"], email, user["hashed_password"],
+                         user.get("created_at") or datetime.now(timezone.utc).isoformat(), int(duplicate)))
+                    conn.executemany("INSERT OR IGNORE INTO backgrounds (user_id, position, path) VALUES (?, ?, ?)",
+                                     [(int(user_id), i, p) for i, p in enumerate(user.get("backgrounds", []))])
+                except (sqlite3.IntegrityError, KeyError, ValueError) as e:
+                    failures.append(f"{user_id} ({user.get('username')}): {e!r}")
+                    continue
+                if email is not None:
+                    seen_emails.add(email.lower())
+                duplicates += duplicate
+            if failures:
+                conn.rollback()
+                raise MigrationError(f"{json_path} не перенесён, записей с ошибками: {len(failures)}: "
+                                     + "; ".join(failures[:10]))
+            if users:
+                # Новые id — после наибольшего старого, даже если последние записи удалялись
+                top = max(int(uid) for uid in users)
+                if conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'users'",
+                                (top,)).rowcount == 0:
+                    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('users', ?)", (top,))
+        migrated = len(users)
+        if duplicates:
+            print(f"⚠️ Пользователей с повторяющимся email: {duplicates} (перенесены, email помечен как повтор)")
+        try:
+            os.replace(json_path, f"{json_path}.migrated")
+        except OSError:
+            pass
+        print(f"✅ Перенесено пользователей из {os.path.basename(json_path)}: {migrated}")
+        return migrated
@@ -0,0 +1,217 @@
+"""
+Пул процессов-воркеров для асинхронных заданий анализа (очередь — storage/job_queue.py).
+
+Каждый воркер — отдельный процесс, который один раз загружает модели
+(как демон) и затем по одному забирает задания из постоянной очереди.
+Число процессов ограничено, а лишние задания ждут в очереди на диске,
+а не в памяти. Упавший воркер перезапускается, его задание возвращается
+в очередь. Завершённые задания и их результаты пул удаляет через
+--result-ttl часов.
+
+Запуск отдельно от API (из каталога backend):
+    python job_pool.py --workers 2 --jobs-dir ../jobs
+или внутри сервера: WEBPSYCHO_JOB_WORKERS=2 uvicorn database.server:app
+
+Входные данные задания:
+    dialog   — диалог в формате MainAnalyzer
+    telegram — экспорт одного чата Telegram (result.json), разбирается потоково
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import signal
+import socket
+import threading
+import time
+from typing import Any, Dict
+
+import thread_budget
+from storage.job_queue import HEARTBEAT_TTL, RESULT_TTL, JobQueue
+from storage.result_cache import ResultCache
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_JOBS_DIR = os.path.join(PROJECT_DIR, "jobs")
+DEFAULT_KB_PATH = os.path.join(PROJECT_DIR, "lib_liter", "literature_data.json")
+POLL_INTERVAL = 0.5  # секунд между проверками пустой очереди
+EXPIRE_INTERVAL = 60.0  # секунд между удалениями устаревших заданий
+
+
+def load_job_input(job: Dict[str, Any]):
+    """Диалог задания: dict в формате MainAnalyzer или DialogStore для экспорта Telegram."""
+    if job["kind"] == "dialog":
+        with open(job["input_path"], "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    from analyzers.dialog_store import DialogStore
+    from prepare_data.formalizer import iter_telegram_messages, scan_export
+
+    if scan_export(job["input_path"])["kind"] != "chat":
+        raise ValueError("Полный экспорт аккаунта: разбейте его на чаты (prepare_data/formalizer.py)")
+    meta = {}
+    store = DialogStore.from_messages(iter_telegram_messages(job["input_path"], meta))
+    store.dialog_id, store.title = meta.get("id"), meta.get("name")
+    return store
+
+
+def run_job(queue: JobQueue, models, job: Dict[str, Any]):
+    """Выполняет одно задание и пишет результат в <job_id>_result.json."""
+    job_id = job["job_id"]
+    try:
+        queue.progress(job_id, 0.05, "parsing")
+        data = load_job_input(job)
+
+        queue.progress(job_id, 0.1, "analyzing")
+        advisor = models.advisor if job["options"].get("advice") else None
+        with models.analyzer() as analyzer:
+            result = analyzer.analyze(data, advisor=advisor)
+
+        result_path = queue.result_path(job_id)
+        tmp_path = f"{result_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, result_path)
+        queue.finish(job_id, result_path)
+    finally:
+        # Задание завершено (done или failed) — вход больше не нужен. Если воркер
+        # упадёт посреди задания, сюда он не дойдёт и вход останется для повтора
+        if os.path.exists(job["input_path"]):
+            os.remove(job["input_path"])
+
+
+def worker_main(index: int, workers: int, jobs_dir: str, with_advice: bool, knowledge_base_path: str,
+                cache_dir: str = None):
+    """Цикл процесса-воркера: модели загружаются один раз, задания — по одному."""
+    # До импорта моделей: OMP/BLAS читают число потоков при инициализации
+    budget = thread_budget.configure(workers=workers, index=index)
+    from daemon import WarmModels
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # останавливает родитель через SIGTERM
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    queue = JobQueue(jobs_dir)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    def beat():
+        while not stop.wait(HEARTBEAT_TTL / 3):
+            queue.heartbeat(worker)
+
+    queue.heartbeat(worker)
+    threading.Thread(target=beat, daemon=True).start()
+    result_cache = ResultCache(cache_dir) if cache_dir else None
+    models = WarmModels(with_advice, knowledge_base_path, result_cache)
+    print(f"🧵 Воркер {worker} готов, потоки: {budget.as_dict()}")
+
+    try:
+        while not stop.is_set():
+            job = queue.claim(worker)
+            if job is None:
+                stop.wait(POLL_INTERVAL)
+                continue
+            try:
+                run_job(queue, models, job)
+            except Exception as e:
+                queue.fail(job["job_id"], str(e))
+    finally:
+        queue.forget_worker(worker)
+
+
+class JobPool:
+    """
+    Родительский процесс пула: запускает воркеры, перезапускает упавшие и
+    возвращает в очередь задания тех, кто перестал отмечаться.
+
+    Атрибуты:
+        jobs_dir (str): Каталог очереди, входных файлов и результатов.
+        workers (int): Число процессов-воркеров.
+        queue (JobQueue): Очередь; её result_ttl — срок хранения завершённых заданий.
+    """
+
+    def __init__(self, jobs_dir: str = DEFAULT_JOBS_DIR, workers: int = 1, with_advice: bool = True,
+                 knowledge_base_path: str = DEFAULT_KB_PATH, cache_dir: str = None,
+                 result_ttl: float = RESULT_TTL):
+        self.jobs_dir = jobs_dir
+        self.workers = max(1, workers)
+        self._args = (jobs_dir, with_advice, knowledge_base_path, cache_dir)
+        # spawn: воркер не наследует потоки и состояние сервера
+        self._ctx = mp.get_context("spawn")
+        self._procs = []
+        self._stop = threading.Event()
+        self._monitor = None
+        self.queue = JobQueue(jobs_dir, result_ttl=result_ttl)
+        self._expired_at = 0.0
+
+    def _spawn(self, index: int):
+        # Номер воркера — его доля ядер (thread_budget); перезапущенный получает ту же
+        proc = self._ctx.Process(target=worker_main, args=(index, self.workers, *self._args), daemon=True)
+        proc.start()
+        return proc
+
+    def start(self):
+        self._requeue_orphans()
+        self._expire()
+        self._procs = [self._spawn(i) for i in range(self.workers)]
+        self._monitor = threading.Thread(target=self._watch, daemon=True)
+        self._monitor.start()
+        print(f"🚀 Пул заданий: {self.workers} воркер(ов), очередь в {self.jobs_dir}")
+
+    def _watch(self):
+        while not self._stop.wait(HEARTBEAT_TTL / 3):
+            for i, proc in enumerate(self._procs):
+                if not proc.is_alive():
+                    print(f"⚠️ Воркер {proc.pid} завершился (код {proc.exitcode}), перезапускаем")
+                    self._procs[i] = self._spawn(i)
+            self._requeue_orphans()
+            if time.time() - self._expired_at >= EXPIRE_INTERVAL:
+                self._expire()
+
+    def _expire(self):
+        self._expired_at = time.time()
+        expired = self.queue.expire()
+        if expired:
+            print(f"🧹 Удалено устаревших заданий с результатами: {expired}")
+
+    def _requeue_orphans(self):
+        requeued, failed = self.queue.requeue_orphans()
+        if requeued:
+            print(f"♻️ Возвращено в очередь незавершённых заданий: {requeued}")
+        if failed:
+            print(f"❌ Заданий, снова и снова ронявших воркер, помечено failed: {failed}")
+
+    def stop(self, timeout: float = 30.0):
+        self._stop.set()
+        for proc in self._procs:
+            proc.terminate()
+        for proc in self._procs:
+            proc.join(timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пул воркеров для асинхронных заданий анализа")
+    parser.add_argument("--jobs-dir", default=DEFAULT_JOBS_DIR)
+    parser.add_argument("--workers", type=int, default=1, help="Число процессов с моделями")
+    parser.add_argument("--kb", default=DEFAULT_KB_PATH, help="База знаний для RAG-советчика")
+    parser.add_argument("--no-advice", action="store_true", help="Не загружать LLM и советчик")
+    parser.add_argument("--cache-dir", default=os.path.join("rag_cache", "results"),
+                        help="Каталог кэша результатов анализа")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать кэш результатов")
+    parser.add_argument("--result-ttl", type=float, default=RESULT_TTL / 3600,
+                        help="Через сколько часов удалять завершённые задания и результаты (0 — не удалять)")
+    args = parser.parse_args()
+
+    pool = JobPool(args.jobs_dir, args.workers, with_advice=not args.no_advice, knowledge_base_path=args.kb,
+                   cache_dir=None if args.no_cache else args.cache_dir, result_ttl=args.result_ttl * 3600)
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    pool.start()
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+        print("👋 Пул заданий остановлен")
+
+
+if __name__ == "__main__":
+    main()
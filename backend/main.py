@@ -1,9 +1,17 @@
-import json, os
+import argparse, json, os
 from analyzers.emotion_class import MainAnalyzer
 from model.psych_advisor import PsychAdvisor
 from model.rag_adviser import RAGPsychologyAdvisor
+from model.advice_cache import AdviceCache
+from storage.result_cache import ResultCache
 
 def main():
+    parser = argparse.ArgumentParser(description="Анализ диалога и совет психолога")
+    parser.add_argument("--no-cache", action="store_true", help="Пересчитать анализ, не используя кэш результатов")
+    parser.add_argument("--advice-cache", action="store_true",
+                        help="Кэшировать советы LLM (повторный запуск не генерирует совет заново)")
+    args = parser.parse_args()
+
     out_dir = "/home/fedosdan2/prog/pr_act/PROJECT/analysis_results"
     os.makedirs(out_dir, exist_ok=True)
     
@@ -15,12 +23,16 @@ def main():
     except Exception as e:
         return {"error": f"Ошибка чтения файла {fpath}: {e}"}
     
-    analyzer = MainAnalyzer()
-    res = analyzer.analyze(data)
+    # Кэш результатов: тот же диалог с теми же моделями не анализируется повторно
+    analyzer = MainAnalyzer(result_cache=ResultCache("rag_cache/results"))
     #model = PsychAdvisor()
     #advice = model.get_recommendations(res)
-    rag_advisor = RAGPsychologyAdvisor(knowledge_base_path="/home/fedosdan2/prog/pr_act/PROJECT/lib_liter/literature_data.json")
-    advice = rag_advisor.generate_advice(res)
+    # Кэш советов (по --advice-cache): повторный запуск на том же диалоге не требует новой генерации
+    advice_cache = AdviceCache(path="rag_cache/advice_cache.json") if args.advice_cache else None
+    rag_advisor = RAGPsychologyAdvisor(knowledge_base_path="/home/fedosdan2/prog/pr_act/PROJECT/lib_liter/literature_data.json",
+                                       advice_cache=advice_cache)
+    res = analyzer.analyze(data, advisor=rag_advisor, use_cache=not args.no_cache)
+    advice = res.get("advice", res.get("error"))
     print(advice)
     
     f = os.path.basename(fpath)
@@ -0,0 +1,266 @@
+"""
+Лёгкая инструментация горячих путей: таймеры, счётчики, гистограммы
+и пиковая память по этапам.
+
+По умолчанию выключена: декоратор timed и контекст timer в этом случае
+сводятся к одной проверке флага. Включение — metrics.enable() или
+переменная окружения WEBPSYCHO_METRICS=1 (WEBPSYCHO_METRICS=memory —
+дополнительно пиковая память Python через tracemalloc).
+
+Экспорт — export_prometheus() (текстовый формат Prometheus) и snapshot()
+(JSON-профиль).
+
+Пик tracemalloc один на процесс, поэтому пиковая память этапа верна, только
+пока замеры идут в одном потоке. Код с собственными пулами (граф анализа,
+пересказ, batch) при memory_tracking() работает в один поток; замеры, всё
+же пересёкшиеся с замером другого потока (демон, сервер), пик не пишут —
+их число в счётчике memory_peaks_skipped.
+"""
+import functools
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "max")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+
+class _State:
+    def __init__(self):
+        self.enabled = False
+        self.track_memory = False
+        self.lock = threading.Lock()
+        self.counters: Dict[LabelKey, float] = {}
+        self.histograms: Dict[LabelKey, _Histogram] = {}
+        self.peak_memory: Dict[LabelKey, int] = {}
+        self.local = threading.local()
+        self.tracking_threads: Dict[int, int] = {}  # поток → число открытых замеров памяти
+        self.overlaps = 0  # сколько раз замер начинался при открытом замере другого потока
+
+
+_state = _State()
+
+
+def _key(name: str, labels: Dict[str, str]) -> LabelKey:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def enable(track_memory: bool = False):
+    """Включает сбор метрик; track_memory — ещё и пиковую память через tracemalloc."""
+    _state.enabled = True
+    _state.track_memory = track_memory
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    _state.enabled = False
+    if _state.track_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state.track_memory = False
+
+
+def is_enabled() -> bool:
+    return _state.enabled
+
+
+def memory_tracking() -> bool:
+    """Идёт ли замер пиковой памяти — тогда пулы потоков стоит сводить к одному потоку."""
+    return _state.enabled and _state.track_memory
+
+
+def reset():
+    with _state.lock:
+        _state.counters.clear()
+        _state.histograms.clear()
+        _state.peak_memory.clear()
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Увеличивает счётчик."""
+    if not _state.enabled:
+        return
+    key = _key(name, labels)
+    with _state.lock:
+        _state.counters[key] = _state.counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    """Добавляет наблюдение в гистограмму."""
+    if not _state.enabled:
+        return
+    key = _key(name, labels)
+    with _state.lock:
+        hist = _state.histograms.get(key)
+        if hist is None:
+            hist = _state.histograms[key] = _Histogram()
+        hist.observe(value)
+
+
+@contextmanager
+def _measure(name: str, labels: Dict[str, str]):
+    track = _state.track_memory and tracemalloc.is_tracing()
+    if track:
+        # Стек вложенных замеров: reset_peak внутреннего этапа не должен
+        # потерять пик внешнего, поэтому пики поднимаются вверх по стеку
+        stack = getattr(_state.local, "stack", None)
+        if stack is None:
+            stack = _state.local.stack = []
+        me = threading.get_ident()
+        with _state.lock:
+            shared = any(t != me for t in _state.tracking_threads)
+            _state.overlaps += shared
+            overlaps = _state.overlaps
+            _state.tracking_threads[me] = _state.tracking_threads.get(me, 0) + 1
+        base = tracemalloc.get_traced_memory()[0]
+        if stack:
+            stack[-1][1] = max(stack[-1][1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        frame = [base, 0]
+        stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+        if track:
+            stack.pop()
+            peak = max(frame[1], tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+            key = _key(f"{name}_peak_bytes", labels)
+            with _state.lock:
+                depth = _state.tracking_threads.pop(me) - 1
+                if depth:
+                    _state.tracking_threads[me] = depth
+                # Другой поток сбрасывал общий пик, пока шёл этот замер — пик недостоверен
+                concurrent = shared or _state.overlaps != overlaps
+                if not concurrent:
+                    _state.peak_memory[key] = max(_state.peak_memory.get(key, 0), peak - frame[0])
+            if concurrent:
+                inc("memory_peaks_skipped", stage=name)
+
+
+class _NullContext:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullContext()
+
+
+def timer(name: str, **labels):
+    """Контекст-менеджер: время блока в гистограмму <name>_seconds."""
+    if not _state.enabled:
+        return _NULL
+    return _measure(name, labels)
+
+
+def timed(name: str, **labels):
+    """Декоратор: время вызова функции в гистограмму <name>_seconds."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return fn(*args, **kwargs)
+            with _measure(name, labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _format_labels(labels, extra=None) -> str:
+    items = list(labels) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def export_prometheus(prefix: str = "webpsycho_") -> str:
+    """Метрики в текстовом формате Prometheus."""
+    lines = []
+    with _state.lock:
+        seen = set()
+        for (name, labels), value in sorted(_state.counters.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {prefix}{name} counter")
+                seen.add(name)
+            lines.append(f"{prefix}{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), hist in sorted(_state.histograms.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {prefix}{name} histogram")
+                seen.add(name)
+            cumulative = 0
+            for bound, count in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+                cumulative += count
+                lines.append(f"{prefix}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{prefix}{name}_sum{_format_labels(labels)} {hist.sum}")
+            lines.append(f"{prefix}{name}_count{_format_labels(labels)} {hist.count}")
+
+        for (name, labels), value in sorted(_state.peak_memory.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {prefix}{name} gauge")
+                seen.add(name)
+            lines.append(f"{prefix}{name}{_format_labels(labels)} {value}")
+
+    lines.append(f"# TYPE {prefix}process_max_rss_bytes gauge")
+    lines.append(f"{prefix}process_max_rss_bytes {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> Dict:
+    """JSON-профиль: счётчики, сводка по таймерам и пиковая память по этапам."""
+    def label_name(name, labels):
+        return name + _format_labels(labels)
+
+    with _state.lock:
+        return {
+            "counters": {label_name(*k): v for k, v in sorted(_state.counters.items())},
+            "timers": {
+                label_name(*k): {
+                    "count": h.count,
+                    "total_s": round(h.sum, 6),
+                    "mean_s": round(h.sum / h.count, 6) if h.count else 0.0,
+                    "max_s": round(h.max, 6),
+                }
+                for k, h in sorted(_state.histograms.items())
+            },
+            "peak_memory_bytes": {label_name(*k): v for k, v in sorted(_state.peak_memory.items())},
+            "process_max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        }
+
+
+# Включение через окружение — удобно для демона и сервера
+if os.environ.get("WEBPSYCHO_METRICS"):
+    enable(track_memory=os.environ["WEBPSYCHO_METRICS"] == "memory")
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+def analysis_fingerprint(analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Выделяет из результата MainAnalyzer.analyze только поля, которые влияют
+    на промпт и подзапросы RAG. Остальные поля (например, медианы эмоций)
+    на совет не влияют и в ключ кэша не входят.
+    """
+    participants = {}
+    for name, data in analysis.get("participants_analysis", {}).items():
+        interests = data.get("topic_interests", {})
+        participants[name] = {
+            "messages_count": data.get("messages_count", 0),
+            "dominant_emotion": data.get("dominant_emotion"),
+            "text_dominant": data.get("text_dominant"),
+            "test_dominant": data.get("test_dominant"),
+            "main_interest": interests.get("main_interest"),
+            "all_topics": interests.get("all_topics", {}),
+        }
+    return {
+        "title": analysis.get("title", "Неизвестно"),
+        "total_messages_analyzed": analysis.get("total_messages_analyzed", 0),
+        "dominant_topics": [[t.get("topic"), t.get("percentage")] for t in analysis.get("dominant_topics", [])],
+        "participants": participants,
+    }
+
+
+def make_advice_key(analysis: Dict[str, Any], entry_ids: List[int], model_hash: str,
+                    params: Dict[str, Any], digest: Optional[str] = None,
+                    kb_hash: Optional[str] = None, prompt_version: Any = None) -> str:
+    """
+    Канонический ключ совета: отпечаток анализа + id фактов + модель + параметры
+    генерации (+ краткое содержание переписки, если оно есть в промпте).
+    id фактов сами по себе не говорят, что в фактах написано: kb_hash (хеш базы
+    знаний) и prompt_version (версия шаблона промпта) меняют ключ, когда
+    меняется текст, попадающий в промпт.
+    """
+    payload = {
+        "analysis": analysis_fingerprint(analysis),
+        "entries": list(entry_ids),
+        "kb": kb_hash,
+        "prompt_version": prompt_version,
+        "model": model_hash,
+        "params": params,
+    }
+    if digest:
+        payload["digest"] = digest
+    canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class AdviceCache:
+    """
+    LRU-кэш готовых советов с TTL и ограничением по числу записей.
+
+    Если задан path, кэш сохраняется в JSON-файл и переживает перезапуск
+    процесса (повторный запуск демо-диалога не требует новой генерации).
+
+    Атрибуты:
+        ttl_seconds (float): Время жизни записи в секундах.
+        max_entries (int): Максимальное число записей, лишние вытесняются по LRU.
+        path (str or None): Файл для сохранения кэша между запусками.
+    """
+
+    def __init__(self, ttl_seconds: float = 24 * 3600, max_entries: int = 512,
+                 path: Optional[str] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def get(self, key: str) -> Optional[str]:
+        """Возвращает совет по ключу или None, если его нет или он устарел."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, advice: str):
+        """Сохраняет совет и вытесняет самые старые записи сверх лимита."""
+        with self._lock:
+            self._entries[key] = (time.time(), advice)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.path:
+                self._save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self.path:
+                self._save()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        now = time.time()
+        for key, (created, advice) in raw.items():
+            if now - created <= self.ttl_seconds:
+                self._entries[key] = (created, advice)
+
+    def _save(self):
+        # Пишем во временный файл и подменяем атомарно — кэш не бьётся при сбое
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(self._entries), f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
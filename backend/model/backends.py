@@ -0,0 +1,282 @@
+"""
+Бэкенды генерации текста.
+
+Единый интерфейс GenerationBackend используется и PsychAdvisor, и
+RAGPsychologyAdvisor. Тяжёлые зависимости (llama_cpp, transformers, torch)
+импортируются только при создании соответствующего бэкенда, поэтому
+StubBackend работает без них — например, в тестах и бенчмарках.
+"""
+import abc
+import hashlib
+import os
+import threading
+from typing import Iterator, List, Optional
+
+
+class GenerationFailed(str):
+    """
+    Текст ошибки вместо ответа LLM. Это обычная строка (её показывают
+    пользователю), но кэши по типу узнают, что сохранять её нельзя.
+    """
+
+
+def file_fingerprint(path: str, cache_dir: str = "rag_cache") -> str:
+    """
+    MD5 файла (модели, базы знаний). Полный хеш многогигабайтного файла
+    считается один раз и сохраняется в cache_dir вместе с размером и
+    временем изменения файла.
+    """
+    stat = os.stat(path)
+    stamp = f"{stat.st_size}:{stat.st_mtime_ns}"
+    os.makedirs(cache_dir, exist_ok=True)
+    hash_path = os.path.join(cache_dir, os.path.basename(path) + ".hash")
+
+    if os.path.exists(hash_path):
+        with open(hash_path, "r") as f:
+            cached_stamp, _, cached_hash = f.read().strip().partition(" ")
+        if cached_stamp == stamp and cached_hash:
+            return cached_hash
+
+    hash_md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hash_md5.update(chunk)
+    digest = hash_md5.hexdigest()
+    with open(hash_path, "w") as f:
+        f.write(f"{stamp} {digest}")
+    return digest
+
+
+class GenerationBackend(abc.ABC):
+    """
+    Базовый интерфейс бэкенда генерации.
+
+    Атрибуты:
+        name (str): Короткое имя бэкенда (для логов и бенчмарков).
+    """
+    name = "base"
+
+    @abc.abstractmethod
+    def tokenize(self, text: str) -> List[int]:
+        """Токенизирует текст токенизатором модели (без BOS)."""
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenize(text))
+
+    @abc.abstractmethod
+    def stream(self, prompt: str, max_tokens: int = 256, temperature: float = 0.7,
+               stop: Optional[List[str]] = None, seed: Optional[int] = None) -> Iterator[str]:
+        """Генерирует ответ по кусочкам (обычно по одному токену)."""
+
+    def generate(self, prompt: str, max_tokens: int = 256, temperature: float = 0.7,
+                 stop: Optional[List[str]] = None, seed: Optional[int] = None) -> str:
+        """Генерирует ответ целиком (без текста промпта)."""
+        return "".join(self.stream(prompt, max_tokens, temperature, stop, seed)).strip()
+
+    def fingerprint(self) -> str:
+        """Идентификатор весов модели — входит в ключи кэшей."""
+        return self.name
+
+
+class LlamaCppBackend(GenerationBackend):
+    """Генерация через llama.cpp (GGUF, CPU)."""
+    name = "llama_cpp"
+
+    def __init__(self, model_path: str, n_ctx: int = 2048, n_threads: int = 6, verbose: bool = False):
+        from llama_cpp import Llama
+
+        self.model_path = model_path
+        self.llm = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,  # количество CPU-потоков
+            verbose=verbose
+        )
+        self._fingerprint = None
+
+    def tokenize(self, text: str) -> List[int]:
+        return self.llm.tokenize(text.encode("utf-8"), add_bos=False)
+
+    def stream(self, prompt, max_tokens=256, temperature=0.7, stop=None, seed=None):
+        for chunk in self.llm(prompt, max_tokens=max_tokens, temperature=temperature,
+                              seed=seed if seed is not None else -1, stop=stop or [],
+                              echo=False, stream=True):
+            yield chunk["choices"][0]["text"]
+
+    def generate(self, prompt, max_tokens=256, temperature=0.7, stop=None, seed=None):
+        output = self.llm(prompt, max_tokens=max_tokens, temperature=temperature,
+                          seed=seed if seed is not None else -1, stop=stop or [], echo=False)
+        return output["choices"][0]["text"].strip()
+
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = file_fingerprint(self.model_path)
+        return self._fingerprint
+
+
+class TransformersBackend(GenerationBackend):
+    """
+    Генерация через transformers.
+
+    По умолчанию модель грузится на CPU в float32. Для GPU можно передать
+    device_map="auto" и quantization_config (например, 4-битный bitsandbytes).
+    """
+    name = "transformers"
+
+    def __init__(self, model_name: str, device_map: Optional[str] = None, torch_dtype=None,
+                 quantization_config=None, num_threads: Optional[int] = None):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model_name = model_name
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            device_map=device_map,
+            torch_dtype=torch_dtype or (torch.float16 if device_map else torch.float32),
+            quantization_config=quantization_config,
+        )
+        self.model.eval()
+
+    def tokenize(self, text: str) -> List[int]:
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+    def _generate_kwargs(self, prompt, max_tokens, temperature, seed):
+        import torch
+
+        if seed is not None:
+            torch.manual_seed(seed)
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+        return dict(
+            **inputs,
+            max_new_tokens=max_tokens,
+            do_sample=temperature > 0,
+            temperature=temperature if temperature > 0 else None,
+            # pad_token_id может быть 0 — это настоящий id, подменять его нельзя
+            pad_token_id=(self.tokenizer.eos_token_id if self.tokenizer.pad_token_id is None
+                          else self.tokenizer.pad_token_id),
+        )
+
+    def stream(self, prompt, max_tokens=256, temperature=0.7, stop=None, seed=None):
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        class StopOnEvent(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return halt.is_set()
+
+        halt = threading.Event()
+        errors = []
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        kwargs = dict(self._generate_kwargs(prompt, max_tokens, temperature, seed), streamer=streamer,
+                      stopping_criteria=StoppingCriteriaList([StopOnEvent()]))
+
+        def run():
+            try:
+                self.model.generate(**kwargs)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()  # иначе чтение стримера ждёт вечно
+
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+
+        stop = [s for s in stop or [] if s]
+        text, emitted = "", 0
+        try:
+            for piece in streamer:
+                text += piece
+                # Стоп-последовательности обрезаем сами, как это делает llama.cpp
+                cut = min((text.index(s) for s in stop if s in text), default=None)
+                if cut is not None:
+                    if cut > emitted:
+                        yield text[emitted:cut]
+                    return
+                # Хвост, с которого может начаться стоп-строка, придерживаем до следующего куска
+                ready = len(text) - _stop_prefix_len(text, stop)
+                if ready > emitted:
+                    yield text[emitted:ready]
+                    emitted = ready
+            if errors:
+                raise errors[0]
+            if len(text) > emitted:
+                yield text[emitted:]
+        finally:
+            # И при стоп-строке, и при закрытии генератора потребителем:
+            # generate останавливается на следующем токене, поток не остаётся висеть
+            halt.set()
+            worker.join()
+
+    def fingerprint(self):
+        return f"{self.name}:{self.model_name}"
+
+
+def _stop_prefix_len(text: str, stop: List[str]) -> int:
+    """Длина самого длинного конца text, который является началом одной из стоп-строк."""
+    longest = 0
+    for s in stop:
+        for k in range(min(len(s) - 1, len(text)), longest, -1):
+            if text.endswith(s[:k]):
+                longest = k
+                break
+    return longest
+
+
+class RegisteredBackend(GenerationBackend):
+    """
+    Бэкенд из реестра моделей (model/registry.py): каждый вызов берёт модель
+    через proxy.call и отпускает её, так что между вызовами она может быть
+    выгружена. Отпечаток берётся из атрибута fingerprint регистрации — без
+    загрузки модели.
+    """
+
+    def __init__(self, proxy, name: str):
+        self.proxy = proxy
+        self.name = name
+
+    def tokenize(self, text: str) -> List[int]:
+        return self.proxy.call("tokenize", text)
+
+    def stream(self, prompt, max_tokens=256, temperature=0.7, stop=None, seed=None):
+        return self.proxy.call("stream", prompt, max_tokens, temperature, stop, seed)
+
+    def generate(self, prompt, max_tokens=256, temperature=0.7, stop=None, seed=None):
+        return self.proxy.call("generate", prompt, max_tokens, temperature, stop, seed)
+
+    def fingerprint(self):
+        return self.proxy.fingerprint()
+
+
+class StubBackend(GenerationBackend):
+    """
+    Детерминированный бэкенд без модели: ответ зависит только от промпта и seed.
+    Токены — слова, разделённые пробелами.
+    """
+    name = "stub"
+
+    def __init__(self, reply_words: int = 32):
+        self.reply_words = reply_words
+
+    def tokenize(self, text: str) -> List[int]:
+        return [int(hashlib.md5(w.encode("utf-8")).hexdigest()[:6], 16) for w in text.split()]
+
+    def stream(self, prompt, max_tokens=256, temperature=0.7, stop=None, seed=None):
+        digest = hashlib.sha256(f"{seed}:{prompt}".encode("utf-8")).hexdigest()
+        for i in range(min(self.reply_words, max_tokens)):
+            yield ("" if i == 0 else " ") + f"совет{digest[i % len(digest)]}{i}"
+
+    def fingerprint(self):
+        return f"{self.name}:{self.reply_words}"
+
+
+def create_backend(kind: str, **kwargs) -> GenerationBackend:
+    """Создаёт бэкенд по имени: llama_cpp, transformers или stub."""
+    backends = {
+        LlamaCppBackend.name: LlamaCppBackend,
+        TransformersBackend.name: TransformersBackend,
+        StubBackend.name: StubBackend,
+    }
+    if kind not in backends:
+        raise ValueError(f"Неизвестный бэкенд генерации: {kind}")
+    return backends[kind](**kwargs)
@@ -1,33 +1,46 @@
-from transformers import pipeline, BitsAndBytesConfig
-import torch
+from model.backends import GenerationBackend, GenerationFailed, RegisteredBackend, TransformersBackend
+from model.registry import registry
+import thread_budget
+
+SAIGA_LLAMA3 = "IlyaGusev/saiga_llama3_8b"
+SAIGA_LLAMA3_SIZE_MB = 5600  # 8B в 4 битах
+
+
+def _load_saiga_llama3():
+    import torch
+    from transformers import BitsAndBytesConfig
+
+    quantization_config = BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_compute_dtype=torch.float16,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_use_double_quant=True,
+    )
+    return TransformersBackend(
+        SAIGA_LLAMA3,
+        device_map="auto",
+        torch_dtype=torch.float16,
+        quantization_config=quantization_config,
+        num_threads=thread_budget.current().threads("torch"),
+    )
+
 
 class SimpleLLM:
-    def __init__(self):
-        quantization_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_compute_dtype=torch.float16,
-            bnb_4bit_quant_type="nf4",
-            bnb_4bit_use_double_quant=True,
-        )
-        self.pipe = pipeline(
-            "text-generation",
-            model="IlyaGusev/saiga_llama3_8b",
-            device_map="auto",
-            torch_dtype=torch.float16,
-            quantization_config=quantization_config,
-        )
+    def __init__(self, backend: GenerationBackend = None):
+        # Без явного бэкенда — Saiga LLaMA3 в 4 битах на GPU из реестра моделей
+        if backend is None:
+            registry.register(SAIGA_LLAMA3, _load_saiga_llama3, size_mb=SAIGA_LLAMA3_SIZE_MB,
+                              attributes={"fingerprint": lambda: f"{TransformersBackend.name}:{SAIGA_LLAMA3}"})
+            backend = RegisteredBackend(registry.proxy(SAIGA_LLAMA3), TransformersBackend.name)
+        self.backend = backend
         print("Модель загружена!")
     
     def quick_advice(self, prompt):
         try:
-            result = self.pipe(
+            return self.backend.generate(
                 prompt,
-                max_new_tokens=512,
+                max_tokens=512,
                 temperature=0.8,
-                do_sample=True,
-                truncation=True,
-                pad_token_id=128001  # для Llama3 — EOS = 128001
             )
-            return result[0]['generated_text']
         except Exception as e:
-            return f"Ошибка генерации: {e}"
\ No newline at end of file
+            return GenerationFailed(f"Ошибка генерации: {e}")
@@ -0,0 +1,116 @@
+import re
+from typing import Callable, List, Optional
+
+
+# Граница предложения: знак конца предложения + пробел
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?…])\s+')
+
+
+def split_sentences(text: str) -> List[str]:
+    """Делит текст на предложения по знакам конца предложения."""
+    return [s.strip() for s in _SENTENCE_SPLIT_RE.split(text or "") if s.strip()]
+
+
+class PromptPacker:
+    """
+    Упаковывает промпт для LLM в фиксированный бюджет токенов.
+
+    Токены считаются токенизатором самой модели (функция count_tokens), поэтому
+    размер промпта известен заранее и никогда не выходит за контекст.
+    Строки участников и научные факты подаются уже отсортированными по
+    релевантности: в промпт попадает максимально длинный префикс каждого списка.
+
+    Атрибуты:
+        count_tokens (Callable[[str], int]): Подсчёт токенов строки.
+        budget (int): Максимальное число токенов промпта (prefill).
+        facts_share (float): Доля свободного бюджета, зарезервированная под факты.
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int], n_ctx: int = 2048,
+                 max_new_tokens: int = 256, prompt_budget: Optional[int] = None,
+                 facts_share: float = 0.6, safety_margin: int = 8):
+        self.count_tokens = count_tokens
+        # Промпт + ответ обязаны поместиться в контекст модели
+        hard_limit = n_ctx - max_new_tokens - safety_margin
+        self.budget = min(prompt_budget, hard_limit) if prompt_budget else hard_limit
+        self.facts_share = facts_share
+
+    def trim_passage(self, sentences: List[str], scores: List[float],
+                     max_sentences: int = 2, max_tokens: int = 120) -> str:
+        """
+        Оставляет в отрывке только самые релевантные предложения.
+
+        Args:
+            sentences (list[str]): Предложения отрывка в исходном порядке.
+            scores (list[float]): Релевантность каждого предложения запросу.
+            max_sentences (int): Сколько предложений оставить максимум.
+            max_tokens (int): Ограничение на длину отрывка в токенах.
+
+        Returns:
+            str: Отрывок из лучших предложений в исходном порядке.
+        """
+        ranked = sorted(range(len(sentences)), key=lambda i: scores[i], reverse=True)
+        chosen, used = [], 0
+        for i in ranked[:max_sentences]:
+            cost = self.count_tokens(sentences[i])
+            if chosen and used + cost > max_tokens:
+                break
+            chosen.append(i)
+            used += cost
+        return " ".join(sentences[i] for i in sorted(chosen))
+
+    def _take(self, lines: List[str], budget: int) -> List[str]:
+        """Берёт максимальный префикс строк, который помещается в бюджет."""
+        taken, used = [], 0
+        for line in lines:
+            cost = self.count_tokens(line + "\n")
+            if used + cost > budget:
+                break
+            taken.append(line)
+            used += cost
+        return taken
+
+    def pack(self, template: str, header_lines: List[str], participant_lines: List[str],
+             fact_lines: List[str], empty_facts: str = "Нет релевантных данных.") -> str:
+        """
+        Собирает промпт по шаблону с полями {analysis_summary} и {facts_text}.
+
+        Заголовок анализа (название, число сообщений, темы) входит всегда,
+        остаток бюджета делится между фактами и участниками; неиспользованная
+        одной частью квота переходит другой.
+
+        Args:
+            template (str): Шаблон промпта.
+            header_lines (list[str]): Обязательные строки сводки анализа.
+            participant_lines (list[str]): Строки участников по убыванию важности.
+            fact_lines (list[str]): Строки фактов по убыванию релевантности.
+            empty_facts (str): Текст на случай, если ни один факт не поместился.
+
+        Returns:
+            str: Готовый промпт, укладывающийся в self.budget токенов.
+        """
+        fixed = template.format(analysis_summary="\n".join(header_lines) + "\nУчастники:",
+                                facts_text=empty_facts)
+        free = max(self.budget - self.count_tokens(fixed), 0)
+
+        facts = self._take(fact_lines, int(free * self.facts_share))
+        facts_cost = sum(self.count_tokens(f + "\n") for f in facts)
+        participants = self._take(participant_lines, free - facts_cost)
+        participants_cost = sum(self.count_tokens(p + "\n") for p in participants)
+        # Остаток после участников отдаём фактам, не попавшим в первую квоту
+        if len(facts) < len(fact_lines):
+            facts += self._take(fact_lines[len(facts):], free - facts_cost - participants_cost)
+
+        while True:
+            summary = list(header_lines)
+            if participants:
+                summary.append("Участники:\n" + "\n".join(participants))
+            prompt = template.format(analysis_summary="\n".join(summary),
+                                     facts_text="\n".join(facts) or empty_facts)
+            # Сумма по строкам — оценка; точную проверку делаем по итоговому тексту
+            if self.count_tokens(prompt) <= self.budget or not (facts or participants):
+                return prompt
+            if len(facts) >= len(participants):
+                facts.pop()
+            else:
+                participants.pop()
@@ -1,9 +1,10 @@
 from model.llm_class import SimpleLLM
 
 class PsychAdvisor:
-    def __init__(self):
+    def __init__(self, backend=None):
+        """backend — любой GenerationBackend; по умолчанию Saiga LLaMA3 через SimpleLLM."""
         try:
-            self.llm = SimpleLLM()
+            self.llm = SimpleLLM(backend)
             self.llm_loaded = True
             self.analysis_text = None
         except Exception as e:
@@ -1,53 +1,132 @@
 import json
 import os
-import hashlib
-from typing import List, Dict, Any
+from functools import lru_cache
+import threading
+from typing import List, Dict, Any, Optional, Tuple
 os.environ["PYTORCH_ALLOC_CONF"] = "expandable_segments:True"
-from llama_cpp import Llama
-import torch
-from transformers import pipeline
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
+from model.prompt_packer import PromptPacker, split_sentences
+from model.advice_cache import AdviceCache, make_advice_key
+from model.backends import (GenerationBackend, GenerationFailed, LlamaCppBackend, RegisteredBackend,
+                            file_fingerprint)
+from model.registry import ModelProxy, registry
+from model.summarizer import DialogSummarizer, SummaryCache
+import metrics
+import thread_budget
 
 
-class RAGPsychologyAdvisor:
-    def __init__(self, knowledge_base_path: str = "psychology_knowledge_base.json"):
-        # === 1. Загружаем LLM ===
+PROMPT_TEMPLATE = """Ты — лицензированный психолог с 15-летним стажем. На основе анализа переписки и научных данных дай краткий, практичный и обоснованный совет.
+
+Анализ переписки:
+{analysis_summary}
+
+Релевантные научные данные:
+{facts_text}
+
+Требования:
+- Давай 3-5 конкретных совета.
+- Ссылаёшься на источники: «Как отмечает Дж. Готтман…», «Согласно модели DISC…».
+- Избегай общих фраз вроде «нужно лучше общаться».
+- Пиши на русском, в поддерживающем, но профессиональном тоне.
+- Ответ должен быть не длиннее 500 слов.
+
+Ответ:"""
+PROMPT_VERSION = 1  # меняется вместе с PROMPT_TEMPLATE и сборкой промпта — старые советы не используются
+
+MISTRAL_PATH = "/home/fedosdan2/prog/pr_act/PROJECT/backend/model/mistral/saiga_mistral_7b.Q4_K_M.gguf"
+MISTRAL_SIZE_MB = 4400  # Q4_K_M 7B
+EMBEDDING_MODEL = "intfloat/multilingual-e5-large"
+EMBEDDING_MODEL_SIZE_MB = 2200
+
+
+def _register_mistral(n_ctx: int) -> str:
+    """Регистрирует Saiga Mistral 7B GGUF в реестре моделей; имя включает размер контекста."""
+    name = f"saiga_mistral_7b:ctx{n_ctx}"
+
+    def load():
         print("📥 Загружаем LLM (Saiga Mistral 7B GGUF)...")
-        self.llm = Llama(
-            model_path="/home/fedosdan2/prog/pr_act/PROJECT/backend/model/mistral/saiga_mistral_7b.Q4_K_M.gguf",
-            n_ctx=2048,
-            n_threads=6,  # количество CPU-потоков
-            verbose=False
+        return LlamaCppBackend(
+            model_path=MISTRAL_PATH,
+            n_ctx=n_ctx,
+            n_threads=thread_budget.current().threads("llm")  # доля CPU-потоков воркера
         )
 
+    # Имя бэкенда и отпечаток файла нужны для ключей кэша — без загрузки модели
+    registry.register(name, load, size_mb=MISTRAL_SIZE_MB,
+                      unloader=lambda backend: getattr(backend.llm, "close", lambda: None)(),
+                      attributes={"fingerprint": lambda: file_fingerprint(MISTRAL_PATH)})
+    return name
+
+
+def _load_embedding_model():
+    from sentence_transformers import SentenceTransformer
+
+    print("🧠 Загружаем эмбеддинг-модель...")
+    thread_budget.current().apply_torch()
+    return SentenceTransformer(EMBEDDING_MODEL, device='cpu')
+
+
+class RAGPsychologyAdvisor:
+    def __init__(self, knowledge_base_path: str = "psychology_knowledge_base.json",
+                 n_ctx: int = 2048, max_tokens: int = 256, prompt_budget: Optional[int] = 1024,
+                 candidate_facts: int = 6, temperature: float = 0.7, seed: int = 42,
+                 advice_cache: Optional[AdviceCache] = None,
+                 backend: Optional[GenerationBackend] = None,
+                 embedding_model=None, cache_dir: str = "rag_cache",
+                 summary_cache: Optional[SummaryCache] = None):
+        # === 1. Загружаем LLM ===
+        self.n_ctx = n_ctx
+        self.max_tokens = max_tokens
+        self.prompt_budget = prompt_budget
+        self.candidate_facts = candidate_facts  # сколько фактов извлекаем до упаковки
+        self.temperature = temperature
+        self.seed = seed  # фиксированный seed — одинаковый промпт даёт одинаковый совет
+        self.stop = ["Анализ переписки:", "Релевантные научные данные:", "\n\n"]
+        self.advice_cache = advice_cache  # None — кэш советов выключен
+        self._generate_lock = threading.Lock()
+        # Имена моделей в реестре, которыми пользуется советчик (для предзагрузки)
+        self.registered_models = []
+        # По умолчанию — llama.cpp из реестра моделей; для тестов и бенчмарков можно передать StubBackend
+        if backend is None:
+            self.registered_models.append(_register_mistral(n_ctx))
+            backend = RegisteredBackend(registry.proxy(self.registered_models[-1]), LlamaCppBackend.name)
+        self.backend = backend
+        # Токены считаем токенизатором самой модели; строки промпта повторяются — кэшируем
+        self._count_tokens = lru_cache(maxsize=4096)(self.backend.count_tokens)
+        self.packer = PromptPacker(self._count_tokens, n_ctx=n_ctx,
+                                   max_new_tokens=max_tokens, prompt_budget=prompt_budget)
+        # Краткое содержание длинной переписки (map-reduce тем же бэкендом), по запросу
+        self.summarizer = DialogSummarizer(
+            self.backend, self._count_tokens, lock=self._generate_lock,
+            cache=summary_cache or SummaryCache(os.path.join(cache_dir, "summaries")))
+
         # === 2. Загружаем базу знаний ===
         print(f"📚 Загружаем базу знаний: {knowledge_base_path}")
         with open(knowledge_base_path, "r", encoding="utf-8") as f:
             self.knowledge_base = json.load(f)
 
         # === 3. Загружаем эмбеддинг-модель (на CPU) ===
-        print("🧠 Загружаем эмбеддинг-модель...")
-        self.embedding_model = SentenceTransformer('intfloat/multilingual-e5-large', device='cpu')
+        if embedding_model is None:
+            registry.register(EMBEDDING_MODEL, _load_embedding_model, size_mb=EMBEDDING_MODEL_SIZE_MB)
+            embedding_model = registry.proxy(EMBEDDING_MODEL)
+            self.registered_models.append(EMBEDDING_MODEL)
+            self.embedding_model_name = EMBEDDING_MODEL
+        else:
+            self.embedding_model_name = type(embedding_model).__name__
+        self.embedding_model = embedding_model
 
         # === 4. Загружаем или создаём FAISS-индекс с кэшированием ===
+        self.cache_dir = cache_dir
+        thread_budget.current().apply_faiss()
         self._load_or_build_index(knowledge_base_path)
 
         print("✅ RAG-система готова к работе!")
 
-    def _compute_file_hash(self, filepath: str) -> str:
-        """Вычисляет хеш файла для отслеживания изменений."""
-        hash_md5 = hashlib.md5()
-        with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-
     def _load_or_build_index(self, knowledge_base_path: str):
         """Загружает индекс из кэша или создаёт новый."""
         # Определяем пути к кэш-файлам
-        cache_dir = "rag_cache"
+        cache_dir = self.cache_dir
         os.makedirs(cache_dir, exist_ok=True)
         base_name = os.path.splitext(os.path.basename(knowledge_base_path))[0]
         index_path = os.path.join(cache_dir, f"{base_name}.faiss")
@@ -55,7 +134,8 @@ class RAGPsychologyAdvisor:
         hash_path = os.path.join(cache_dir, f"{base_name}.hash")
 
         # Вычисляем текущий хеш базы знаний
-        current_hash = self._compute_file_hash(knowledge_base_path)
+        current_hash = file_fingerprint(knowledge_base_path, cache_dir)
+        self.kb_hash = current_hash
 
         # Проверяем, есть ли актуальный кэш
         if (os.path.exists(index_path) and
@@ -82,6 +162,15 @@ class RAGPsychologyAdvisor:
         with open(hash_path, "w") as f:
             f.write(current_hash)
 
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Нормированные эмбеддинги float32 (модель из реестра — через proxy.call)."""
+        kwargs = dict(convert_to_numpy=True, normalize_embeddings=True)
+        if isinstance(self.embedding_model, ModelProxy):
+            embeddings = self.embedding_model.call("encode", texts, **kwargs)
+        else:
+            embeddings = self.embedding_model.encode(texts, **kwargs)
+        return embeddings.astype('float32')
+
     def _build_faiss_index(self):
         """Создаёт FAISS-индекс на основе базы знаний."""
         self.kb_texts = []
@@ -90,46 +179,130 @@ class RAGPsychologyAdvisor:
             self.kb_texts.append(text)
 
         print("  → Генерация эмбеддингов...")
-        embeddings = self.embedding_model.encode(
-            self.kb_texts,
-            convert_to_numpy=True,
-            normalize_embeddings=True
-        ).astype('float32')
+        embeddings = self.encode(self.kb_texts)
 
         dim = embeddings.shape[1]
         self.index = faiss.IndexFlatL2(dim)
         self.index.add(embeddings)
         print(f"  → Индекс создан. Векторов: {self.index.ntotal}")
 
+    def _search_ids(self, queries: List[str], top_k: int = 3) -> List[int]:
+        """
+        Ищет top_k записей базы знаний сразу для нескольких запросов.
+
+        Все запросы кодируются одним батчем и ищутся одним вызовом index.search.
+        Результаты объединяются по рангу (сначала лучшие попадания каждого
+        запроса, затем вторые и т.д.), дубликаты отбрасываются.
+        """
+        with metrics.timer("embedding_encode", purpose="query"):
+            query_embs = self.encode(queries)
+        if query_embs.ndim == 1:
+            query_embs = np.expand_dims(query_embs, axis=0)
+
+        with metrics.timer("faiss_search"):
+            distances, indices = self.index.search(query_embs, top_k)
+        metrics.inc("retrieval_queries", len(queries))
+
+        merged, seen = [], set()
+        for rank in range(indices.shape[1]):
+            # Внутри одного ранга ближайшие попадания идут первыми
+            for q in np.argsort(distances[:, rank]):
+                idx = int(indices[q, rank])
+                if 0 <= idx < len(self.knowledge_base) and idx not in seen:
+                    seen.add(idx)
+                    merged.append(idx)
+        return merged
+
     def _retrieve_relevant_facts(self, query: str, top_k: int = 3) -> List[Dict]:
         """Извлекает top_k релевантных цитат из базы знаний."""
-        query_emb = self.embedding_model.encode(
-            query,
-            convert_to_numpy=True,
-            normalize_embeddings=True
-        ).astype('float32')
-        query_emb = np.expand_dims(query_emb, axis=0)
-
-        distances, indices = self.index.search(query_emb, top_k)
-
-        results = []
-        for idx in indices[0]:
-            if idx < len(self.knowledge_base):
-                results.append(self.knowledge_base[idx])
-        return results
-
-    def _build_prompt(self, analysis: Dict[str, Any], retrieved_facts: List[Dict]) -> str:
-        """Формирует промпт для LLM."""
+        return [self.knowledge_base[idx] for idx in self._search_ids([query], top_k)]
+
+    def _retrieve_relevant_facts_multi(self, queries: List[str], top_k: int = 3,
+                                       limit: Optional[int] = None) -> List[Dict]:
+        """Извлекает цитаты по нескольким подзапросам за один батч, без дублей."""
+        ids = self._search_ids(queries, top_k)
+        return [self.knowledge_base[idx] for idx in ids[:limit]]
+
+    @staticmethod
+    def _disc_letters(data: Dict[str, Any]) -> List[str]:
+        """Собирает буквы DISC участника из text_dominant и test_dominant."""
+        letters = set()
+        for key in ["text_dominant", "test_dominant"]:
+            val = data.get(key)
+            if isinstance(val, list):
+                letters.update(v for v in val if isinstance(v, str))
+            elif isinstance(val, str):
+                letters.add(val)
+        return sorted(letters)
+
+    def _build_queries(self, analysis: Dict[str, Any]) -> List[str]:
+        """
+        Формирует подзапросы к базе знаний: общий по всему диалогу,
+        по одному на участника и по одному на доминирующую тему.
+        """
+        participants = analysis.get("participants_analysis", {})
+        topics = [t["topic"] for t in analysis.get("dominant_topics", [])]
+        emotions = sorted({data.get("dominant_emotion") for data in participants.values() if data.get("dominant_emotion")})
+        disc_list = sorted({letter for data in participants.values() for letter in self._disc_letters(data)})
+
+        query = f"{' '.join(topics)} {' '.join(emotions)} {' '.join(disc_list)}"
+        queries = [query.strip() or "общий психологический анализ межличностной коммуникации"]
+
+        for data in participants.values():
+            own_counts = data.get("topic_interests", {}).get("all_topics", {})
+            own_topics = sorted(own_counts, key=own_counts.get, reverse=True)[:3]
+            parts = own_topics + [data.get("dominant_emotion") or ""] + self._disc_letters(data)
+            sub_query = " ".join(p for p in parts if p).strip()
+            if sub_query:
+                queries.append(sub_query)
+
+        for topic in topics:
+            queries.append(f"{topic} {' '.join(emotions)}".strip())
+
+        # Одинаковые подзапросы искать дважды незачем
+        return list(dict.fromkeys(queries))
+
+    def _trim_facts(self, retrieved_facts: List[Dict], query: str) -> List[str]:
+        """Сокращает каждый факт до самых релевантных запросу предложений."""
+        passages = [split_sentences(item["content"]) or [item["content"]] for item in retrieved_facts]
+        flat = [sent for sentences in passages for sent in sentences]
+        if not flat:
+            return []
+
+        # Один батч: запрос + все предложения всех фактов
+        with metrics.timer("embedding_encode", purpose="sentences"):
+            embs = self.encode([query] + flat)
+        scores = (embs[1:] @ embs[0]).tolist()
+
+        trimmed, pos = [], 0
+        for item, sentences in zip(retrieved_facts, passages):
+            content = self.packer.trim_passage(sentences, scores[pos:pos + len(sentences)])
+            pos += len(sentences)
+            trimmed.append(f"• {content} (Источник: {item['source']})")
+        return trimmed
+
+    def _build_prompt(self, analysis: Dict[str, Any], retrieved_facts: List[Dict],
+                      query: Optional[str] = None, digest: Optional[str] = None) -> str:
+        """Формирует промпт для LLM в пределах бюджета токенов."""
         summary_lines = []
         summary_lines.append(f"Диалог: {analysis.get('title', 'Неизвестно')}")
         summary_lines.append(f"Проанализировано сообщений: {analysis.get('total_messages_analyzed', 0)}")
+        if digest:
+            # Ограничен digest_tokens сумматора — входит в обязательную часть промпта
+            summary_lines.append(f"Краткое содержание переписки: {digest}")
 
         dominant = [f"{t['topic']} ({t['percentage']}%)" for t in analysis.get('dominant_topics', [])]
         if dominant:
             summary_lines.append(f"Основные темы: {', '.join(dominant)}")
 
+        # Самые активные участники важнее — они попадают в промпт первыми
+        participants = sorted(
+            analysis.get('participants_analysis', {}).items(),
+            key=lambda kv: kv[1].get('messages_count', 0),
+            reverse=True
+        )
         participants_info = []
-        for name, data in analysis.get('participants_analysis', {}).items():
+        for name, data in participants:
             emotion = data.get('dominant_emotion', 'не определена')
             disc_raw = data.get('text_dominant', 'не определён')
             if isinstance(disc_raw, list):
@@ -140,66 +313,88 @@ class RAGPsychologyAdvisor:
                 disc_str = "не определён"
             main_topic = data.get('topic_interests', {}).get('main_interest', 'не определена')
             participants_info.append(f"- {name}: доминирующая эмоция — {emotion}, стиль DISC — {disc_str}, интересы — {main_topic}")
-        
-        if participants_info:
-            summary_lines.append("Участники:\n" + "\n".join(participants_info))
 
-        analysis_summary = "\n".join(summary_lines)
+        if query:
+            facts_lines = self._trim_facts(retrieved_facts, query)
+        else:
+            facts_lines = [f"• {item['content']} (Источник: {item['source']})" for item in retrieved_facts]
 
-        facts_text = "\n".join([
-            f"• {item['content']} (Источник: {item['source']})"
-            for item in retrieved_facts
-        ]) or "Нет релевантных данных."
+        return self.packer.pack(PROMPT_TEMPLATE, summary_lines, participants_info, facts_lines)
 
-        prompt = f"""Ты — лицензированный психолог с 15-летним стажем. На основе анализа переписки и научных данных дай краткий, практичный и обоснованный совет.
+    def retrieve(self, analysis: Dict[str, Any]) -> Tuple[List[str], List[int]]:
+        """Этап извлечения: подзапросы и id отобранных записей базы знаний."""
+        queries = self._build_queries(analysis)
+        return queries, self._search_ids(queries, top_k=3)[:self.candidate_facts]
 
-Анализ переписки:
-{analysis_summary}
-
-Релевантные научные данные:
-{facts_text}
-
-Требования:
-- Давай 3-5 конкретных совета.
-- Ссылаёшься на источники: «Как отмечает Дж. Готтман…», «Согласно модели DISC…».
-- Избегай общих фраз вроде «нужно лучше общаться».
-- Пиши на русском, в поддерживающем, но профессиональном тоне.
-- Ответ должен быть не длиннее 500 слов.
-
-Ответ:"""
-        return prompt
-
-    def generate_advice(self, analysis: Dict[str, Any]) -> str:
-        """Генерирует совет на основе анализа и RAG."""
-        topics = [t["topic"] for t in analysis.get("dominant_topics", [])]
-        emotions = list({data.get("dominant_emotion") for data in analysis.get("participants_analysis", {}).values() if data.get("dominant_emotion")})
-        
-        disc_tokens = set()
-        for data in analysis.get("participants_analysis", {}).values():
-            for key in ["text_dominant", "test_dominant"]:
-                val = data.get(key)
-                if isinstance(val, list):
-                    for v in val:
-                        if isinstance(v, str):
-                            disc_tokens.add(v)
-                elif isinstance(val, str):
-                    disc_tokens.add(val)
-        disc_list = sorted(disc_tokens)
-
-        query = f"{' '.join(topics)} {' '.join(emotions)} {' '.join(disc_list)}"
-        query = query.strip() or "общий психологический анализ межличностной коммуникации"
-
-        retrieved = self._retrieve_relevant_facts(query, top_k=3)
-        prompt = self._build_prompt(analysis, retrieved)
+    def summarize_dialog(self, store) -> str:
+        """
+        Этап краткого содержания: DialogStore → сжатый пересказ переписки для промпта.
+        Ошибка LLM не роняет анализ: совет строится без пересказа (пустая строка).
+        В кэш попадают только пересказы, сгенерированные целиком.
+        """
+        try:
+            return self.summarizer.summarize(store)
+        except Exception as e:
+            print(f"⚠️ Краткое содержание не построено, совет без него: {e}")
+            metrics.inc("summary_failures")
+            return ""
+
+    def generate_advice(self, analysis: Dict[str, Any], digest: Optional[str] = None) -> str:
+        """Генерирует совет на основе анализа и RAG (и краткого содержания, если передано)."""
+        return self.generate_from_retrieved(analysis, *self.retrieve(analysis), digest=digest)
+
+    def _generation_params(self) -> Dict[str, Any]:
+        return {
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "seed": self.seed,
+            "stop": self.stop,
+            "n_ctx": self.n_ctx,
+            "prompt_budget": self.prompt_budget,
+        }
+
+    def versions(self) -> Dict[str, Any]:
+        """Версии компонентов, от которых зависит совет (для ключей кэша результатов)."""
+        return {
+            "embedding_model": self.embedding_model_name,
+            "index": self.kb_hash,
+            "prompt_version": PROMPT_VERSION,
+            "llm": self.backend.fingerprint(),
+            "params": self._generation_params(),
+        }
+
+    def generate_from_retrieved(self, analysis: Dict[str, Any], queries: List[str],
+                                entry_ids: List[int], digest: Optional[str] = None) -> str:
+        """Этап генерации: промпт по уже извлечённым фактам (и краткому содержанию) и ответ LLM."""
+        cache_key = None
+        if self.advice_cache is not None:
+            cache_key = make_advice_key(analysis, entry_ids, self.backend.fingerprint(),
+                                        self._generation_params(), digest,
+                                        kb_hash=self.kb_hash, prompt_version=PROMPT_VERSION)
+            cached = self.advice_cache.get(cache_key)
+            if cached is not None:
+                metrics.inc("advice_cache_hits")
+                return cached
+
+        retrieved = [self.knowledge_base[idx] for idx in entry_ids]
+        prompt = self._build_prompt(analysis, retrieved, queries[0], digest)
 
         try:
-            output = self.llm(
-                prompt,
-                max_tokens=256,       # ← не больше 128!
-                temperature=0.7,
-                stop=["Анализ переписки:", "Релевантные научные данные:", "\n\n"],
-                echo=False
-            )
-            return output["choices"][0]["text"].strip()
+            # Бэкенды LLM не потокобезопасны — одна генерация за раз
+            if metrics.is_enabled():  # токенизация промпта — только ради метрики
+                metrics.inc("llm_prompt_tokens", self._count_tokens(prompt))
+            with self._generate_lock, metrics.timer("llm_generate", backend=self.backend.name):
+                advice = self.backend.generate(
+                    prompt,
+                    max_tokens=self.max_tokens,
+                    temperature=self.temperature,
+                    stop=self.stop,
+                    seed=self.seed
+                )
         except Exception as e:
-            return f"Ошибка генерации: {e}"
\ No newline at end of file
+            # Ошибки генерации не кэшируем (и ResultCache узнаёт их по типу)
+            return GenerationFailed(f"Ошибка генерации: {e}")
+
+        if cache_key is not None:
+            self.advice_cache.put(cache_key, advice)
+        return advice
@@ -0,0 +1,338 @@
+"""
+Реестр моделей процесса: загрузка по требованию, бюджет памяти и выгрузка LRU.
+
+Модель регистрируется загрузчиком и грузится при первом обращении.
+Занимаемая память оценивается по приросту RSS процесса во время загрузки
+(не меньше size_mb из регистрации — llama.cpp отображает GGUF в память,
+и RSS растёт уже при генерации); при бюджете загрузки разных моделей
+поэтому идут по одной. Если загрузка не помещается в бюджет
+WEBPSYCHO_MODEL_BUDGET_MB, сначала выгружаются давно не использованные
+модели. Модель, которую кто-то держит (acquire/use, счётчик ссылок),
+не выгружается; если освободить память нечем, модель всё равно
+загружается, с предупреждением.
+
+    registry.register("emotion", load_fn, size_mb=1100)
+    with registry.use("emotion") as model:   # держит модель на время блока
+        model(text)
+    proxy = registry.proxy("emotion")        # объект вместо модели: каждый
+    proxy(text)                              # вызов берёт и отпускает её сам
+    proxy.call("encode", texts)              # то же для метода модели
+    registry.preload("emotion")              # загрузить заранее (тёплый старт)
+
+Счётчики model_loads, model_unloads и model_hits (метка model) пишутся
+в metrics; сводка по моделям — registry.stats().
+"""
+import gc
+import os
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+
+BUDGET_ENV = "WEBPSYCHO_MODEL_BUDGET_MB"
+MB = 1 << 20
+
+
+def resident_bytes() -> int:
+    """RSS процесса; 0, если /proc недоступен."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _release_memory():
+    gc.collect()
+    torch = sys.modules.get("torch")  # только если torch уже импортирован кем-то
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class _Entry:
+    def __init__(self, name, loader, size_mb, unloader, attributes):
+        self.name = name
+        self.loader = loader
+        self.size_hint = int((size_mb or 0) * MB)
+        self.unloader = unloader
+        self.attributes = attributes or {}
+        self.model = None
+        self.size = 0
+        self.refs = 0
+        self.stale = False  # выгрузить, как только отпустят
+        self.loads = self.unloads = self.hits = 0
+        self.last_used = None
+        self.load_seconds = 0.0
+        self.load_lock = threading.Lock()
+
+
+class ModelRegistry:
+    """
+    Модели процесса с общим бюджетом памяти.
+
+    Атрибуты:
+        budget (int): Бюджет в байтах; 0 — без ограничения.
+    """
+
+    def __init__(self, budget_mb: Optional[float] = None):
+        if budget_mb is None:
+            budget_mb = float(os.environ.get(BUDGET_ENV, "0") or 0)
+        self.budget = int(budget_mb * MB)
+        self._entries: Dict[str, _Entry] = {}
+        self._lru = OrderedDict()  # загруженные модели, от давно использованной к недавней
+        self._lock = threading.RLock()
+        # При бюджете загрузки идут по одной: иначе прирост RSS одной загрузки
+        # включал бы память соседней, и обе модели получили бы завышенный размер.
+        # RLock — загрузчик модели может сам взять из реестра другую
+        self._load_lock = threading.RLock() if self.budget else None
+
+    def register(self, name: str, loader: Callable[[], Any], size_mb: Optional[float] = None,
+                 unloader: Optional[Callable[[Any], None]] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        """
+        Регистрирует модель. Повторная регистрация того же имени ничего не
+        меняет (модули могут импортироваться несколько раз).
+
+        Args:
+            loader: Функция без аргументов, возвращающая модель.
+            size_mb: Ожидаемый размер — нижняя граница оценки и запас при
+                     освобождении памяти до первой загрузки.
+            unloader: Вызывается с моделью при выгрузке (закрыть файлы, пулы).
+            attributes: Атрибуты, которые proxy отдаёт без загрузки модели
+                        (имя, версия для ключей кэша).
+        """
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = _Entry(name, loader, size_mb, unloader, attributes)
+
+    def _entry(self, name: str) -> _Entry:
+        try:
+            return self._entries[name]
+        except KeyError:
+            raise KeyError(f"Модель {name!r} не зарегистрирована")
+
+    def is_registered(self, name: str) -> bool:
+        return name in self._entries
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._lru
+
+    # ---------------------- ССЫЛКИ ----------------------
+    def acquire(self, name: str) -> Any:
+        """Модель (загружается при необходимости); не выгружается до release(name)."""
+        entry = self._entry(name)
+        with self._lock:
+            entry.refs += 1
+            entry.last_used = time.time()
+            if entry.model is not None:
+                return self._hit(entry)
+        try:
+            with self._load_lock or nullcontext(), entry.load_lock:
+                with self._lock:
+                    if entry.model is not None:  # загрузил соседний поток
+                        return self._hit(entry)
+                return self._load(entry)
+        except BaseException:
+            with self._lock:
+                entry.refs -= 1
+            raise
+
+    def release(self, name: str):
+        entry = self._entry(name)
+        with self._lock:
+            entry.refs -= 1
+            unload = entry.refs == 0 and entry.stale
+        if unload:
+            self.unload(name)
+        elif self.budget:
+            # Загрузка сверх бюджета (всё было занято) — освобождаем, как только можно
+            self._make_room(0, warn=False)
+
+    @contextmanager
+    def use(self, name: str):
+        model = self.acquire(name)
+        try:
+            yield model
+        finally:
+            self.release(name)
+
+    def preload(self, *names: str) -> List[str]:
+        """
+        Загружает модели заранее, не удерживая их: процесс стартует тёплым,
+        но при нехватке бюджета модели по-прежнему выгружаются LRU.
+        Возвращает имена моделей, которые пришлось загрузить.
+        """
+        loaded = []
+        for name in names:
+            if not self.is_loaded(name):
+                loaded.append(name)
+            self.acquire(name)
+            self.release(name)
+        return loaded
+
+    def proxy(self, name: str) -> "ModelProxy":
+        self._entry(name)
+        return ModelProxy(self, name)
+
+    def _hit(self, entry: _Entry) -> Any:
+        entry.hits += 1
+        self._lru.move_to_end(entry.name)
+        metrics.inc("model_hits", model=entry.name)
+        return entry.model
+
+    # ---------------------- ЗАГРУЗКА И ВЫГРУЗКА ----------------------
+    def _load(self, entry: _Entry) -> Any:
+        self._make_room(max(entry.size, entry.size_hint), keep=entry.name)
+        print(f"📥 Реестр моделей: загружаем {entry.name}...")
+        before = resident_bytes()
+        start = time.perf_counter()
+        model = entry.loader()
+        elapsed = time.perf_counter() - start
+        size = max(resident_bytes() - before, entry.size_hint)
+        with self._lock:
+            entry.model, entry.size, entry.stale = model, size, False
+            entry.loads += 1
+            entry.load_seconds += elapsed
+            self._lru[entry.name] = None
+        metrics.inc("model_loads", model=entry.name)
+        metrics.observe("model_load_seconds", elapsed, model=entry.name)
+        # Оценка могла оказаться больше ожидаемой — освобождаем место за счёт других
+        self._make_room(0, keep=entry.name)
+        return model
+
+    def _make_room(self, needed: int, keep: Optional[str] = None, warn: bool = True):
+        """Выгружает давно не использованные свободные модели, пока needed не поместится в бюджет."""
+        if not self.budget:
+            return
+        while True:
+            with self._lock:
+                used = sum(self._entries[n].size for n in self._lru)
+                if used + needed <= self.budget:
+                    return
+                victim = next((n for n in self._lru if n != keep and self._entries[n].refs == 0), None)
+            if victim is None:
+                if warn:
+                    print(f"⚠️ Реестр моделей: бюджет {self.budget / MB:.0f} МБ превышен "
+                          f"({(used + needed) / MB:.0f} МБ), все модели заняты")
+                return
+            self.unload(victim)
+
+    def unload(self, name: str) -> bool:
+        """
+        Выгружает модель. Если её кто-то держит, она только помечается и
+        выгрузится при последнем release; возвращает, выгружена ли сейчас.
+        """
+        entry = self._entry(name)
+        with self._lock:
+            if entry.model is None:
+                return False
+            if entry.refs > 0:
+                entry.stale = True
+                return False
+            model, entry.model = entry.model, None
+            entry.unloads += 1
+            entry.stale = False
+            self._lru.pop(name, None)
+        print(f"📤 Реестр моделей: выгружаем {name} (~{entry.size / MB:.0f} МБ)")
+        if entry.unloader is not None:
+            entry.unloader(model)
+        del model
+        _release_memory()
+        metrics.inc("model_unloads", model=name)
+        return True
+
+    def unload_all(self) -> int:
+        return sum(self.unload(name) for name in list(self._lru))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {
+                name: {
+                    "loaded": e.model is not None,
+                    "size_mb": round(e.size / MB, 1),
+                    "refs": e.refs,
+                    "loads": e.loads,
+                    "unloads": e.unloads,
+                    "hits": e.hits,
+                    "load_seconds": round(e.load_seconds, 3),
+                    "last_used": e.last_used,
+                }
+                for name, e in self._entries.items()
+            }
+            resident = sum(self._entries[n].size for n in self._lru)
+        return {
+            "budget_mb": round(self.budget / MB, 1) if self.budget else None,
+            "resident_mb": round(resident / MB, 1),
+            "lru": list(self._lru),
+            "models": models,
+        }
+
+
+class ModelProxy:
+    """
+    Заменитель модели для кода, который хранит её в атрибуте.
+
+    Вызов proxy(...) и proxy.call("method", ...) берут модель из реестра на
+    время вызова (генератор — до конца итерации) и отпускают её, так что
+    между вызовами модель может быть выгружена. Через точку доступны только
+    атрибуты, объявленные в attributes при регистрации; остальные имена —
+    AttributeError, чтобы proxy не выдавал себя за модель (hasattr, getattr
+    с умолчанием) и не грузил её ради проверки.
+    """
+
+    def __init__(self, registry: ModelRegistry, name: str):
+        self._registry = registry
+        self.name = name
+
+    @property
+    def version(self) -> str:
+        """Версия модели для ключей кэша, без загрузки."""
+        return self._registry._entry(self.name).attributes.get("version", self.name)
+
+    def hold(self):
+        """Держать модель загруженной на время блока with (например, весь анализ)."""
+        return self._registry.use(self.name)
+
+    def _call(self, method: Optional[str], args, kwargs):
+        model = self._registry.acquire(self.name)
+        try:
+            result = (model if method is None else getattr(model, method))(*args, **kwargs)
+        except BaseException:
+            self._registry.release(self.name)
+            raise
+        if isinstance(result, types.GeneratorType):
+            return self._held(result)
+        self._registry.release(self.name)
+        return result
+
+    def _held(self, gen):
+        try:
+            yield from gen
+        finally:
+            self._registry.release(self.name)
+
+    def __call__(self, *args, **kwargs):
+        return self._call(None, args, kwargs)
+
+    def call(self, method: str, *args, **kwargs):
+        """Вызов метода модели: model.method(*args, **kwargs) на время вызова."""
+        return self._call(method, args, kwargs)
+
+    def __getattr__(self, attr: str):
+        if not attr.startswith("_"):
+            attributes = self._registry._entry(self.name).attributes
+            if attr in attributes:
+                return attributes[attr]
+        raise AttributeError(f"{attr!r}: атрибут модели {self.name!r} не объявлен в реестре, "
+                             f"методы вызываются через proxy.call({attr!r}, ...)")
+
+    def __repr__(self) -> str:
+        return f"ModelProxy({self.name!r})"
+
+
+registry = ModelRegistry()
@@ -0,0 +1,208 @@
+"""
+Иерархическое (map-reduce) краткое содержание диалога для промпта советчика.
+
+Реальная переписка не помещается в контекст LLM (n_ctx=2048), поэтому:
+    1. chunk  — сообщения по порядку режутся на фрагменты до chunk_tokens
+                токенов; новый фрагмент начинается и на паузе дольше
+                gap_seconds, и при смене темы (маски store.results['topic_mask']),
+                если текущий фрагмент уже заполнен хотя бы наполовину;
+    2. map    — каждый фрагмент пересказывается LLM (параллельно, до workers
+                фрагментов сразу);
+    3. reduce — пересказы объединяются группами по fan_in, пока не останется
+                один, не длиннее digest_tokens — он и попадает в промпт.
+
+Границы фрагментов зависят только от предыдущих сообщений, поэтому при
+дописывании чата меняется лишь последний фрагмент. Пересказы фрагментов и
+промежуточные объединения кэшируются по хешу своего входа (SummaryCache):
+повторно LLM вызывается только для новых фрагментов и для групп с ними.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, List, Optional
+
+from analyzers.dialog_store import NO_TIME, DialogStore
+import metrics
+
+MAP_TEMPLATE = """Кратко перескажи фрагмент переписки: о чём говорят участники, что их беспокоит, как они относятся друг к другу. 2–3 предложения, без оценок, по-русски.
+
+Фрагмент:
+{text}
+
+Краткое содержание:"""
+
+REDUCE_TEMPLATE = """Ниже — краткие содержания последовательных частей одной переписки. Объедини их в одно связное краткое содержание: главные темы, конфликты и их развитие. Не длиннее 5 предложений, по-русски.
+
+{text}
+
+Общее краткое содержание:"""
+
+PROMPT_VERSION = 1  # меняется вместе с шаблонами — старые пересказы не используются
+
+
+class SummaryCache:
+    """
+    Пересказы в каталоге: по файлу на ключ (хеш входа), переживают перезапуск.
+
+    Атрибуты:
+        cache_dir (str): Каталог с записями.
+        hits (int), misses (int): Счётчики обращений за время жизни объекта.
+    """
+
+    def __init__(self, cache_dir: str = os.path.join("rag_cache", "summaries")):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.txt")
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                summary = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return summary
+
+    def put(self, key: str, summary: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(summary)
+        os.replace(tmp_path, path)
+
+
+class DialogSummarizer:
+    """
+    Краткое содержание диалога через бэкенд генерации.
+
+    Атрибуты:
+        backend (GenerationBackend): Бэкенд LLM (тот же, что у советчика).
+        chunk_tokens (int): Предельный размер фрагмента в токенах.
+        summary_tokens (int): Длина пересказа фрагмента (max_tokens генерации).
+        digest_tokens (int): Длина итогового краткого содержания.
+        fan_in (int): Сколько пересказов объединяется за один вызов reduce.
+        gap_seconds (int): Пауза, после которой начинается новый фрагмент.
+        workers (int): Сколько фрагментов пересказывается одновременно.
+    """
+
+    def __init__(self, backend, count_tokens: Optional[Callable[[str], int]] = None,
+                 cache: Optional[SummaryCache] = None, chunk_tokens: int = 900,
+                 summary_tokens: int = 96, digest_tokens: int = 200, fan_in: int = 4,
+                 gap_seconds: int = 6 * 3600, workers: int = 2, lock=None,
+                 temperature: float = 0.3, seed: int = 42):
+        self.backend = backend
+        self.count_tokens = count_tokens or backend.count_tokens
+        self.cache = cache
+        self.chunk_tokens = chunk_tokens
+        self.summary_tokens = summary_tokens
+        self.digest_tokens = digest_tokens
+        self.fan_in = max(2, fan_in)
+        self.gap_seconds = gap_seconds
+        self.workers = max(1, workers)
+        # Бэкенд, не допускающий параллельных вызовов (llama.cpp), передаёт свой замок
+        self._lock = lock
+        self.temperature = temperature
+        self.seed = seed
+
+    # ---------------------- ФРАГМЕНТЫ ----------------------
+    def _line(self, store: DialogStore, i: int, text: str) -> str:
+        line = f"{store.sender(i) or '—'}: {text}"
+        # Одно сообщение длиннее фрагмента обрезаем, пока не поместится
+        while len(line) > 16 and self.count_tokens(line) > self.chunk_tokens:
+            line = line[:len(line) // 2] + "…"
+        return line
+
+    def chunk(self, store: DialogStore) -> List[str]:
+        """Тексты фрагментов: строки «отправитель: текст» подряд, по времени и темам."""
+        masks = store.results.get("topic_mask")
+        chunks, lines = [], []
+        used = chunk_topics = 0
+        prev_time = NO_TIME
+        for i, text in enumerate(store.iter_texts()):
+            if not text:
+                continue
+            line = self._line(store, i, text)
+            cost = self.count_tokens(line + "\n")
+            t = int(store.times[i])
+            mask = int(masks[i]) if masks is not None else 0
+            gap = prev_time != NO_TIME and t != NO_TIME and t - prev_time > self.gap_seconds
+            topic_shift = (mask and chunk_topics and not mask & chunk_topics
+                           and used >= self.chunk_tokens // 2)
+            if lines and (used + cost > self.chunk_tokens or gap or topic_shift):
+                chunks.append("\n".join(lines))
+                lines, used, chunk_topics = [], 0, 0
+            lines.append(line)
+            used += cost
+            chunk_topics |= mask
+            if t != NO_TIME:
+                prev_time = t
+        if lines:
+            chunks.append("\n".join(lines))
+        return chunks
+
+    # ---------------------- MAP И REDUCE ----------------------
+    def _key(self, kind: str, text: str, max_tokens: int) -> str:
+        payload = {
+            "kind": kind,
+            "text": text,
+            "max_tokens": max_tokens,
+            "prompt_version": PROMPT_VERSION,
+            "model": self.backend.fingerprint(),
+            "params": [self.temperature, self.seed],
+        }
+        canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _generate(self, kind: str, template: str, text: str, max_tokens: int) -> str:
+        key = self._key(kind, text, max_tokens) if self.cache is not None else None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.inc("summary_cache_hits", kind=kind)
+                return cached
+        metrics.inc("summary_cache_misses", kind=kind)
+        with self._lock or nullcontext(), metrics.timer("summary_generate", kind=kind):
+            summary = self.backend.generate(template.format(text=text), max_tokens=max_tokens,
+                                            temperature=self.temperature, stop=["\n\n"], seed=self.seed)
+        summary = " ".join(summary.split())
+        if key is not None and summary:
+            self.cache.put(key, summary)
+        return summary
+
+    def _map(self, chunks: List[str]) -> List[str]:
+        workers = 1 if metrics.memory_tracking() else self.workers  # пик памяти — по фрагменту
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summary") as pool:
+            return list(pool.map(lambda c: self._generate("map", MAP_TEMPLATE, c, self.summary_tokens), chunks))
+
+    def _reduce(self, summaries: List[str]) -> str:
+        level = 0
+        while len(summaries) > 1:
+            level += 1
+            groups = ["\n".join(f"{j + 1}. {s}" for j, s in enumerate(summaries[i:i + self.fan_in]))
+                      for i in range(0, len(summaries), self.fan_in)]
+            # Последний уровень — итог, он короче промежуточных не бывает
+            max_tokens = self.digest_tokens if len(groups) == 1 else self.summary_tokens * 2
+            summaries = [self._generate("reduce", REDUCE_TEMPLATE, g, max_tokens) for g in groups]
+            metrics.inc("summary_reduce_calls", len(groups))
+        return summaries[0] if summaries else ""
+
+    def summarize(self, store: DialogStore) -> str:
+        """Краткое содержание диалога (пустая строка — нечего пересказывать)."""
+        chunks = self.chunk(store)
+        metrics.inc("summary_chunks", len(chunks))
+        if not chunks:
+            return ""
+        if len(chunks) == 1 and self.count_tokens(chunks[0]) <= self.digest_tokens:
+            return " ".join(chunks[0].split("\n"))  # короткий диалог целиком
+        digest = self._reduce(self._map(chunks))
+        # Однофрагментный пересказ мог выйти длиннее итогового бюджета
+        if self.count_tokens(digest) > self.digest_tokens:
+            digest = self._generate("reduce", REDUCE_TEMPLATE, f"1. {digest}", self.digest_tokens)
+        return digest
@@ -1,7 +1,141 @@
+import codecs
 import json
 import os
 import sys
-from typing import Any, List, Dict
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, List, Dict, Iterator, Optional
+
+CHUNK_SIZE = 1 << 16  # символов за одно чтение файла
+
+
+class JsonStream:
+    """
+    Инкрементальный разбор JSON-файла без загрузки целиком.
+
+    Контейнеры обходятся через iter_object() / iter_array(); отдельные
+    значения (например, одно сообщение) декодируются целиком через
+    read_value(). Значение, которое потребитель не прочитал, пропускается
+    с постоянной памятью. В памяти держится только текущий кусок файла.
+    """
+
+    _WS = " \t\n\r"
+
+    def __init__(self, f, chunk_size: int = CHUNK_SIZE):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._base = 0  # сколько символов файла уже отброшено из буфера
+        self._eof = False
+
+    @property
+    def offset(self) -> int:
+        """Позиция в файле (в символах)."""
+        return self._base + self._pos
+
+    def value_offset(self) -> int:
+        """Позиция начала следующего значения (пробелы пропускаются)."""
+        self._peek()
+        return self.offset
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        # Отбрасываем уже разобранную часть буфера
+        self._base += self._pos
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in self._WS:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError(f"Неожиданный конец JSON на позиции {self.offset}")
+
+    def _expect(self, chars: str) -> str:
+        c = self._peek()
+        if c not in chars:
+            raise ValueError(f"Ожидался один из {chars!r}, получено {c!r} на позиции {self.offset}")
+        self._pos += 1
+        return c
+
+    def read_value(self) -> Any:
+        """Декодирует следующее значение целиком."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # Число на границе куска могло обрезаться — дочитываем и разбираем снова
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def skip_value(self):
+        """
+        Пропускает значение. Объекты обходятся по ключам, элементы массивов
+        декодируются по одному (быстрый C-декодер), так что в памяти не больше
+        одного элемента массива.
+        """
+        c = self._peek()
+        if c == "{":
+            for _ in self.iter_object():
+                pass
+        elif c == "[":
+            for _ in self.iter_array():
+                self.read_value()
+        else:
+            self.read_value()
+
+    def iter_object(self) -> Iterator[str]:
+        """
+        Обходит объект: отдаёт ключи, после каждого поток стоит перед значением.
+        Если потребитель не прочитал значение, оно пропускается.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self._expect(":")
+            mark = self.value_offset()
+            yield key
+            if self.offset == mark:
+                self.skip_value()
+            if self._expect(",}") == "}":
+                return
+
+    def iter_array(self) -> Iterator[int]:
+        """Обходит массив: отдаёт номер элемента, поток стоит перед элементом."""
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        i = 0
+        while True:
+            mark = self.value_offset()
+            yield i
+            if self.offset == mark:
+                self.skip_value()
+            i += 1
+            if self._expect(",]") == "]":
+                return
+
 
 def extract_text_from_entities(text_field: Any) -> str:
     """
@@ -22,56 +156,275 @@ def extract_text_from_entities(text_field: Any) -> str:
     else:
         return ""
 
+def normalize_message(msg: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Сообщение экспорта → {sender, text, time} или None для служебных и пустых."""
+    # Пропускаем не-сообщения (service-сообщения и т.п.)
+    if msg.get("type") != "message":
+        return None
+
+    # Извлекаем текст (обрабатываем разные форматы)
+    text = extract_text_from_entities(msg.get("text", ""))
+
+    # Пропускаем пустые сообщения и медиа без текста
+    if not text:
+        return None
+
+    # Сохраняем только нужные поля
+    return {
+        "sender": msg.get("from", "Unknown"),
+        "text": text,
+        "time": msg.get("date")  # ISO 8601, подходит для большинства целей
+    }
+
+
+def iter_chat_messages(stream: JsonStream, meta: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Обходит объект чата из текущей позиции потока и отдаёт нормализованные
+    сообщения. Остальные поля чата (id, name, type) складываются в meta.
+    """
+    meta = meta if meta is not None else {}
+    for key in stream.iter_object():
+        if key == "messages":
+            for _ in stream.iter_array():
+                cleaned = normalize_message(stream.read_value())
+                if cleaned is not None:
+                    yield cleaned
+        elif key in ("id", "name", "type"):
+            meta[key] = stream.read_value()
+
+
+def iter_telegram_messages(input_path: str, meta: Optional[Dict[str, Any]] = None,
+                           chunk_size: int = CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Генератор нормализованных сообщений {sender, text, time} из result.json
+    Telegram Desktop. Файл читается кусками, память не зависит от размера
+    экспорта. Метаданные чата (id, name) по ходу разбора попадают в meta.
+    """
+    with open(input_path, "r", encoding="utf-8") as f:
+        yield from iter_chat_messages(JsonStream(f, chunk_size), meta)
+
+
+def write_dialog_stream(messages: Iterator[Dict[str, Any]], meta: Dict[str, Any], output_path: str) -> int:
+    """
+    Пишет диалог в формате MainAnalyzer по мере поступления сообщений
+    (по сообщению на строку) и возвращает их число. Метаданные дописываются
+    в конце: в экспорте они могут идти после массива сообщений.
+    """
+    tmp_path = f"{output_path}.tmp"
+    count = 0
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write('{"messages": [')
+        for msg in messages:
+            f.write(",\n" if count else "\n")
+            f.write(json.dumps(msg, ensure_ascii=False))
+            count += 1
+        f.write("\n],\n")
+        f.write(f'"dialog_id": {json.dumps(meta.get("id"))},\n')
+        f.write(f'"title": {json.dumps(meta.get("name"), ensure_ascii=False)}\n}}\n')
+    os.replace(tmp_path, output_path)
+    return count
+
+
+def load_dialog(input_path: str) -> Dict[str, Any]:
+    """
+    Читает экспорт Telegram сразу в формат MainAnalyzer — без промежуточного
+    файла и без полной копии исходного JSON в памяти.
+    """
+    meta = {}
+    messages = list(iter_telegram_messages(input_path, meta))
+    return {"dialog_id": meta.get("id"), "title": meta.get("name"), "messages": messages}
+
+
 def clean_telegram_export(input_path: str, output_path: str):
     """
     Преобразует экспорт Telegram в формат, совместимый с MainAnalyzer.
     
     Ожидаемый вход: result.json от Telegram Desktop
     Выход: cleaned_chat.json с минимальной структурой
+
+    Экспорт разбирается потоково, а результат пишется по мере разбора,
+    поэтому пиковая память не растёт с размером экспорта.
     """
-    with open(input_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    meta = {}
+    count = write_dialog_stream(iter_telegram_messages(input_path, meta), meta, output_path)
+
+    print(f"✅ Успешно обработано {count} сообщений.")
+    print(f"📁 Результат сохранён в: {output_path}")
+
+# ---------------------- ПОЛНЫЙ ЭКСПОРТ АККАУНТА ----------------------
+MANIFEST_NAME = "manifest.json"
+
+
+def _read_spans(input_path: str, spans: List[tuple]) -> List[Any]:
+    """
+    Значения JSON по байтовым диапазонам [start, end), разобранные из UTF-8.
+    Строку, прочитанную как latin-1, обратно не перекодировать: экранирования
+    \\uXXXX в ней уже раскрыты в символы вне latin-1.
+    """
+    values = []
+    with open(input_path, "rb") as f:
+        for start, end in spans:
+            f.seek(start)
+            values.append(json.loads(f.read(end - start).decode("utf-8")))
+    return values
+
+
+def scan_export(input_path: str) -> Dict[str, Any]:
+    """
+    Определяет тип экспорта и для полного экспорта аккаунта находит байтовые
+    границы каждого чата в chats.list.
+
+    Файл читается как latin-1: один байт — один символ, поэтому позиции
+    потока совпадают с байтовыми смещениями, а структура JSON (ASCII)
+    разбирается правильно. Метаданные чатов запоминаются как байтовые
+    диапазоны и затем разбираются заново из UTF-8.
 
-    # Базовые метаданные
-    cleaned = {
-        "dialog_id": data.get("id"),
-        "title": data.get("name"),
-        "messages": []
+    Returns:
+        dict: {'kind': 'chat'} для экспорта одного чата или
+              {'kind': 'account', 'chats': [{id, name, type, start, end}, ...]}.
+    """
+    chats, fields = None, []
+    with open(input_path, "r", encoding="latin-1", newline="") as f:
+        stream = JsonStream(f)
+        for key in stream.iter_object():
+            if key == "messages":
+                return {"kind": "chat"}
+            if key != "chats":
+                continue
+            chats = []
+            for chats_key in stream.iter_object():
+                if chats_key != "list":
+                    continue
+                for _ in stream.iter_array():
+                    chat = {"start": stream.value_offset()}
+                    for chat_key in stream.iter_object():
+                        if chat_key in ("id", "name", "type"):
+                            value_start = stream.value_offset()
+                            stream.read_value()
+                            fields.append((chat, chat_key, value_start, stream.offset))
+                    chat["end"] = stream.offset
+                    chats.append(chat)
+            break
+    if chats is None:
+        raise ValueError(f"{input_path}: не найдено ни 'messages', ни 'chats' — это не экспорт Telegram")
+    values = _read_spans(input_path, [(start, end) for _, _, start, end in fields])
+    for (chat, key, _, _), value in zip(fields, values):
+        chat[key] = value
+    return {"kind": "account", "chats": chats}
+
+
+class _SpanReader:
+    """Текстовое чтение байтового диапазона [start, end) файла в UTF-8."""
+
+    def __init__(self, f, start: int, end: int):
+        self._f = f
+        self._end = end
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        f.seek(start)
+
+    def read(self, size: int) -> str:
+        while True:
+            remaining = self._end - self._f.tell()
+            if remaining <= 0:
+                return self._decoder.decode(b"", final=True)
+            text = self._decoder.decode(self._f.read(min(size, remaining)))
+            # Пустая строка означала бы конец файла — дочитываем обрезанный символ
+            if text:
+                return text
+
+
+def shard_name(chat: Dict[str, Any], index: int) -> str:
+    chat_id = chat.get("id")
+    return f"chat_{chat_id}.json" if chat_id is not None else f"chat_n{index}.json"
+
+
+def convert_chat_span(input_path: str, chat: Dict[str, Any], output_path: str) -> Dict[str, Any]:
+    """Разбирает один чат по его байтовым границам и пишет шард (выполняется в воркере)."""
+    start = time.perf_counter()
+    meta = {}
+    with open(input_path, "rb") as f:
+        stream = JsonStream(_SpanReader(f, chat["start"], chat["end"]))
+        count = write_dialog_stream(iter_chat_messages(stream, meta), meta, output_path)
+    return {
+        "chat_id": meta.get("id"),
+        "title": meta.get("name"),
+        "type": meta.get("type"),
+        "messages": count,
+        "path": output_path,
+        "bytes": os.path.getsize(output_path),
+        "source_offsets": [chat["start"], chat["end"]],
+        "seconds": round(time.perf_counter() - start, 3),
     }
 
-    for msg in data.get("messages", []):
-        # Пропускаем не-сообщения (service-сообщения и т.п.)
-        if msg.get("type") != "message":
-            continue
 
-        # Извлекаем текст (обрабатываем разные форматы)
-        raw_text = msg.get("text", "")
-        text = extract_text_from_entities(raw_text)
+def convert_account_export(input_path: str, out_dir: str, workers: Optional[int] = None,
+                           scan: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Полный экспорт аккаунта → по шарду на чат (формат MainAnalyzer) и манифест.
 
-        # Пропускаем пустые сообщения и медиа без текста
-        if not text:
-            continue
+    Границы чатов находятся одним проходом, затем чаты разбираются
+    параллельно в пуле процессов (крупные — первыми). Манифест
+    <out_dir>/manifest.json содержит для каждого чата id, название, число
+    сообщений, путь к шарду и байтовые границы чата в исходном экспорте;
+    batch.py принимает манифест как вход и анализирует шарды как отдельные задания.
+    """
+    started = time.perf_counter()
+    scan = scan or scan_export(input_path)
+    if scan["kind"] != "account":
+        raise ValueError(f"{input_path}: это экспорт одного чата, используйте clean_telegram_export")
 
-        # Сохраняем только нужные поля
-        cleaned_msg = {
-            "sender": msg.get("from", "Unknown"),
-            "text": text,
-            "time": msg.get("date")  # ISO 8601, подходит для большинства целей
-        }
-        cleaned["messages"].append(cleaned_msg)
+    chats_dir = os.path.join(out_dir, "chats")
+    os.makedirs(chats_dir, exist_ok=True)
+    jobs = [(chat, os.path.join(chats_dir, shard_name(chat, i))) for i, chat in enumerate(scan["chats"])]
+    jobs.sort(key=lambda job: job[0]["end"] - job[0]["start"], reverse=True)
 
-    # Сохраняем результат
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(cleaned, f, ensure_ascii=False, indent=2)
+    entries = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(convert_chat_span, input_path, chat, path) for chat, path in jobs]
+        for future in as_completed(futures):
+            entry = future.result()
+            entry["path"] = os.path.relpath(entry["path"], out_dir)
+            entries.append(entry)
+    entries.sort(key=lambda e: e["source_offsets"][0])
+
+    manifest = {
+        "source": os.path.abspath(input_path),
+        "chats_total": len(entries),
+        "messages_total": sum(e["messages"] for e in entries),
+        "seconds": round(time.perf_counter() - started, 3),
+        "chats": entries,
+    }
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+    return manifest
+
+
+def read_manifest(manifest_path: str, min_messages: int = 1) -> List[str]:
+    """Абсолютные пути шардов из манифеста (чаты без сообщений пропускаются)."""
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    return [os.path.join(base, e["path"]) for e in manifest["chats"] if e["messages"] >= min_messages]
 
-    print(f"✅ Успешно обработано {len(cleaned['messages'])} сообщений.")
-    print(f"📁 Результат сохранён в: {output_path}")
 
 if __name__ == "__main__":
-    input_file = input()
+    input_file = sys.argv[1] if len(sys.argv) > 1 else input()
     if not os.path.exists(input_file):
         print(f"❌ Файл не найден: {input_file}")
         sys.exit(1)
 
-    output_file = "/home/fedosdan2/prog/pr_act/PROJECT/analysis_results/cleaned_chat.json"
-    clean_telegram_export(input_file, output_file)
\ No newline at end of file
+    scan = scan_export(input_file)
+    if scan["kind"] == "account":
+        # Полный экспорт: второй аргумент — каталог для шардов и манифеста
+        out_dir = (sys.argv[2] if len(sys.argv) > 2 else
+                   "/home/fedosdan2/prog/pr_act/PROJECT/analysis_results/account_export")
+        manifest = convert_account_export(input_file, out_dir, scan=scan)
+        print(f"✅ Чатов: {manifest['chats_total']}, сообщений: {manifest['messages_total']} "
+              f"за {manifest['seconds']} c")
+        print(f"📁 Манифест: {os.path.join(out_dir, MANIFEST_NAME)}")
+    else:
+        output_file = (sys.argv[2] if len(sys.argv) > 2 else
+                       "/home/fedosdan2/prog/pr_act/PROJECT/analysis_results/cleaned_chat.json")
+        clean_telegram_export(input_file, output_file)
\ No newline at end of file
@@ -0,0 +1,242 @@
+"""
+Компактный формат результатов анализа: маленький JSON-заголовок со сводкой
+и отдельный построчный файл результатов по сообщениям.
+
+    <stem>_analysis.json   — сводка MainAnalyzer.analyze + описание файла строк
+    <stem>_messages.jsonl  — по строке-массиву на сообщение (колонки — в заголовке)
+    <stem>_messages.parquet — то же в Parquet (нужен pyarrow)
+
+Строки пишутся инкрементально, по мере готовности батчей модели эмоций
+(в Parquet — группами по ROW_GROUP_ROWS строк: батчи модели для группы
+строк слишком малы). Поэтому порядок строк — порядок обработки: сообщения
+сгруппированы по отправителям, внутри отправителя идут по возрастанию index.
+Сообщения без текста или без отправителя (оценка эмоций не считалась) в файл
+не попадают. Читатели могут загрузить только сводку, только нужные колонки,
+диапазон строк файла или диапазон номеров сообщений (колонка index).
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+COLUMNS = ["index", "sender", "time", "negative", "neutral", "positive", "text"]
+# Каждые OFFSET_EVERY строк JSONL запоминаем байтовое смещение — для чтения диапазонов
+OFFSET_EVERY = 1024
+# Строк в группе Parquet: батчи копятся в памяти, пока не наберётся группа
+ROW_GROUP_ROWS = 65536
+
+
+def _row_values(row: Dict[str, Any]) -> List[Any]:
+    scores = row.get("emotion_scores", {})
+    return [row.get("index"), row.get("sender"), row.get("time"),
+            scores.get("negative", 0.0), scores.get("neutral", 0.0), scores.get("positive", 0.0),
+            row.get("text")]
+
+
+class CompactResultWriter:
+    """
+    Потоковая запись результатов анализа.
+
+    Экземпляр передаётся в MainAnalyzer.analyze(message_sink=writer) и
+    закрывается вызовом close(summary) с итоговой сводкой.
+
+    Атрибуты:
+        header_path (str): Путь к JSON-заголовку.
+        rows_path (str): Путь к файлу строк.
+        fmt (str): 'jsonl' или 'parquet'.
+        rows_written (int): Сколько строк уже записано.
+        offsets (list[int]): JSONL — байтовое смещение каждого блока из OFFSET_EVERY строк.
+        index_ranges (list[list[int]]): JSONL — [min, max] колонки index в каждом блоке.
+    """
+
+    def __init__(self, out_dir: str, stem: str, fmt: str = "jsonl"):
+        if fmt not in ("jsonl", "parquet"):
+            raise ValueError(f"Неизвестный формат вывода: {fmt}")
+        self.fmt = fmt
+        self.header_path = os.path.join(out_dir, f"{stem}_analysis.json")
+        self.rows_path = os.path.join(out_dir, f"{stem}_messages.{fmt}")
+        self._tmp_path = f"{self.rows_path}.tmp"
+        self.rows_written = 0
+        self.offsets = []
+        self.index_ranges = []
+        self._lock = threading.Lock()
+
+        if fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            self._pa = pa
+            self._schema = pa.schema([
+                ("index", pa.int64()),
+                ("sender", pa.dictionary(pa.int32(), pa.string())),
+                ("time", pa.string()),
+                ("negative", pa.float32()),
+                ("neutral", pa.float32()),
+                ("positive", pa.float32()),
+                ("text", pa.string()),
+            ])
+            self._writer = pq.ParquetWriter(self._tmp_path, self._schema, compression="zstd")
+            self._pending = []  # значения строк ещё не записанной группы
+        else:
+            self._file = open(self._tmp_path, "w", encoding="utf-8")
+            self._pos = 0
+
+    def __call__(self, rows: List[Dict[str, Any]]):
+        self.write_rows(rows)
+
+    def write_rows(self, rows: List[Dict[str, Any]]):
+        """Дописывает батч строк (вызывается из потоков конвейера)."""
+        if not rows:
+            return
+        with self._lock:
+            if self.fmt == "parquet":
+                self._pending.extend(_row_values(r) for r in rows)
+                if len(self._pending) >= ROW_GROUP_ROWS:
+                    self._flush_row_group()
+            else:
+                for row in rows:
+                    if self.rows_written % OFFSET_EVERY == 0:
+                        self.offsets.append(self._pos)
+                        self.index_ranges.append([row["index"], row["index"]])
+                    block = self.index_ranges[-1]
+                    block[0], block[1] = min(block[0], row["index"]), max(block[1], row["index"])
+                    line = json.dumps(_row_values(row), ensure_ascii=False, separators=(",", ":")) + "\n"
+                    self._file.write(line)
+                    self._pos += len(line.encode("utf-8"))
+                    self.rows_written += 1
+                return
+            self.rows_written += len(rows)
+
+    def _flush_row_group(self):
+        """Пишет накопленные строки группами по ROW_GROUP_ROWS (под self._lock)."""
+        if not self._pending:
+            return
+        columns = list(zip(*self._pending))
+        self._pending = []
+        arrays = [self._pa.array(col, type=field.type) if not self._pa.types.is_dictionary(field.type)
+                  else self._pa.array(col, type=self._pa.string()).dictionary_encode()
+                  for col, field in zip(columns, self._schema)]
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self._schema),
+                                 row_group_size=ROW_GROUP_ROWS)
+
+    def close(self, summary: Dict[str, Any]) -> str:
+        """Завершает файл строк и пишет заголовок со сводкой. Возвращает путь заголовка."""
+        with self._lock:
+            if self.fmt == "parquet":
+                self._flush_row_group()
+                self._writer.close()
+            else:
+                self._file.close()
+            os.replace(self._tmp_path, self.rows_path)
+
+        header = dict(summary)
+        header["messages_file"] = {
+            "format": self.fmt,
+            "path": os.path.basename(self.rows_path),
+            "columns": COLUMNS,
+            "rows": self.rows_written,
+        }
+        if self.fmt == "jsonl":
+            header["messages_file"]["offset_every"] = OFFSET_EVERY
+            header["messages_file"]["offsets"] = self.offsets
+            header["messages_file"]["index_ranges"] = self.index_ranges
+
+        tmp_header = f"{self.header_path}.tmp"
+        with open(tmp_header, "w", encoding="utf-8") as f:
+            json.dump(header, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_header, self.header_path)
+        return self.header_path
+
+    def abort(self):
+        """Закрывает и удаляет недописанный файл строк."""
+        with self._lock:
+            if self.fmt == "parquet":
+                self._pending = []
+                self._writer.close()
+            else:
+                self._file.close()
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+
+def read_summary(header_path: str) -> Dict[str, Any]:
+    """Читает только сводку — без разбора результатов по сообщениям."""
+    with open(header_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _overlaps(lo: int, hi: int, index_start: int, index_stop: Optional[int]) -> bool:
+    """Пересекается ли [lo, hi] (включительно) с диапазоном номеров сообщений."""
+    return hi >= index_start and (index_stop is None or lo < index_stop)
+
+
+def iter_rows(header_path: str, columns: Optional[List[str]] = None,
+              start: int = 0, stop: Optional[int] = None,
+              index_start: int = 0, index_stop: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Итерирует строки результатов по сообщениям в порядке файла (по
+    отправителям, см. описание модуля).
+
+    Args:
+        header_path (str): Путь к JSON-заголовку.
+        columns (list[str], optional): Какие колонки вернуть (по умолчанию все).
+        start (int): Номер первой строки файла.
+        stop (int, optional): Номер строки файла, на которой остановиться (не включительно).
+        index_start (int): Только сообщения с index >= index_start.
+        index_stop (int, optional): Только сообщения с index < index_stop.
+
+    Фильтр по index пропускает блоки JSONL и группы строк Parquet, в которые
+    такие сообщения не попали, по их min/max.
+
+    Yields:
+        dict: Колонка → значение.
+    """
+    meta = read_summary(header_path)["messages_file"]
+    rows_path = os.path.join(os.path.dirname(header_path), meta["path"])
+    columns = columns or meta["columns"]
+    stop = meta["rows"] if stop is None else min(stop, meta["rows"])
+    if start >= stop:
+        return
+    by_index = index_start > 0 or index_stop is not None
+    read_columns = columns if not by_index or "index" in columns else columns + ["index"]
+
+    def select(values: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        if not by_index or _overlaps(values["index"], values["index"], index_start, index_stop):
+            yield {c: values[c] for c in columns}
+
+    if meta["format"] == "parquet":
+        import pyarrow.parquet as pq
+
+        pf = pq.ParquetFile(rows_path)
+        index_column = pf.schema_arrow.get_field_index("index")
+        row_base = 0
+        # Читаем только пересекающиеся с диапазонами группы строк и нужные колонки
+        for rg in range(pf.num_row_groups):
+            group = pf.metadata.row_group(rg)
+            n = group.num_rows
+            stats = group.column(index_column).statistics
+            wanted = not by_index or stats is None or not stats.has_min_max \
+                or _overlaps(stats.min, stats.max, index_start, index_stop)
+            if wanted and row_base + n > start and row_base < stop:
+                table = pf.read_row_group(rg, columns=read_columns)
+                lo, hi = max(start - row_base, 0), min(stop - row_base, n)
+                for values in table.slice(lo, hi - lo).to_pylist():
+                    yield from select(values)
+            row_base += n
+            if row_base >= stop:
+                break
+        return
+
+    every = meta["offset_every"]
+    with open(rows_path, "rb") as f:
+        for block in range(start // every, (stop - 1) // every + 1):
+            if by_index and not _overlaps(*meta["index_ranges"][block], index_start, index_stop):
+                continue
+            f.seek(meta["offsets"][block])
+            row = block * every
+            for line in f:
+                if row >= min(stop, (block + 1) * every):
+                    break
+                if row >= start:
+                    yield from select(dict(zip(meta["columns"], json.loads(line))))
+                row += 1
@@ -0,0 +1,256 @@
+"""
+Постоянная очередь заданий анализа на SQLite (режим WAL).
+
+Сервер API кладёт задание (входной файл уже сохранён на диск) и читает его
+статус; воркеры из job_pool.py атомарно забирают задания по одному и
+отмечают прогресс. Очередь переживает перезапуск: задания, которые
+выполнялись в момент падения, возвращаются в очередь при следующем старте
+пула — но не больше max_attempts раз: задание, которое снова и снова
+роняет воркер (память, сегфолт в модели), помечается failed. Воркеры раз
+в несколько секунд отмечаются в таблице workers — по ней сервер
+понимает, что обрабатывать очередь некому. Входной файл удаляется,
+как только задание завершено; завершённые задания вместе с результатами
+удаляются через result_ttl секунд (expire, его вызывает пул).
+
+Статусы: queued → running → done | failed.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    input_path TEXT NOT NULL,
+    options TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    stage TEXT,
+    result_path TEXT,
+    error TEXT,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs(status, submitted_at);
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+"""
+HEARTBEAT_TTL = 15.0  # секунд без отметки — воркер считается мёртвым
+MAX_ATTEMPTS = 3  # столько раз задание забирается воркером, прежде чем считаться губительным
+RESULT_TTL = 7 * 24 * 3600.0  # секунд хранения завершённых заданий и их результатов
+
+
+class QueueFullError(RuntimeError):
+    """В очереди уже max_pending заданий; retry_after — через сколько секунд повторить."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Job queue is full")
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """
+    Очередь заданий в файле SQLite; безопасна для нескольких процессов.
+
+    Атрибуты:
+        path (str): Файл базы.
+        jobs_dir (str): Каталог входных файлов и результатов заданий.
+        max_pending (int): Предельное число заданий в статусах queued и running.
+        max_attempts (int): Сколько раз задание может остаться без воркера.
+        result_ttl (float): Через сколько секунд после завершения задание удаляется (0 — никогда).
+    """
+
+    def __init__(self, jobs_dir: str, max_pending: int = 32, max_attempts: int = MAX_ATTEMPTS,
+                 result_ttl: float = RESULT_TTL):
+        self.jobs_dir = jobs_dir
+        self.path = os.path.join(jobs_dir, "jobs.sqlite3")
+        self.max_pending = max_pending
+        self.max_attempts = max(1, max_attempts)
+        self.result_ttl = result_ttl
+        self._local = threading.local()
+        os.makedirs(jobs_dir, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "attempts" not in columns:  # очередь, созданная до счётчика попыток
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def input_path(self, job_id: str, suffix: str = ".json") -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}_input{suffix}")
+
+    def result_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}_result.json")
+
+    @staticmethod
+    def new_id() -> str:
+        return uuid.uuid4().hex
+
+    # ---------------------- СЕРВЕР ----------------------
+    def check_capacity(self):
+        """
+        QueueFullError, если очередь уже полна. Вызывается до копирования
+        входного файла в jobs_dir: само тело запроса к этому моменту уже
+        принято (FastAPI разбирает multipart до вызова обработчика), но
+        копию и её удаление при отказе можно не делать.
+        """
+        conn = self._conn()
+        pending = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+        if pending >= self.max_pending:
+            raise QueueFullError(self._retry_after(conn, pending))
+
+    def submit(self, job_id: str, kind: str, input_path: str, options: Optional[Dict[str, Any]] = None):
+        """
+        Ставит задание в очередь.
+
+        Raises:
+            QueueFullError: Заданий в работе и в очереди уже max_pending.
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            pending = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+            if pending >= self.max_pending:
+                raise QueueFullError(self._retry_after(conn, pending))
+            conn.execute(
+                "INSERT INTO jobs (job_id, status, kind, input_path, options, submitted_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, kind, input_path, json.dumps(options or {}), time.time()))
+
+    def _retry_after(self, conn: sqlite3.Connection, pending: int) -> int:
+        """Оценка: среднее время последних заданий × очередь / число живых воркеров."""
+        row = conn.execute(
+            "SELECT AVG(finished_at - started_at) FROM (SELECT finished_at, started_at FROM jobs "
+            "WHERE status = 'done' ORDER BY finished_at DESC LIMIT 20)").fetchone()
+        avg = row[0] or 30.0
+        workers = max(1, self._alive_workers(conn))
+        return max(1, min(600, int(avg * (pending - self.max_pending + 1) / workers)))
+
+    def _alive_workers(self, conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT COUNT(*) FROM workers WHERE heartbeat > ?",
+                            (time.time() - HEARTBEAT_TTL,)).fetchone()[0]
+
+    def alive_workers(self) -> int:
+        return self._alive_workers(self._conn())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        if job["status"] == "queued":
+            job["position"] = self._conn().execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND submitted_at < ?",
+                (job["submitted_at"],)).fetchone()[0]
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        conn = self._conn()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"jobs": counts, "max_pending": self.max_pending, "workers": self._alive_workers(conn)}
+
+    # ---------------------- ВОРКЕРЫ ----------------------
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Забирает самое старое задание из очереди (атомарно) или возвращает None."""
+        conn = self._conn()
+        with conn:
+            row = conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, stage = 'starting', "
+                "attempts = attempts + 1 "
+                "WHERE job_id = (SELECT job_id FROM jobs WHERE status = 'queued' "
+                "ORDER BY submitted_at LIMIT 1) AND status = 'queued' RETURNING *",
+                (worker, time.time())).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        return job
+
+    def progress(self, job_id: str, progress: float, stage: str):
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET progress = ?, stage = ? WHERE job_id = ?",
+                         (round(progress, 3), stage, job_id))
+
+    def finish(self, job_id: str, result_path: str):
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET status = 'done', progress = 1, stage = 'done', result_path = ?, "
+                         "finished_at = ? WHERE job_id = ?", (result_path, time.time(), job_id))
+
+    def fail(self, job_id: str, error: str):
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE job_id = ?",
+                         (error, time.time(), job_id))
+
+    def heartbeat(self, worker: str):
+        with self._conn() as conn:
+            conn.execute("INSERT INTO workers (worker, heartbeat) VALUES (?, ?) "
+                         "ON CONFLICT(worker) DO UPDATE SET heartbeat = excluded.heartbeat",
+                         (worker, time.time()))
+
+    def forget_worker(self, worker: str):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM workers WHERE worker = ?", (worker,))
+
+    def requeue_orphans(self) -> Tuple[int, int]:
+        """
+        Возвращает в очередь задания, чей воркер перестал отмечаться (падение,
+        перезапуск). Задание, потерявшее воркер уже max_attempts раз, вероятно,
+        само его и роняет — оно помечается failed, чтобы не ронять следующий.
+
+        Returns:
+            (возвращено в очередь, помечено failed)
+        """
+        now = time.time()
+        orphaned = ("status = 'running' AND (worker IS NULL OR worker NOT IN "
+                    "(SELECT worker FROM workers WHERE heartbeat > ?))")
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            failed = conn.execute(
+                "UPDATE jobs SET status = 'failed', finished_at = ?, error = ? "
+                f"WHERE {orphaned} AND attempts >= ?",
+                (now, f"Worker died while processing the job ({self.max_attempts} attempts)",
+                 now - HEARTBEAT_TTL, self.max_attempts)).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', progress = 0, stage = NULL, worker = NULL, started_at = NULL "
+                f"WHERE {orphaned}", (now - HEARTBEAT_TTL,)).rowcount
+        return requeued, failed
+
+    def expire(self) -> int:
+        """
+        Удаляет задания, завершённые больше result_ttl секунд назад, вместе с
+        их входными файлами и результатами. Возвращает число удалённых заданий.
+        """
+        if not self.result_ttl:
+            return 0
+        conn = self._conn()
+        with conn:
+            rows = conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ? "
+                "RETURNING input_path, result_path", (time.time() - self.result_ttl,)).fetchall()
+        for row in rows:
+            for path in (row["input_path"], row["result_path"]):
+                if path and os.path.exists(path):
+                    os.remove(path)
+        return len(rows)
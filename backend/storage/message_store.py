@@ -0,0 +1,300 @@
+"""
+Результаты по сообщениям в бинарном формате фиксированной ширины (memory-mapped).
+
+Каталог <stem>_messages/ рядом с <stem>_analysis.json:
+    records.npy   — по записи на сообщение: время, смещение и длина текста,
+                    номер отправителя, оценки эмоций (float32, NaN — не оценено)
+    texts.bin     — тексты подряд в UTF-8
+    by_sender.npy — номера сообщений, сгруппированные по отправителям (по порядку)
+    by_<эмоция>.npy — номера сообщений по убыванию оценки эмоции
+    by_sender_<эмоция>.npy — то же внутри каждой группы отправителя
+                    (границы групп — как у by_sender)
+    meta.json     — отправители, границы групп by_sender, формат времени
+
+Файлы открываются через np.load(mmap_mode='r'): страница выборки читает
+только нужные записи, поэтому время ответа не зависит от размера диалога.
+Фильтры, которые покрывает индекс (участник, диапазон времени при
+упорядоченных временах, порог эмоции при сортировке по ней — в том числе
+у одного участника), стоят O(log n). Прочие условия проверяются блоками
+по ходу выборки, но не больше чем по SCAN_LIMIT кандидатам: такие запросы
+к большому диалогу отклоняются (UnindexedQueryError, на сервере — 400),
+их нужно сузить индексируемым фильтром.
+"""
+import json
+import os
+import shutil
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from analyzers.dialog_store import NO_TIME, DialogStore, _TimeCodec, to_epoch
+
+EMOTIONS = ["negative", "neutral", "positive"]
+RECORD = np.dtype([
+    ("time", "<i8"),
+    ("text_offset", "<i8"),
+    ("text_length", "<u4"),
+    ("sender", "<i4"),
+    ("scores", "<f4", (len(EMOTIONS),)),
+])
+FORMAT_VERSION = 2  # 2: индексы by_sender_<эмоция>
+SCAN_BLOCK = 4096  # номеров за один шаг проверки неиндексированных условий
+SCAN_LIMIT = 200_000  # предел кандидатов для проверки неиндексированных условий
+
+
+class UnindexedQueryError(ValueError):
+    """Сочетание фильтров без индекса по слишком большому числу сообщений."""
+
+
+class StoreFormatError(ValueError):
+    """Хранилище записано другой версией формата — его нужно пересобрать (batch.py --format mmap)."""
+
+
+def store_dir(out_dir: str, stem: str) -> str:
+    return os.path.join(out_dir, f"{stem}_messages")
+
+
+def write_message_store(store: DialogStore, path: str) -> str:
+    """
+    Сохраняет сообщения и store.results['emotion_scores'] в каталог path
+    (атомарно: пишется во временный каталог и подменяет старый).
+    """
+    n = len(store)
+    records = np.zeros(n, dtype=RECORD)
+    records["time"] = store.times
+    records["text_offset"] = store.offsets[:-1]
+    records["text_length"] = np.diff(store.offsets)
+    records["sender"] = store.sender_ids
+    scores = store.results.get("emotion_scores")
+    records["scores"] = scores if scores is not None else np.nan
+
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "records.npy"), records)
+    with open(os.path.join(tmp_path, "texts.bin"), "wb") as f:
+        f.write(store.text_buffer)
+
+    by_sender = np.argsort(store.sender_ids, kind="stable").astype(np.int32)
+    # Сообщения без отправителя (-1) идут первыми — границы групп с учётом них
+    counts = np.bincount(store.sender_ids + 1, minlength=len(store.senders) + 1)
+    starts = np.concatenate([[0], np.cumsum(counts)]).tolist()
+    np.save(os.path.join(tmp_path, "by_sender.npy"), by_sender)
+    for k, emotion in enumerate(EMOTIONS):
+        # По убыванию оценки, неоценённые (NaN) — в конце
+        key = np.nan_to_num(records["scores"][:, k], nan=-np.inf)
+        np.save(os.path.join(tmp_path, f"by_{emotion}.npy"), np.argsort(-key, kind="stable").astype(np.int32))
+        # Группы отправителей в порядке by_sender, внутри — по убыванию оценки
+        np.save(os.path.join(tmp_path, f"by_sender_{emotion}.npy"),
+                np.lexsort((-key, store.sender_ids)).astype(np.int32))
+
+    valid = store.times[store.times != NO_TIME]
+    codec = store._time_codec
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "dialog_id": store.dialog_id,
+        "title": store.title,
+        "messages": n,
+        "senders": store.senders,
+        # границы группы отправителя i в by_sender: sender_starts[i + 1]..sender_starts[i + 2]
+        "sender_starts": starts,
+        "emotions": EMOTIONS,
+        # Время по номеру сообщения не убывает — диапазон ищется двоичным поиском
+        "time_sorted": bool(len(valid) == n and np.all(np.diff(store.times) >= 0)),
+        "time_format": {"sep": codec.sep, "timespec": codec.timespec},
+    }
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    if os.path.exists(path):
+        old_path = f"{path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+    else:
+        os.replace(tmp_path, path)
+    return path
+
+
+class MessageStore:
+    """
+    Чтение результатов по сообщениям из каталога write_message_store.
+
+    Атрибуты:
+        path (str): Каталог хранилища.
+        meta (dict): Содержимое meta.json.
+        records (np.memmap): Записи сообщений (RECORD).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format_version") != FORMAT_VERSION:
+            raise StoreFormatError(f"Хранилище {path}: формат {self.meta.get('format_version')}, "
+                                   f"нужен {FORMAT_VERSION} — пересоберите его (batch.py --format mmap)")
+        self.records = np.load(os.path.join(path, "records.npy"), mmap_mode="r")
+        self.by_sender = np.load(os.path.join(path, "by_sender.npy"), mmap_mode="r")
+        self.by_emotion = {e: np.load(os.path.join(path, f"by_{e}.npy"), mmap_mode="r") for e in EMOTIONS}
+        self.by_sender_emotion = {e: np.load(os.path.join(path, f"by_sender_{e}.npy"), mmap_mode="r")
+                                  for e in EMOTIONS}
+        self._texts = np.memmap(os.path.join(path, "texts.bin"), dtype=np.uint8, mode="r") \
+            if os.path.getsize(os.path.join(path, "texts.bin")) else np.zeros(0, dtype=np.uint8)
+        self._codec = _TimeCodec()
+        self._codec.sep = self.meta["time_format"]["sep"]
+        self._codec.timespec = self.meta["time_format"]["timespec"]
+
+    def __len__(self) -> int:
+        return self.meta["messages"]
+
+    def _row(self, i: int) -> Dict[str, Any]:
+        rec = self.records[i]
+        start = int(rec["text_offset"])
+        sid = int(rec["sender"])
+        seconds = int(rec["time"])
+        return {
+            "index": int(i),
+            "sender": self.meta["senders"][sid] if sid >= 0 else None,
+            "time": None if seconds == NO_TIME else self._codec.format(seconds),
+            "text": bytes(self._texts[start:start + int(rec["text_length"])]).decode("utf-8"),
+            "emotion_scores": {e: (None if np.isnan(s) else round(float(s), 3))
+                               for e, s in zip(EMOTIONS, rec["scores"].tolist())},
+        }
+
+    # ---------------------- ВЫБОРКА ----------------------
+    def _sender_id(self, sender: str) -> int:
+        try:
+            return self.meta["senders"].index(sender)
+        except ValueError:
+            raise KeyError(f"Нет участника {sender!r}")
+
+    @staticmethod
+    def _bisect(n: int, before) -> int:
+        """Первый номер i < n, для которого before(i) ложно (before монотонно)."""
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if before(mid):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _score_prefix(self, order: np.ndarray, k: int, min_score: float) -> int:
+        """Сколько первых номеров order (по убыванию оценки k) имеют оценку >= min_score."""
+        return self._bisect(len(order), lambda i: self.records[int(order[i])]["scores"][k] >= min_score)
+
+    def _time_position(self, seconds: int) -> int:
+        """Первый номер сообщения со временем >= seconds (при упорядоченных временах)."""
+        # Поэлементный двоичный поиск: np.searchsorted скопировал бы всю колонку
+        return self._bisect(len(self), lambda i: int(self.records[i]["time"]) < seconds)
+
+    def query(self, offset: int = 0, limit: int = 50, sender: Optional[str] = None,
+              start: Any = None, end: Any = None, emotion: Optional[str] = None,
+              min_score: Optional[float] = None, sort: str = "index") -> Dict[str, Any]:
+        """
+        Страница сообщений.
+
+        Args:
+            offset, limit: Смещение и размер страницы.
+            sender: Только сообщения участника.
+            start, end: Диапазон времени [start, end) — ISO-строки или секунды Unix.
+            emotion, min_score: Только сообщения с оценкой emotion >= min_score.
+            sort: 'index' — по порядку в диалоге, иначе название эмоции —
+                  по убыванию её оценки (top-N «самых негативных» — sort='negative').
+
+        Returns:
+            dict: 'messages' — страница, 'total' — число подходящих сообщений,
+                  если оно известно без полного прохода (иначе None), 'has_more'.
+
+        Raises:
+            UnindexedQueryError: Условия без индекса пришлось бы проверять
+                                 больше чем у SCAN_LIMIT сообщений.
+        """
+        if sort != "index" and sort not in EMOTIONS:
+            raise ValueError(f"sort: 'index' или одна из {EMOTIONS}")
+        if emotion is not None and emotion not in EMOTIONS:
+            raise ValueError(f"emotion: одна из {EMOTIONS}")
+        if min_score is not None and emotion is None:
+            emotion = sort if sort in EMOTIONS else "negative"
+        lo_t = None if start is None else to_epoch(start)
+        hi_t = None if end is None else to_epoch(end)
+        sid = None if sender is None else self._sender_id(sender)
+
+        # 1. Кандидаты из индекса
+        need_sender = need_time = need_score = False
+        if sort in EMOTIONS:
+            k = EMOTIONS.index(sort)
+            if sid is not None:
+                starts = self.meta["sender_starts"]
+                candidates = self.by_sender_emotion[sort][starts[sid + 1]:starts[sid + 2]]
+            else:
+                candidates = self.by_emotion[sort]
+                need_sender = sid is not None
+            if emotion == sort and min_score is not None:
+                candidates = candidates[:self._score_prefix(candidates, k, min_score)]
+            else:
+                need_score = min_score is not None
+            need_time = lo_t is not None or hi_t is not None
+        else:
+            if sid is not None:
+                starts = self.meta["sender_starts"]
+                candidates = self.by_sender[starts[sid + 1]:starts[sid + 2]]
+            else:
+                candidates = None  # все номера по порядку
+            if (lo_t is not None or hi_t is not None) and self.meta["time_sorted"]:
+                i0 = 0 if lo_t is None else self._time_position(lo_t)
+                i1 = len(self) if hi_t is None else self._time_position(hi_t)
+                if candidates is None:
+                    candidates = range(i0, i1)  # без материализации: страница — срез диапазона
+                else:
+                    candidates = candidates[np.searchsorted(candidates, i0):np.searchsorted(candidates, i1)]
+            else:
+                need_time = lo_t is not None or hi_t is not None
+            need_score = min_score is not None
+            if candidates is None:
+                candidates = range(len(self))
+
+        # 2. Прочие условия — блоками, пока не наберётся страница
+        if not (need_sender or need_time or need_score):
+            page = candidates[offset:offset + limit]
+            return {"messages": [self._row(int(i)) for i in page], "total": len(candidates),
+                    "has_more": offset + limit < len(candidates)}
+
+        if len(candidates) > SCAN_LIMIT:
+            unindexed = [name for name, need in (("sender", need_sender), ("start/end", need_time),
+                                                 ("min_score", need_score)) if need]
+            raise UnindexedQueryError(
+                f"Фильтры {', '.join(unindexed)} при sort={sort!r} не покрыты индексом, а кандидатов "
+                f"{len(candidates)} > {SCAN_LIMIT}: сузьте выборку участником, временем "
+                f"(sort=index) или порогом той же эмоции, что и sort")
+        k_score = EMOTIONS.index(emotion) if need_score else None
+        matched: List[int] = []
+        skipped = 0
+        pos = 0
+        while pos < len(candidates) and len(matched) <= limit:
+            block = np.asarray(candidates[pos:pos + SCAN_BLOCK], dtype=np.int64)
+            pos += SCAN_BLOCK
+            recs = self.records[block]
+            mask = np.ones(len(block), dtype=bool)
+            if need_sender:
+                mask &= recs["sender"] == sid
+            if need_time:
+                mask &= recs["time"] != NO_TIME
+                if lo_t is not None:
+                    mask &= recs["time"] >= lo_t
+                if hi_t is not None:
+                    mask &= recs["time"] < hi_t
+            if need_score:
+                mask &= recs["scores"][:, k_score] >= min_score
+            hits = block[mask]
+            take = min(len(hits), max(0, offset - skipped))
+            skipped += take
+            matched.extend(int(i) for i in hits[take:take + limit + 1 - len(matched)])
+        return {"messages": [self._row(i) for i in matched[:limit]], "total": None,
+                "has_more": len(matched) > limit}
+
+    def iter_rows(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self._row(i)
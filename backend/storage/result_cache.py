@@ -0,0 +1,152 @@
+"""
+Кэш результатов анализа целых диалогов.
+
+Ключ — канонический хеш содержимого диалога плюс версии компонентов
+анализа (модель эмоций, словари DISC и тем). Совет LLM хранится в той же
+записи отдельно для каждой версии советчика (эмбеддинги, индекс, LLM и
+параметры генерации), поэтому смена LLM пересчитывает только совет.
+
+Каждая запись — отдельный JSON-файл <key>.json в каталоге кэша, пишется
+атомарно. Общий размер ограничен max_bytes: при переполнении удаляются
+записи, к которым дольше всего не обращались (mtime обновляется при чтении).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+def _canonical(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def version_hash(versions: Dict[str, Any]) -> str:
+    """Короткий хеш словаря версий компонентов."""
+    return hashlib.sha256(_canonical(versions)).hexdigest()[:16]
+
+
+def dialog_fingerprint(data: Dict[str, Any]) -> str:
+    """
+    Канонический хеш диалога (dict или DialogStore): сообщения хешируются
+    по одному (без сборки одной огромной строки), остальные поля — одним
+    блоком. Порядок ключей и форматирование исходного файла на хеш не влияют.
+    """
+    h = hashlib.sha256()
+    if hasattr(data, "iter_messages"):
+        # DialogStore: те же сообщения, восстановленные из колонок
+        meta, messages = {"dialog_id": data.dialog_id, "title": data.title}, data.iter_messages()
+    else:
+        meta, messages = {k: v for k, v in data.items() if k != "messages"}, data.get("messages", [])
+    h.update(_canonical(meta))
+    for msg in messages:
+        h.update(_canonical(msg))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+def file_version(*paths: str) -> str:
+    """Хеш исходников — словари DISC и тем заданы прямо в коде анализаторов."""
+    h = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Дисковый кэш результатов MainAnalyzer.analyze.
+
+    Атрибуты:
+        cache_dir (str): Каталог с записями.
+        max_bytes (int): Предельный суммарный размер записей.
+        hits (int), misses (int): Счётчики обращений за время жизни объекта.
+    """
+
+    def __init__(self, cache_dir: str = "rag_cache/results", max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        # Размеры записей держим в памяти, чтобы не обходить каталог на каждой записи
+        self._sizes = {}
+        for name in os.listdir(cache_dir):
+            if name.endswith(".json"):
+                self._sizes[name[:-5]] = os.path.getsize(os.path.join(cache_dir, name))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    @staticmethod
+    def make_key(data: Dict[str, Any], analysis_versions: Dict[str, Any]) -> str:
+        return hashlib.sha256(f"{dialog_fingerprint(data)}:{version_hash(analysis_versions)}"
+                              .encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Запись {'result': ..., 'advice': {версия советчика: совет}} или None."""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)  # отметка для вытеснения по давности обращения
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key: str, result: Dict[str, Any], advice: Optional[Dict[str, str]] = None):
+        """Сохраняет результат анализа (без поля 'advice') и советы по версиям советчика."""
+        entry = {
+            "created_at": time.time(),
+            "result": {k: v for k, v in result.items() if k != "advice"},
+            "advice": advice or {},
+        }
+        path = self._path(key)
+        tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._sizes[key] = size
+            self._evict()
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        if total <= self.max_bytes:
+            return
+        by_age = []
+        for key in self._sizes:
+            try:
+                by_age.append((os.path.getmtime(self._path(key)), key))
+            except OSError:
+                by_age.append((0.0, key))
+        for _, key in sorted(by_age):
+            if total <= self.max_bytes:
+                break
+            total -= self._sizes.pop(key)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._sizes):
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self._sizes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._sizes), "bytes": sum(self._sizes.values()),
+                    "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,168 @@
+"""
+Распределение CPU-потоков между движками и процессами.
+
+Ядра процесса определяются с учётом привязки (sched_getaffinity) и квоты
+cgroup (cpu.max в v2, cfs_quota_us / cfs_period_us в v1). Если на хосте
+работают несколько воркеров, ядра делятся между ними поровну, а внутри
+воркера каждый движок получает свою долю:
+
+    torch  — intra-op потоки PyTorch (XLM-R, эмбеддинги, transformers)
+    llm    — n_threads llama.cpp
+    faiss  — пул OpenMP FAISS
+
+Доли перекрываются (в сумме могут быть больше 1): движки в основном
+работают по очереди, а одновременно — лишь частично. Inter-op потоки
+PyTorch — отдельное число (по умолчанию 1: параллелизм между этапами уже
+даёт граф анализа).
+
+Настройка окружением:
+    WEBPSYCHO_CPUS=8                          # вместо определённого числа ядер
+    WEBPSYCHO_THREADS=torch=0.5,llm=0.75,faiss=0.25,interop=1
+    WEBPSYCHO_PIN_WORKERS=1                   # привязать воркеры к своим ядрам
+"""
+import math
+import os
+import sys
+from typing import Dict, List, Optional
+
+CPUS_ENV = "WEBPSYCHO_CPUS"
+THREADS_ENV = "WEBPSYCHO_THREADS"
+PIN_ENV = "WEBPSYCHO_PIN_WORKERS"
+DEFAULT_SHARES = {"torch": 0.5, "llm": 0.75, "faiss": 0.25}
+DEFAULT_INTEROP = 1
+# Переменные, которые читают OpenMP/BLAS при первой инициализации пула
+OMP_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def _cgroup_cpus() -> Optional[float]:
+    """Квота CPU из cgroup (в ядрах) или None, если она не задана."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "r") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "r") as f:
+            period = int(f.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def allowed_cpus() -> List[int]:
+    """Номера ядер, на которых процессу разрешено работать."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # нет на macOS
+        return list(range(os.cpu_count() or 1))
+
+
+def available_cores() -> int:
+    """Ядра, доступные процессу: WEBPSYCHO_CPUS или min(привязка, квота cgroup)."""
+    if os.environ.get(CPUS_ENV):
+        return max(1, int(os.environ[CPUS_ENV]))
+    cores = len(allowed_cpus())
+    quota = _cgroup_cpus()
+    if quota is not None:
+        cores = min(cores, math.ceil(quota))
+    return max(1, cores)
+
+
+def parse_shares(spec: str) -> Dict[str, float]:
+    """'torch=0.5,llm=0.75,interop=2' → словарь долей (interop — число потоков)."""
+    shares = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        engine, _, value = part.partition("=")
+        shares[engine.strip()] = float(value)
+    return shares
+
+
+class ThreadBudget:
+    """
+    Число потоков каждого движка для одного воркера.
+
+    Атрибуты:
+        cores (int): Ядра воркера (доля ядер хоста при нескольких воркерах).
+        shares (dict): Доли ядер по движкам.
+        interop (int): Inter-op потоки PyTorch.
+        cpus (list): Ядра, к которым воркер привязывается при pin().
+    """
+
+    def __init__(self, cores: Optional[int] = None, workers: int = 1, index: int = 0,
+                 shares: Optional[Dict[str, float]] = None):
+        shares = {**DEFAULT_SHARES, **parse_shares(os.environ.get(THREADS_ENV, "")), **(shares or {})}
+        self.interop = max(1, int(shares.pop("interop", DEFAULT_INTEROP)))
+        self.shares = shares
+        total = cores or available_cores()
+        workers = max(1, workers)
+        self.cores = max(1, total // workers)
+        # Непересекающийся срез разрешённых ядер для воркера index
+        cpus = allowed_cpus()
+        per_worker = max(1, len(cpus) // workers)
+        start = (index % workers) * per_worker
+        self.cpus = cpus[start:start + per_worker] or cpus
+
+    def threads(self, engine: str) -> int:
+        return max(1, int(self.cores * self.shares.get(engine, 1.0)))
+
+    def as_dict(self) -> Dict[str, int]:
+        return {**{engine: self.threads(engine) for engine in self.shares},
+                "interop": self.interop, "cores": self.cores}
+
+    # ---------------------- ПРИМЕНЕНИЕ ----------------------
+    def pin(self):
+        """Привязывает процесс к своему срезу ядер (воркеры не мешают друг другу кэшами)."""
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, self.cpus)
+
+    def set_omp_env(self):
+        """OMP/BLAS-переменные для ещё не инициализированных пулов (не перезаписывает заданные)."""
+        for var in OMP_VARS:
+            os.environ.setdefault(var, str(self.threads("torch")))
+
+    def apply_torch(self):
+        """Потоки PyTorch; вызывается перед загрузкой torch-моделей."""
+        import torch
+
+        torch.set_num_threads(self.threads("torch"))
+        try:
+            torch.set_num_interop_threads(self.interop)
+        except RuntimeError:
+            pass  # inter-op задаётся только до первой параллельной операции
+
+    def apply_faiss(self):
+        faiss = sys.modules.get("faiss")
+        if faiss is not None:
+            faiss.omp_set_num_threads(self.threads("faiss"))
+
+
+_budget: Optional[ThreadBudget] = None
+
+
+def configure(workers: int = 1, index: int = 0, cores: Optional[int] = None,
+              pin: Optional[bool] = None) -> ThreadBudget:
+    """
+    Задаёт бюджет процесса: число воркеров на хосте и номер этого воркера.
+    Вызывается при старте процесса, до загрузки моделей.
+    """
+    global _budget
+    _budget = ThreadBudget(cores=cores, workers=workers, index=index)
+    if pin is None:
+        pin = os.environ.get(PIN_ENV) == "1"
+    if pin and workers > 1:
+        _budget.pin()
+    _budget.set_omp_env()
+    return _budget
+
+
+def current() -> ThreadBudget:
+    """Бюджет процесса (по умолчанию — один воркер на все доступные ядра)."""
+    global _budget
+    if _budget is None:
+        _budget = ThreadBudget()
+    return _budget